@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gwm_crm.middleware.MetricsMiddleware',
+    'gwm_crm.middleware.QueryInspectorMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -86,6 +88,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # migrations aren't kept in the repo, so tests build tables from the models
+        'TEST': {'MIGRATE': False},
     }
 }
 
@@ -134,6 +138,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media is stored once per distinct content, see gwm_crm/storage.py
+STORAGES = {
+    'default': {
+        'BACKEND': 'gwm_crm.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 # AWS_ACCESS_KEY_ID = 'your-key'
 # AWS_SECRET_ACCESS_KEY = 'your-secret'
@@ -144,7 +158,7 @@ AUTH_USER_MODEL = 'authentication.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -156,6 +170,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'gwm_crm.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
     # 'DEFAULT_PERMISSION_CLASSES': [
     #     'rest_framework.permissions.IsAuthenticated',
     # ],
@@ -165,10 +181,97 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_REFRESH_SERIALIZER': 'authentication.authentication.UserTokenRefreshSerializer',
 }
 
 CORS_ALLOW_ALL_ORIGINS = True 
 
+# Upper bound for ?page_size= on list endpoints
+PAGINATION_MAX_PAGE_SIZE = 500
+
+# Cached company details are invalidated by the process that saves the
+# change, so every worker has to share the cache: set REDIS_URL whenever
+# more than one process serves requests. The per-process fallback is for
+# the development server (`manage.py check --deploy` warns about it).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'gwm-crm',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
+# Serialized company detail documents, invalidated by gwm_crm.signals
+COMPANY_DETAIL_CACHE_ALIAS = 'default'
+COMPANY_DETAIL_CACHE_TIMEOUT = 600
+
+# Users resolved by CachedJWTAuthentication. With the per-process cache
+# above, a change reaches other workers after this many seconds; point
+# the alias at a shared cache to make it immediate.
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Background company imports. Set IMPORT_JOB_IN_PROCESS_WORKERS to 0 to
+# leave jobs to `manage.py run_import_worker` instead.
+IMPORT_JOB_IN_PROCESS_WORKERS = 2
+IMPORT_JOB_BATCH_SIZE = 2000
+IMPORT_JOB_STALE_SECONDS = 300
+
+# Send meeting notifications only after the saving transaction commits.
+MEETING_NOTIFICATIONS_ON_COMMIT = False
+
+# Live notification stream (crm/api/notifications/stream/, ASGI only).
+# Streams poll the database this often for rows created by other processes.
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = 15
+NOTIFICATION_STREAM_POLL_SECONDS = 30
+# Lifetime of the single-use ?ticket= EventSource clients open the stream with
+NOTIFICATION_STREAM_TICKET_SECONDS = 30
+
+# `manage.py prune_notifications` removes seen notifications older than this
+NOTIFICATION_RETENTION_DAYS = 90
+NOTIFICATION_RETENTION_BATCH_SIZE = 1000
+
+# Chunked uploads (crm/api/uploads/). Keep the session dir on the same
+# filesystem as MEDIA_ROOT so completed files are moved, not copied.
+UPLOAD_SESSION_DIR = os.path.join(BASE_DIR, 'upload_sessions')
+UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+UPLOAD_MAX_CHUNK_SIZE = 32 * 1024 ** 2
+UPLOAD_SESSION_TTL_HOURS = 24
+
+# File downloads: None streams through Django; 'x-accel' (nginx, files under
+# DOWNLOAD_ACCEL_PREFIX as an internal location) or 'x-sendfile' hands the
+# transfer to the front proxy after Django has checked permissions.
+DOWNLOAD_SENDFILE_MODE = None
+DOWNLOAD_ACCEL_PREFIX = '/protected-media/'
+
+# Upper bound on items per request to the <resource>/bulk/ endpoints
+BULK_MAX_ITEMS = 5000
+
+# SQL inspection per request (gwm_crm.middleware.QueryInspectorMiddleware).
+# 'strict' raises when a view goes over its query_budget, failing the test
+# that made the request; 'sample' inspects QUERY_INSPECTOR_SAMPLE_RATE of
+# requests and only logs; None turns it off. The test runner below switches
+# to strict unless the environment variable is set. Set
+# QUERY_INSPECTOR_REPORT_PATH to collect a run for `manage.py query_report`.
+QUERY_INSPECTOR_MODE = os.environ.get('QUERY_INSPECTOR_MODE') or None
+QUERY_INSPECTOR_SAMPLE_RATE = 0.01
+QUERY_INSPECTOR_REPEAT_THRESHOLD = 5
+QUERY_INSPECTOR_REPORT_PATH = os.environ.get('QUERY_INSPECTOR_REPORT_PATH')
+TEST_RUNNER = 'gwm_crm.test_runner.QueryBudgetTestRunner'
+
+# Per-process request metrics (gwm_crm.middleware.MetricsMiddleware),
+# scraped by admins from /metrics/ in the Prometheus text format
+METRICS_ENABLED = True
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Bearer': {
@@ -22,6 +22,8 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 
+from gwm_crm.views import MetricsView, media_blob
+
 
 from django.urls import re_path
 from drf_yasg.views import get_schema_view
@@ -40,10 +42,14 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('crm/', include('gwm_crm.urls')), 
     path('auth/', include('authentication.urls')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
 
 if settings.DEBUG:
+    urlpatterns += [
+        re_path(rf'^{settings.MEDIA_URL.lstrip("/")}cas/(?P<digest>[0-9a-f]{{64}})/(?P<filename>[^/]+)$', media_blob),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+JWT authentication that resolves users from a short-lived cache instead
+of loading the row on every request.
+
+Entries are keyed by user id and the token's ``ver`` claim. Saving a user
+drops their entries (authentication.signals); changing is_active,
+is_staff, is_superuser or the password also bumps ``token_version``,
+which revokes the tokens issued before. With a per-process cache, other
+workers see a change once AUTH_USER_CACHE_TIMEOUT has passed.
+
+Views that set ``trust_token_claims = True`` skip the user lookup on
+safe methods and get a ClaimsUser built from the signed claims, once
+the token's version has been checked against the cached current one.
+Refreshing a token checks its version too (UserTokenRefreshSerializer).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User
+
+VERSION_CLAIM = 'ver'
+# claims copied into every token, used by trusted views
+USER_CLAIMS = ('is_staff', 'is_superuser')
+
+
+def _cache():
+    return caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')]
+
+
+def _key(user_id, version):
+    return f'auth-user:{user_id}:{version}'
+
+
+def _state_key(user_id):
+    return f'auth-user:{user_id}:state'
+
+
+def cached_user(user_id, version):
+    """The user with its company, from the cache when the version matches"""
+    cache = _cache()
+    user = cache.get(_key(user_id, version))
+    if user is None:
+        user = User.objects.select_related('company').filter(pk=user_id).first()
+        if user is not None:
+            timeout = getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60)
+            cache.set(_state_key(user_id), (user.token_version, user.is_active), timeout=timeout)
+            if user.token_version == version:
+                cache.set(_key(user_id, version), user, timeout=timeout)
+    return user
+
+
+def check_token_version(user_id, version, state):
+    """Raises AuthenticationFailed unless ``state``, (token_version, is_active), accepts the token"""
+    current, is_active = state
+    if not is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    if current != version:
+        raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+
+
+def invalidate(user_id, *versions):
+    _cache().delete_many([_key(user_id, version) for version in versions] + [_state_key(user_id)])
+
+
+class UserRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the version and role claims"""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[VERSION_CLAIM] = user.token_version
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+
+class ClaimsUser:
+    """
+    The request.user of trusted views: the id and the claims of the token.
+    Any other user attribute raises instead of reading as blank, so a view
+    that needs more can't set trust_token_claims by mistake.
+    """
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+
+    def __init__(self, user_id, validated_token):
+        self.pk = self.id = User._meta.pk.to_python(user_id)
+        self.token_version = validated_token[VERSION_CLAIM]
+        for claim in USER_CLAIMS:
+            setattr(self, claim, validated_token[claim])
+
+    def __getattr__(self, name):
+        raise AttributeError(f"{name!r} is not in the token; views using it can't set trust_token_claims")
+
+    def __repr__(self):
+        return f'<ClaimsUser {self.pk}>'
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        view = (getattr(request, 'parser_context', None) or {}).get('view')
+        if getattr(view, 'trust_token_claims', False) and request.method in SAFE_METHODS:
+            user = self.user_from_claims(validated_token)
+            if user is not None:
+                return user, validated_token
+        return self.get_user(validated_token), validated_token
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+    def get_user(self, validated_token):
+        version = validated_token.get(VERSION_CLAIM, 0)
+        user = cached_user(self._user_id(validated_token), version)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        check_token_version(user.pk, version, (user.token_version, user.is_active))
+        return user
+
+    def user_from_claims(self, validated_token):
+        """
+        A ClaimsUser for the token. None for older tokens without the
+        claims, and when the user's current version isn't cached, so the
+        caller loads the user (which caches it).
+        """
+        if VERSION_CLAIM not in validated_token or any(claim not in validated_token for claim in USER_CLAIMS):
+            return None
+        user_id = self._user_id(validated_token)
+        state = _cache().get(_state_key(user_id))
+        if state is None:
+            return None
+        check_token_version(user_id, validated_token[VERSION_CLAIM], state)
+        return ClaimsUser(user_id, validated_token)
+
+
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refuses refresh tokens of inactive users and tokens issued before the last revocation"""
+    token_class = UserRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        version = refresh.get(VERSION_CLAIM, 0)
+        user = cached_user(refresh.get(api_settings.USER_ID_CLAIM), version)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        check_token_version(user.pk, version, (user.token_version, user.is_active))
+        return super().validate(attrs)
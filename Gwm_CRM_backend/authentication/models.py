@@ -10,6 +10,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     date_joined = models.DateTimeField(auto_now_add=True)
+    # bumped when a change must revoke issued tokens, see authentication.signals
+    token_version = models.PositiveIntegerField(default=0)
     
     company = models.ForeignKey(
         Company,
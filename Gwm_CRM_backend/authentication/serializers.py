@@ -2,8 +2,9 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from .models import User
 from gwm_crm.models import Company
+from gwm_crm.mixins import SparseFieldsMixin
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
     company = serializers.PrimaryKeyRelatedField(read_only=True)
     company_name = serializers.CharField(source='company.name', read_only=True)
@@ -15,7 +16,7 @@ class UserSerializer(serializers.ModelSerializer):
     def get_full_name(self, obj):
         return f"{obj.first_name} {obj.last_name}"
     
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     company_id = serializers.PrimaryKeyRelatedField(
         queryset=Company.objects.all(),
         source='company', 
@@ -56,7 +57,7 @@ class AssignCompanySerializer(serializers.Serializer):
         write_only=True
     )
 
-class UserDetailSerializer(serializers.Serializer):
+class UserDetailSerializer(SparseFieldsMixin, serializers.Serializer):
     company_name = serializers.CharField(source='company.name', read_only=True)
     full_name = serializers.SerializerMethodField()
     
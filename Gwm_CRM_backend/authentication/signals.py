@@ -0,0 +1,34 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import invalidate
+from .models import User
+
+# changing any of these revokes the tokens issued before
+REVOKING_FIELDS = ('is_active', 'is_staff', 'is_superuser', 'password')
+
+
+@receiver(pre_save, sender=User)
+def remember_revoking_fields(sender, instance, update_fields=None, **kwargs):
+    instance._revoking_values = None
+    if instance.pk is None or instance._state.adding:
+        return
+    if update_fields is not None and not set(update_fields) & set(REVOKING_FIELDS):
+        return
+    instance._revoking_values = User.objects.filter(pk=instance.pk).values_list(*REVOKING_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, created, **kwargs):
+    version = instance.token_version
+    old = getattr(instance, '_revoking_values', None)
+    if old is not None and old != tuple(getattr(instance, field) for field in REVOKING_FIELDS):
+        User.objects.filter(pk=instance.pk).update(token_version=F('token_version') + 1)
+        instance.token_version = version + 1
+    invalidate(instance.pk, version, instance.token_version)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    invalidate(instance.pk, instance.token_version)
@@ -1,3 +1,45 @@
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .authentication import CachedJWTAuthentication, UserRefreshToken
+from .models import User
+
+COUNT_URL = '/crm/api/notifications/unread/count/'
+
+
+class TokenVersionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='token@example.com', password=None, first_name='A', last_name='B')
+        self.refresh = UserRefreshToken.for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+    def test_trusted_claims_skip_the_user_lookup_once_cached(self):
+        self.assertEqual(self.client.get(COUNT_URL).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(COUNT_URL).status_code, 200)
+
+    def test_trusted_user_only_has_what_the_token_carries(self):
+        self.assertEqual(self.client.get(COUNT_URL).status_code, 200)
+        authentication = CachedJWTAuthentication()
+        user = authentication.user_from_claims(authentication.get_validated_token(str(self.refresh.access_token).encode()))
+        self.assertEqual((user.pk, user.is_staff, user.is_authenticated), (self.user.pk, False, True))
+        with self.assertRaisesMessage(AttributeError, "'email' is not in the token"):
+            user.email
+
+    def test_trusted_claims_are_refused_after_deactivation(self):
+        self.assertEqual(self.client.get(COUNT_URL).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(COUNT_URL).status_code, 401)
+
+    def test_refresh_checks_the_token_version(self):
+        response = self.client.post('/auth/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.set_password('changed')
+        self.user.save()
+        response = self.client.post('/auth/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
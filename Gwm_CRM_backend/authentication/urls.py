@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import TokenRefreshView
 
 from .views import RegisterView, LoginView, UserProfileView, AssignCompanyView, UserViewSet
 
@@ -10,6 +11,7 @@ urlpatterns = [
     path('', include(router.urls)),
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('profile/', UserProfileView.as_view(), name='profile'),
     path('assign-company/', AssignCompanyView.as_view(), name='assign-company'),
     # path('users/', UserViewSet, name='user-list'),
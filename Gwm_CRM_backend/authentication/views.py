@@ -1,12 +1,13 @@
 from django.shortcuts import render
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import viewsets, status, filters
 
 from .serializers import RegisterSerializer, LoginSerializer, UserSerializer, AssignCompanySerializer, UserDetailSerializer
+from .authentication import UserRefreshToken
 from .models import User
+from gwm_crm.mixins import EagerLoadingMixin, SparseFieldsViewMixin
 
 class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
@@ -16,7 +17,7 @@ class RegisterView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
         
-        refresh = RefreshToken.for_user(user)
+        refresh = UserRefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'refresh': str(refresh),
@@ -31,7 +32,7 @@ class LoginView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data
         
-        refresh = RefreshToken.for_user(user)
+        refresh = UserRefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'refresh': str(refresh),
@@ -40,6 +41,7 @@ class LoginView(generics.GenericAPIView):
 
 class UserProfileView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 2
     serializer_class = UserSerializer
     
     def get_object(self):
@@ -71,9 +73,10 @@ class AssignCompanyView(generics.UpdateAPIView):
 #     serializer_class = UserSerializer
 #     permission_classes = [IsAuthenticated]
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(EagerLoadingMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated]  
+    query_budget = {'list': 3, 'retrieve': 3}
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
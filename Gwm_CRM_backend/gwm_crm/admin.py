@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Company, Opportunity, Product, Contact, Interaction, Task, Meeting, Notification
+from .models import Company, Opportunity, Product, Contact, Interaction, Task, Meeting, Notification, ImportJob
 
 admin.site.register(Company)
 admin.site.register(Contact)
@@ -9,3 +9,4 @@ admin.site.register(Interaction)
 admin.site.register(Task)
 admin.site.register(Meeting)
 admin.site.register(Notification)
+admin.site.register(ImportJob)
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class GwmCrmConfig(AppConfig):
@@ -6,4 +7,11 @@ class GwmCrmConfig(AppConfig):
     name = 'gwm_crm'
 
     def ready(self):
-        import gwm_crm.signals
\ No newline at end of file
+        import gwm_crm.checks
+        import gwm_crm.signals
+        post_migrate.connect(create_search_index, sender=self)
+
+
+def create_search_index(sender, using='default', **kwargs):
+    from .services.search import ensure_index
+    ensure_index()
\ No newline at end of file
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Warning, register
+
+
+@register(deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Cached company details are only invalidated in the cache of the process that saved the change"""
+    if settings.DEBUG:
+        return []
+    alias = getattr(settings, 'COMPANY_DETAIL_CACHE_ALIAS', 'default')
+    if not isinstance(caches[alias], LocMemCache):
+        return []
+    return [Warning(
+        f"The '{alias}' cache is per process, other workers keep serving stale company details.",
+        hint='Set REDIS_URL, or point COMPANY_DETAIL_CACHE_ALIAS at a cache every worker shares.',
+        id='gwm_crm.W001',
+    )]
@@ -0,0 +1,131 @@
+"""
+Query plans derived from a serializer's field tree.
+
+Forward relations a serializer reads through (nested serializers, dotted
+``source=`` paths such as ``company.name``) become select_related joins,
+to-many relations (nested ``many=True`` serializers, primary key lists)
+become Prefetch objects with their own plan, and only the columns behind
+the rendered fields are loaded. Fields whose source can't be mapped to
+columns (method fields, properties) load every column of their model.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+_plans = {}
+_field_names = {}
+
+
+def _relation(model, name):
+    """The field or reverse relation behind attribute ``name`` of ``model``, or None"""
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+    for rel in model._meta.related_objects:
+        if rel.get_accessor_name() == name:
+            return rel
+    return None
+
+
+class QueryPlan:
+
+    def __init__(self, model):
+        self.model = model
+        self.select = set()
+        self.columns = {model._meta.pk.name}
+        self.prefetch = {}
+
+    def add_all_columns(self, model, prefix):
+        self.columns.update(prefix + field.name for field in model._meta.concrete_fields)
+
+    def add_serializer(self, serializer, model, prefix=''):
+        if isinstance(serializer, serializers.ListSerializer):
+            serializer = serializer.child
+        self.columns.add(prefix + model._meta.pk.name)
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if field.source == '*':
+                if isinstance(field, serializers.BaseSerializer):
+                    self.add_serializer(field, model, prefix)
+                else:
+                    self.add_all_columns(model, prefix)
+                continue
+            self.add_source(field, field.source_attrs, model, prefix)
+
+    def add_source(self, field, attrs, model, prefix):
+        name, rest = attrs[0], attrs[1:]
+        model_field = _relation(model, name)
+        if model_field is None:
+            self.add_all_columns(model, prefix)
+            return
+        path = prefix + name
+        if not model_field.is_relation:
+            self.columns.add(path)
+            return
+
+        related = model_field.related_model
+        if model_field.concrete and not model_field.many_to_many:
+            self.columns.add(path)
+            if rest:
+                self.select.add(path)
+                self.add_source(field, rest, related, path + '__')
+            elif isinstance(field, serializers.BaseSerializer):
+                self.select.add(path)
+                self.add_serializer(field, related, path + '__')
+            elif not isinstance(field, PrimaryKeyRelatedField):
+                self.select.add(path)
+                self.add_all_columns(related, path + '__')
+            return
+
+        child = self.prefetch.get(path)
+        if child is None:
+            child = self.prefetch[path] = QueryPlan(related)
+            if not model_field.many_to_many:
+                # the reverse foreign key prefetching joins on
+                child.columns.add(model_field.field.name)
+        if rest:
+            child.add_source(field, rest, related, '')
+        elif isinstance(field, serializers.BaseSerializer):
+            child.add_serializer(field, related)
+        elif not (isinstance(field, ManyRelatedField) and isinstance(field.child_relation, PrimaryKeyRelatedField)):
+            child.add_all_columns(related, '')
+
+    def apply(self, queryset, extra_columns=()):
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        queryset = queryset.only(*sorted(self.columns | set(extra_columns)))
+        for path, child in sorted(self.prefetch.items()):
+            queryset = queryset.prefetch_related(
+                Prefetch(path, queryset=child.apply(child.model._default_manager.all()))
+            )
+        return queryset
+
+
+def field_names(serializer_class):
+    """The names of every field ``serializer_class`` renders without a selection"""
+    names = _field_names.get(serializer_class)
+    if names is None:
+        names = _field_names[serializer_class] = frozenset(serializer_class().fields)
+    return names
+
+
+def query_plan(serializer_class, model, key=None, get_serializer=None):
+    """
+    The plan for rendering ``model`` rows with ``serializer_class``, built
+    once per class, model and ``key`` (e.g. the field selection) from
+    ``get_serializer()``, or from a bare instance. Past
+    EAGER_LOADING_MAX_PLANS cached plans, new keyed plans are built per
+    call instead of stored.
+    """
+    cache_key = (serializer_class, model, key)
+    plan = _plans.get(cache_key)
+    if plan is None:
+        plan = QueryPlan(model)
+        plan.add_serializer(get_serializer() if get_serializer else serializer_class(), model)
+        if key is None or len(_plans) < getattr(settings, 'EAGER_LOADING_MAX_PLANS', 256):
+            _plans[cache_key] = plan
+    return plan
@@ -0,0 +1,57 @@
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
+
+# serializer context key: {field_name: {str(pk): instance}} preloaded by BulkMixin
+RELATED_CACHE = 'related_cache'
+
+
+class PrefetchedManyRelatedField(ManyRelatedField):
+    """Resolves a list of primary keys with one IN query instead of one query per key"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        self.child_relation.preload(data)
+        return [self.child_relation.to_internal_value(item) for item in data]
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that looks related objects up in instances
+    loaded ahead of time, either by BulkMixin for a whole request or by
+    its many=True parent for one list, and only queries on a miss.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return PrefetchedManyRelatedField(**list_kwargs)
+
+    def _cache(self):
+        root = self.root
+        cache = root._context.setdefault(RELATED_CACHE, {}) if hasattr(root, '_context') else {}
+        return cache.setdefault(self.field_name or self.parent.field_name, {})
+
+    def preload(self, values):
+        cache = self._cache()
+        missing = {str(value) for value in values if value is not None} - set(cache)
+        if missing:
+            try:
+                cache.update((str(obj.pk), obj) for obj in self.get_queryset().filter(pk__in=missing))
+            except (TypeError, ValueError):
+                pass
+
+    def to_internal_value(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        cached = self._cache().get(str(data))
+        if cached is not None:
+            return cached
+        return super().to_internal_value(data)
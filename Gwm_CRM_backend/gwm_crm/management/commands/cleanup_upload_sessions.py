@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from gwm_crm.services.chunked_uploads import cleanup
+
+
+class Command(BaseCommand):
+    help = "Deletes abandoned chunked upload sessions and their temp files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, help="Idle time after which a session is removed "
+                                                        "(default UPLOAD_SESSION_TTL_HOURS)")
+
+    def handle(self, *args, **options):
+        removed = cleanup(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} upload sessions"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from gwm_crm.models import NotificationCounter
+from gwm_crm.services.notification_dedupe import collapse_duplicates
+
+
+class Command(BaseCommand):
+    help = ("Deletes duplicate (user, type, related_object) notifications, keeping the oldest. "
+            "Run before the migration that adds the unique_notification_event constraint")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per transaction")
+
+    def handle(self, *args, **options):
+        deleted = collapse_duplicates(batch_size=options['batch_size'])
+        if deleted and NotificationCounter._meta.db_table in connection.introspection.table_names():
+            # unread badges are recounted on their next read
+            NotificationCounter.objects.all().delete()
+        self.stdout.write(self.style.SUCCESS(f"Collapsed {deleted} duplicate notifications"))
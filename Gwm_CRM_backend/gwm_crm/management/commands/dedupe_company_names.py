@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gwm_crm.models import Company
+
+
+class Command(BaseCommand):
+    help = ("Lists companies whose names differ only in case. With --rename every one but the oldest gets "
+            "its id appended. Run before the migration that adds the unique_company_name_ci constraint")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rename', action='store_true', help="Rename the duplicates instead of failing")
+
+    def handle(self, *args, **options):
+        max_length = Company._meta.get_field('name').max_length
+        renamed = 0
+        groups = list(Company.objects.duplicate_names())
+        for name in groups:
+            companies = list(Company.objects.with_name(name).order_by('pk'))
+            self.stdout.write(f"{name}: " + ', '.join(f"{company.pk} {company.name!r}" for company in companies))
+            if not options['rename']:
+                continue
+            for company in companies[1:]:
+                suffix = f" ({company.pk})"
+                company.name = company.name[:max_length - len(suffix)] + suffix
+                company.save(update_fields=['name'])
+                renamed += 1
+
+        if groups and not options['rename']:
+            raise CommandError(f"{len(groups)} company names are taken more than once, ignoring case; "
+                               "rename them or rerun with --rename")
+        self.stdout.write(self.style.SUCCESS(f"Renamed {renamed} companies"))
@@ -0,0 +1,122 @@
+import os
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from gwm_crm.models import Blob
+from gwm_crm.services.versions import bump_collection
+from gwm_crm.storage import BLOB_DIR, add_reference, blob_name, file_digest, split_name
+
+
+def file_fields():
+    """(model, field name) for every FileField of the project's apps"""
+    for model in apps.get_models():
+        if model._meta.app_label not in ('gwm_crm', 'authentication'):
+            continue
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                yield model, field.attname
+
+
+class Command(BaseCommand):
+    help = ("Moves media stored under plain upload_to paths into the content-addressed blob store, "
+            "keeping one copy per distinct content, and recounts blob references")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report the space that would be reclaimed")
+        parser.add_argument(
+            '--orphan-age', type=int, default=3600,
+            help="Seconds before a blob file without a Blob row is removed; younger ones may belong to an "
+                 "open transaction (default 3600)",
+        )
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        dry_run = options['dry_run']
+
+        # legacy name -> [(model, field, pk), ...]
+        references = defaultdict(list)
+        for model, field in file_fields():
+            rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            for pk, name in rows.values_list('pk', field).iterator():
+                if split_name(name) is None:
+                    references[name].append((model, field, pk))
+
+        seen = set(Blob.objects.values_list('digest', flat=True))
+        files = reclaimed = missing = 0
+        renamed = set()
+        for name, rows in references.items():
+            path = storage.path(name)
+            if not os.path.exists(path):
+                missing += 1
+                continue
+            digest = file_digest(path)
+            size = os.path.getsize(path)
+            files += 1
+            if digest in seen:
+                reclaimed += size
+            seen.add(digest)
+            if dry_run:
+                continue
+
+            target = storage.path(blob_name(digest))
+            new_name = storage.logical_name(digest, os.path.basename(name))
+            with transaction.atomic():
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(path, target)
+                add_reference(digest, size, count=len(rows))
+                for model, field, pk in rows:
+                    model.objects.filter(pk=pk).update(**{field: new_name})
+                    renamed.add(model)
+            if os.path.exists(path):
+                os.remove(path)
+
+        verb = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(
+            f"{files} legacy files checked, {missing} missing on disk. "
+            f"{verb} {reclaimed / 1024 ** 2:.1f} MiB from duplicates."
+        )
+        if not dry_run:
+            # the file URLs in cached lists changed without touching updated_at
+            bump_collection(*renamed)
+            self.recount(storage, options['orphan_age'])
+
+    def recount(self, storage, orphan_age):
+        """
+        Rebuilds refcounts from the FileFields and removes blobs nothing
+        points to, including files left by rolled back saves: the blob file
+        is moved into place before the transaction that adds its row ends.
+        """
+        counts = defaultdict(int)
+        for model, field in file_fields():
+            for name in model.objects.filter(**{f'{field}__startswith': 'cas/'}).values_list(field, flat=True).iterator():
+                counts[split_name(name)[0]] += 1
+
+        fixed = removed = 0
+        for blob in Blob.objects.iterator():
+            refcount = counts.get(blob.digest, 0)
+            if refcount == 0:
+                blob.delete()
+                storage.delete(blob_name(blob.digest))
+                removed += 1
+            elif refcount != blob.refcount:
+                Blob.objects.filter(pk=blob.pk).update(refcount=refcount)
+                fixed += 1
+
+        known = set(Blob.objects.values_list('digest', flat=True))
+        cutoff = time.time() - orphan_age
+        for directory, _, filenames in os.walk(storage.path(BLOB_DIR)):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    if filename not in known and os.path.getmtime(path) <= cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        self.stdout.write(self.style.SUCCESS(f"Recounted blob references: {fixed} corrected, {removed} orphans removed"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from gwm_crm.services import notification_retention
+
+
+class Command(BaseCommand):
+    help = "Deletes or archives old seen notifications in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Age in days after which seen notifications go "
+                                                     "(default NOTIFICATION_RETENTION_DAYS)")
+        parser.add_argument('--batch-size', type=int, help="Rows per transaction")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+        parser.add_argument('--archive', action='store_true', help="Move old rows to the compressed archive")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be reclaimed and exit")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            report = notification_retention.report(options['days'])
+            for name, stats in report.items():
+                self.stdout.write(f"{name}: {stats['rows']} rows, ~{stats['bytes'] / 1024:.1f} KiB")
+            return
+
+        pruned = notification_retention.prune(
+            options['days'], options['batch_size'], archive=options['archive'], pause=options['pause']
+        )
+        verb = 'Archived' if options['archive'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {pruned} old seen notifications"))
@@ -0,0 +1,53 @@
+import json
+import os
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Lists the endpoints with the most queries per request, budget overruns and N+1 shapes " \
+           "from the QueryInspectorMiddleware report"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Report file (default QUERY_INSPECTOR_REPORT_PATH)")
+        parser.add_argument('--limit', type=int, default=20, help="Endpoints to list")
+        parser.add_argument('--clear', action='store_true', help="Empty the report after printing it")
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'QUERY_INSPECTOR_REPORT_PATH', None)
+        if not path:
+            raise CommandError("No report file; pass --path or set QUERY_INSPECTOR_REPORT_PATH.")
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist.")
+
+        endpoints = defaultdict(lambda: {'requests': 0, 'total': 0, 'max': 0, 'over': 0, 'budget': None, 'repeated': {}})
+        with open(path) as report_file:
+            for line in report_file:
+                record = json.loads(line)
+                stats = endpoints[(record['endpoint'], record['view'])]
+                stats['requests'] += 1
+                stats['total'] += record['queries']
+                stats['max'] = max(stats['max'], record['queries'])
+                stats['budget'] = record['budget']
+                if record['budget'] is not None and record['queries'] > record['budget']:
+                    stats['over'] += 1
+                for item in record['repeated']:
+                    seen = stats['repeated'].setdefault(item['shape'], {'count': 0, 'field': item['field']})
+                    seen['count'] = max(seen['count'], item['count'])
+
+        worst = sorted(endpoints.items(), key=lambda entry: (entry[1]['over'], entry[1]['max']), reverse=True)
+        for (endpoint, view), stats in worst[:options['limit']]:
+            budget = stats['budget'] if stats['budget'] is not None else '-'
+            line = (f"{endpoint} [{view}]: {stats['requests']} requests, "
+                    f"avg {stats['total'] / stats['requests']:.1f}, max {stats['max']} queries, budget {budget}")
+            self.stdout.write(self.style.ERROR(line) if stats['over'] else line)
+            if stats['over']:
+                self.stdout.write(f"    over budget in {stats['over']} requests")
+            for shape, item in sorted(stats['repeated'].items(), key=lambda entry: -entry[1]['count'])[:3]:
+                field = f" ({item['field']})" if item['field'] else ''
+                self.stdout.write(f"    N+1 x{item['count']}{field}: {shape[:160]}")
+
+        if options['clear']:
+            open(path, 'w').close()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from gwm_crm.services.pipeline import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recomputes the opportunity pipeline rollup rows from the opportunities table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="Only rebuild this company's rows (repeatable)")
+
+    def handle(self, *args, **options):
+        written = rebuild(options['companies'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt pipeline rollups, {written} rows written"))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gwm_crm.services.search import rebuild_index, uses_fts
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index from companies, contacts and interactions"
+
+    def handle(self, *args, **options):
+        if not uses_fts():
+            self.stdout.write("Full-text index is only used on SQLite, nothing to rebuild")
+            return
+
+        started = time.monotonic()
+        counts = rebuild_index()
+        elapsed = time.monotonic() - started
+        summary = ', '.join(f"{count} {kind}" for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Indexed {summary} in {elapsed:.1f}s"))
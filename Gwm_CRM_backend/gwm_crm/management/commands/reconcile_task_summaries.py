@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from gwm_crm.services.task_summary import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recounts the task dashboard summary rows and fixes any that drifted"
+
+    def handle(self, *args, **options):
+        changed = reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled task summaries, {changed} rows corrected"))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gwm_crm.services.import_jobs import claim_next_job, run_import_job
+
+
+class Command(BaseCommand):
+    help = "Processes queued company import jobs, resuming any that were left running by a crashed worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write(f"Running import job {job.pk} from row {job.rows_processed + 1}")
+            run_import_job(job)
+            job.refresh_from_db()
+            self.stdout.write(
+                f"Import job {job.pk} {job.status}: {job.created_count} created, "
+                f"{job.skipped_count} skipped, {job.error_count} errors"
+            )
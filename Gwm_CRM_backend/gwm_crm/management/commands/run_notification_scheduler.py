@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gwm_crm.services.notifications import create_notifications
+
+
+class Command(BaseCommand):
+    help = "Creates due-soon and assignment notifications on a fixed interval"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=60.0, help="Seconds between sweeps")
+        parser.add_argument('--once', action='store_true', help="Run a single sweep and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            stats = create_notifications()
+            elapsed = time.monotonic() - started
+            details = ', '.join(
+                f"{type}: {row['created']} rows in {row['seconds']:.3f}s" for type, row in stats.items()
+            )
+            self.stdout.write(f"Notification sweep took {elapsed:.3f}s ({details})")
+            if options['once']:
+                return
+            time.sleep(max(options['interval'] - elapsed, 0))
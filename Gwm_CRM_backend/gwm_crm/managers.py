@@ -0,0 +1,33 @@
+from django.db import models
+from django.db.models import Count, Value
+from django.db.models.functions import Lower
+
+
+class CompanyQuerySet(models.QuerySet):
+    def with_name(self, name):
+        """
+        Case-insensitive name match. Both sides are lowered by the database
+        so the lookup uses the Lower(name) unique index instead of the full
+        table scan an iexact LIKE needs.
+        """
+        return self.alias(name_lower=Lower('name')).filter(name_lower=Lower(Value(name)))
+
+    def name_taken(self, name, exclude_pk=None):
+        queryset = self.with_name(name)
+        if exclude_pk is not None:
+            queryset = queryset.exclude(pk=exclude_pk)
+        return queryset.exists()
+
+    def duplicate_names(self):
+        """Lowered names shared by more than one company"""
+        return (
+            self.annotate(name_lower=Lower('name')).values('name_lower')
+            .annotate(total=Count('pk')).filter(total__gt=1)
+            .order_by('name_lower').values_list('name_lower', flat=True)
+        )
+
+    def lowered_names(self):
+        return self.annotate(name_lower=Lower('name')).values_list('name_lower', flat=True)
+
+
+CompanyManager = models.Manager.from_queryset(CompanyQuerySet)
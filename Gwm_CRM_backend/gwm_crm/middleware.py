@@ -0,0 +1,267 @@
+import json
+import logging
+import random
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .services import metrics
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in strict mode, so the test that made the request fails"""
+
+
+def normalize_sql(sql):
+    """The statement's shape: literals and parameters become ?, IN lists (...)"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _serializer_field():
+    """Serializer.field being rendered when the current query ran, if any"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == 'to_representation' and 'rest_framework' in frame.f_code.co_filename:
+            field = frame.f_locals.get('field')
+            if field is not None and field.parent is not None:
+                return f'{type(field.parent).__name__}.{field.field_name}'
+        frame = frame.f_back
+    return None
+
+
+class QueryRecorder:
+
+    def __init__(self):
+        self.count = 0
+        self.shapes = Counter()
+        self.fields = defaultdict(Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        shape = normalize_sql(sql)
+        self.shapes[shape] += 1
+        field = _serializer_field()
+        if field:
+            self.fields[shape][field] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        return [
+            {
+                'shape': shape,
+                'count': count,
+                'field': self.fields[shape].most_common(1)[0][0] if self.fields[shape] else None,
+            }
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+
+@contextmanager
+def wrapping_queries(wrapper):
+    """Runs ``wrapper`` around every statement on every database connection"""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+@asynccontextmanager
+async def wrapping_queries_async(wrapper):
+    """
+    wrapping_queries for async middleware. Database connections are per
+    thread, so the wrappers go on the thread-sensitive executor that runs
+    sync views and sync_to_async database calls.
+    """
+    stack = ExitStack()
+    await sync_to_async(stack.enter_context)(wrapping_queries(wrapper))
+    try:
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+
+
+def view_budget(request):
+    """(view name, budget) for the resolved view; budget is None if undeclared"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None, None
+    view = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    name = f'{view.__name__}.{action}' if view is not None else match._func_path
+    budget = getattr(view, 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(action)
+    return name, budget
+
+
+class QueryInspectorMiddleware:
+    """
+    Counts the SQL each request runs, groups statements by shape and flags
+    shapes repeated QUERY_INSPECTOR_REPEAT_THRESHOLD times or more (N+1),
+    naming the serializer field that was rendering when they ran.
+
+    Views declare ``query_budget``, an int or {action: int}. In 'strict'
+    mode going over it raises QueryBudgetExceeded; in 'sample' mode a
+    fraction of requests is inspected and overruns are logged. With
+    QUERY_INSPECTOR_REPORT_PATH set every inspected request is appended
+    there as a JSON line for ``manage.py query_report``.
+
+    Queries made while a streaming response is consumed happen after the
+    count is taken.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        mode = self.inspection_mode()
+        if mode is None:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with wrapping_queries(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, started, mode)
+
+    async def __acall__(self, request):
+        mode = self.inspection_mode()
+        if mode is None:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        async with wrapping_queries_async(recorder):
+            response = await self.get_response(request)
+        return self.finish(request, response, recorder, started, mode)
+
+    def inspection_mode(self):
+        """The mode to inspect this request in, or None to let it through"""
+        mode = getattr(settings, 'QUERY_INSPECTOR_MODE', None)
+        if mode == 'sample' and random.random() >= getattr(settings, 'QUERY_INSPECTOR_SAMPLE_RATE', 0.01):
+            return None
+        return mode
+
+    def finish(self, request, response, recorder, started, mode):
+        self.report(request, recorder, time.perf_counter() - started, mode)
+        response['X-Query-Count'] = str(recorder.count)
+        return response
+
+    def report(self, request, recorder, elapsed, mode):
+        view, budget = view_budget(request)
+        repeated = recorder.repeated(getattr(settings, 'QUERY_INSPECTOR_REPEAT_THRESHOLD', 5))
+        over_budget = budget is not None and recorder.count > budget
+        match = getattr(request, 'resolver_match', None)
+        endpoint = f'{request.method} {match.route}' if match else f'{request.method} {request.path}'
+
+        for item in repeated:
+            logger.warning(
+                'Possible N+1 in %s (%s): %d x %s%s', endpoint, view, item['count'], item['shape'][:200],
+                f" while rendering {item['field']}" if item['field'] else '',
+            )
+
+        path = getattr(settings, 'QUERY_INSPECTOR_REPORT_PATH', None)
+        if path:
+            record = {
+                'endpoint': endpoint, 'view': view, 'queries': recorder.count, 'budget': budget,
+                'duration_ms': round(elapsed * 1000, 2), 'repeated': repeated,
+            }
+            with open(path, 'a') as report_file:
+                report_file.write(json.dumps(record) + '\n')
+
+        if over_budget:
+            message = f'{endpoint} ({view}) ran {recorder.count} queries, budget is {budget}'
+            if mode == 'strict':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+
+def route_labels(request, status_code):
+    """(route name, viewset action, method, status) for the metrics"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ('unmatched', '', request.method, str(status_code))
+    actions = getattr(match.func, 'actions', None) or {}
+    return (match.url_name or match.route, actions.get(request.method.lower(), ''), request.method, str(status_code))
+
+
+class MetricsMiddleware:
+    """
+    Records each request's latency, SQL statement count and time, and
+    serializer time into gwm_crm.services.metrics, labelled by URL route
+    name and viewset action.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        metrics.instrument_serializers()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        stats = metrics.start_request()
+        started = time.perf_counter()
+        with wrapping_queries(query_timer(stats)):
+            response = self.get_response(request)
+        metrics.finish_request(route_labels(request, response.status_code), time.perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return await self.get_response(request)
+
+        # the stats are thread-local, so they're set where the serializers run
+        stats = await sync_to_async(metrics.start_request)()
+        started = time.perf_counter()
+        async with wrapping_queries_async(query_timer(stats)):
+            response = await self.get_response(request)
+        elapsed = time.perf_counter() - started
+        await sync_to_async(metrics.finish_request)(route_labels(request, response.status_code), elapsed, stats)
+        return response
+
+
+def query_timer(stats):
+    """An execute wrapper adding each statement's count and time to ``stats``"""
+    def record_query(execute, sql, params, many, context):
+        query_started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats.queries += 1
+            stats.query_seconds += time.perf_counter() - query_started
+    return record_query
@@ -0,0 +1,456 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import classonlymethod
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
+from rest_framework.utils import model_meta
+
+from .eager_loading import field_names, query_plan
+from .fields import RELATED_CACHE, CachedPrimaryKeyRelatedField
+from .services.bulk import sync_derived_data
+from .services.versions import collection_generation
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _split(value):
+    return {name.strip() for name in value.split(',') if name.strip()} if value else set()
+
+
+def requested_fields(request):
+    """
+    Reads ?fields= and ?omit= from a read request.
+    Returns (fields or None, omit), or None when nothing was asked for.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    fields, omit = _split(params.get('fields')), _split(params.get('omit'))
+    if not fields and not omit:
+        return None
+    return fields or None, omit
+
+
+def prune_field_names(names, request):
+    selection = requested_fields(request)
+    if selection is None:
+        return list(names)
+    fields, omit = selection
+    return [name for name in names if (fields is None or name in fields) and name not in omit]
+
+
+class SparseFieldsMixin:
+    """
+    Lets read requests trim the top-level serializer output with
+    ?fields=id,name or ?omit=contacts,tasks. Nested serializers are left
+    alone, and writes always see every field.
+    """
+
+    def _is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_root():
+            return fields
+        keep = prune_field_names(fields, self.context.get('request'))
+        return {name: fields[name] for name in keep}
+
+
+def model_columns(serializer, model):
+    """
+    The concrete columns ``serializer`` reads from ``model``, or None if a
+    field's source can't be mapped to one (method fields, dotted sources),
+    in which case the queryset has to stay as it is.
+    """
+    columns = {model._meta.pk.name}
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            return None
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        if model_field.concrete and not model_field.many_to_many:
+            columns.add(model_field.name)
+    return columns
+
+
+def ordering_columns(view):
+    """Columns of the view's ``pagination_ordering``; keyset pagination reads them off the last row"""
+    ordering = getattr(view, 'pagination_ordering', None) or ()
+    if isinstance(ordering, str):
+        ordering = (ordering,)
+    return [name.lstrip('-') for name in ordering]
+
+
+class SparseFieldsViewMixin:
+    """
+    Narrows the SQL to match ?fields=/?omit=: only the columns behind the
+    kept fields are selected, and relations that were dropped are never
+    prefetched because their serializer fields no longer exist.
+    """
+
+    def get_sparse_field_names(self):
+        """Field names left after ?fields=/?omit=, or None if neither was given"""
+        if requested_fields(self.request) is None:
+            return None
+        return set(self.get_serializer().fields)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if requested_fields(self.request) is None:
+            return queryset
+        columns = model_columns(self.get_serializer(), queryset.model)
+        if columns:
+            queryset = queryset.only(*columns, *ordering_columns(self))
+        return queryset
+
+
+class EagerLoadingMixin:
+    """
+    Applies the select_related / prefetch_related / only() plan inferred
+    from the serializer's fields (gwm_crm.eager_loading) to reads, so
+    nested serializers and dotted sources don't cost a query per row.
+    Plans are cached per serializer class and the set of fields left by
+    ?fields=/?omit=; the full-field plans are built by as_view().
+    """
+    eager_loading_actions = ('list', 'retrieve')
+
+    @classonlymethod
+    def as_view(cls, *args, **kwargs):
+        view = super().as_view(*args, **kwargs)
+        cls.build_query_plans()
+        return view
+
+    @classmethod
+    def build_query_plans(cls):
+        """Builds the plan for every eager-loading action's serializer"""
+        if cls.queryset is None:
+            return
+        for action in cls.eager_loading_actions:
+            serializer_class = cls(action=action, request=None, format_kwarg=None).get_serializer_class()
+            query_plan(serializer_class, cls.queryset.model)
+
+    def uses_eager_loading(self):
+        action = getattr(self, 'action', None)
+        if action is None:
+            return self.request.method in SAFE_METHODS
+        return action in self.eager_loading_actions
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not self.uses_eager_loading():
+            return queryset
+        serializer_class = self.get_serializer_class()
+        key = None
+        if requested_fields(self.request) is not None:
+            names = field_names(serializer_class)
+            kept = frozenset(prune_field_names(names, self.request))
+            key = None if kept == names else kept
+        plan = query_plan(serializer_class, queryset.model, key, self.get_serializer)
+        return plan.apply(queryset, ordering_columns(self))
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for list and retrieve. The validators come
+    from a cheap version token (one indexed aggregate, or a single column
+    for one object), so a 304 is answered without running the serializer.
+
+    Views override get_list_version / get_detail_version when their data
+    isn't covered by ``version_field``.
+    """
+    version_field = 'updated_at'
+    # user-scoped lists can lose rows without a delete (e.g. leaving a meeting)
+    version_counts_rows = False
+
+    def get_list_version(self, queryset):
+        """Returns (token, last_modified)"""
+        aggregates = {'last': Max(self.version_field)}
+        if self.version_counts_rows:
+            aggregates['total'] = Count('pk')
+        stats = queryset.order_by().aggregate(**aggregates)
+        token = f"{collection_generation(queryset.model)}:{stats['last']}:{stats.get('total')}"
+        return token, stats['last']
+
+    def get_detail_version(self, queryset, lookup):
+        """Returns (token, last_modified), or None if the object doesn't exist"""
+        rows = queryset.prefetch_related(None).filter(pk=lookup)
+        last_modified = rows.values_list(self.version_field, flat=True).first()
+        if last_modified is None:
+            return None
+        return str(last_modified), last_modified
+
+    def make_etag(self, request, token):
+        raw = ':'.join([
+            self.__class__.__name__,
+            token,
+            str(request.user.pk),
+            request.get_full_path(),
+            getattr(getattr(request, 'accepted_renderer', None), 'format', '') or '',
+        ])
+        return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+    def conditional_response(self, request, version, render):
+        if version is None:
+            return render()
+        token, last_modified = version
+        etag = self.make_etag(request, token)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            return not_modified
+
+        response = render()
+        if 200 <= response.status_code < 300:
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        version = self.get_list_version(self.filter_queryset(self.get_queryset()))
+        return self.conditional_response(
+            request, version, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        version = self.get_detail_version(self.filter_queryset(self.get_queryset()), lookup)
+        return self.conditional_response(
+            request, version, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        )
+
+
+class NotificationVersionMixin(ConditionalGetMixin):
+    """Notifications have no updated_at; reading them only flips ``seen``"""
+
+    def get_list_version(self, queryset):
+        stats = queryset.order_by().aggregate(
+            last=Max('id'),
+            total=Count('id'),
+            unseen=Count('id', filter=Q(seen=False)),
+        )
+        return f"{stats['last']}:{stats['total']}:{stats['unseen']}", None
+
+
+class BulkMixin:
+    """
+    Adds ``<list url>/bulk/`` to a ModelViewSet: POST creates, PATCH
+    updates (each item carries its id) and DELETE removes (a list of ids).
+    The body is a list, or {"items": [...], "mode": ...}.
+
+    Foreign keys are resolved with one IN query per relation, items are
+    validated in memory and written with bulk_create / bulk_update in one
+    transaction. In "atomic" mode (the default) any invalid item rejects
+    the whole request; in "partial" mode the valid items are written and
+    the response (207) reports each item separately.
+    """
+
+    def _bulk_payload(self, request):
+        data = request.data
+        mode = request.query_params.get('mode', 'atomic')
+        if isinstance(data, dict):
+            mode = data.get('mode', mode)
+            data = data.get('items')
+        if not isinstance(data, list):
+            return None, None, 'Expected a list of items, or {"items": [...]}.'
+        if mode not in ('atomic', 'partial'):
+            return None, None, 'mode must be "atomic" or "partial".'
+        limit = getattr(settings, 'BULK_MAX_ITEMS', 5000)
+        if len(data) > limit:
+            return None, None, f'At most {limit} items per request.'
+        return data, mode, None
+
+    def _valid_ids(self, model, ids):
+        """The ids that are valid primary key values; others can only be 'Not found.'"""
+        valid = []
+        for value in ids:
+            if value is None or isinstance(value, (list, dict)):
+                continue
+            try:
+                valid.append(model._meta.pk.to_python(value))
+            except ValidationError:
+                continue
+        return valid
+
+    def _preload_related(self, serializer, items):
+        """Fills the related cache with one query per foreign key field"""
+        for name, field in serializer.fields.items():
+            if field.read_only:
+                continue
+            relation = field.child_relation if isinstance(field, ManyRelatedField) else field
+            if not isinstance(relation, CachedPrimaryKeyRelatedField):
+                continue
+            values = []
+            for item in items:
+                value = item.get(name) if isinstance(item, dict) else None
+                if isinstance(field, ManyRelatedField) and isinstance(value, list):
+                    values.extend(value)
+                elif value is not None and not isinstance(value, (list, dict)):
+                    values.append(value)
+            relation.preload(values)
+
+    def _validate_items(self, items, instances=None):
+        """Returns (serializers, results); results hold an entry per item"""
+        context = self.get_serializer_context()
+        context[RELATED_CACHE] = {}
+        serializer_class = self.get_serializer_class()
+        self._preload_related(serializer_class(context=context), items)
+
+        valid, results = [], []
+        for index, item in enumerate(items):
+            instance = None
+            if instances is not None:
+                instance = instances.get(str(item.get('id'))) if isinstance(item, dict) else None
+                if instance is None:
+                    results.append({'index': index, 'status': 'error', 'errors': {'id': ['Not found.']}})
+                    continue
+            serializer = serializer_class(instance, data=item, partial=instances is not None, context=context)
+            if serializer.is_valid():
+                valid.append((index, serializer))
+                results.append(None)
+            else:
+                results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+        return valid, results
+
+    def _write(self, valid, results, write_many, write_one, done_status, mode):
+        instances = [instance for _, instance in valid]
+        try:
+            with transaction.atomic():
+                write_many(instances)
+            written = valid
+        except IntegrityError:
+            if mode == 'atomic':
+                raise
+            written = []
+            for index, instance in valid:
+                try:
+                    with transaction.atomic():
+                        write_one(instance)
+                    written.append((index, instance))
+                except IntegrityError as row_error:
+                    results[index] = {'index': index, 'status': 'error', 'errors': {'non_field_errors': [str(row_error)]}}
+        for index, instance in written:
+            results[index] = {'index': index, 'status': done_status, 'id': instance.pk}
+        return written
+
+    def _insert_one(self, instance):
+        instance.pk = None
+        instance.save(force_insert=True)
+
+    def _bulk_response(self, results, mode, success_status):
+        failed = any(result['status'] == 'error' for result in results)
+        if failed and mode == 'atomic':
+            code = status.HTTP_400_BAD_REQUEST
+        elif failed:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = success_status
+        return Response({'mode': mode, 'results': results}, status=code)
+
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        items, mode, error = self._bulk_payload(request)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        model = self.get_queryset().model
+
+        if request.method == 'DELETE':
+            return self._bulk_delete(items, mode, model)
+
+        instances = None
+        if request.method == 'PATCH':
+            ids = self._valid_ids(model, [item.get('id') for item in items if isinstance(item, dict)])
+            instances = {str(obj.pk): obj for obj in self.get_queryset().filter(pk__in=ids)}
+            # rows moved to another company leave stale derived data behind at the old one
+            previous_company_ids = {getattr(obj, 'company_id', None) for obj in instances.values()}
+
+        valid, results = self._validate_items(items, instances)
+        if mode == 'atomic' and len(valid) != len(items):
+            results = [r or {'index': i, 'status': 'valid'} for i, r in enumerate(results)]
+            return self._bulk_response(results, mode, status.HTTP_200_OK)
+
+        # to-many values are set after the rows exist, as ModelSerializer.create does
+        relations = model_meta.get_field_info(model).relations
+        to_many = {name for name, info in relations.items() if info.to_many}
+        built, many_values = [], {}
+        for index, serializer in valid:
+            data = dict(serializer.validated_data)
+            many_values[index] = {name: data.pop(name) for name in to_many & set(data)}
+            if instances is None:
+                built.append((index, model(**data)))
+            else:
+                instance = serializer.instance
+                for attr, value in data.items():
+                    setattr(instance, attr, value)
+                built.append((index, instance))
+
+        try:
+            with transaction.atomic():
+                if instances is None:
+                    written = self._write(
+                        built, results,
+                        lambda objs: model.objects.bulk_create(objs),
+                        self._insert_one,
+                        'created', mode,
+                    )
+                else:
+                    fields = sorted({attr for _, s in valid for attr in s.validated_data} - to_many)
+                    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+                        now = timezone.now()
+                        for _, instance in built:
+                            instance.updated_at = now
+                        fields.append('updated_at')
+                    written = self._write(
+                        built, results,
+                        lambda objs: model.objects.bulk_update(objs, fields) if fields else None,
+                        lambda obj: obj.save(update_fields=fields),
+                        'updated', mode,
+                    )
+                for index, instance in written:
+                    for name, value in many_values[index].items():
+                        getattr(instance, name).set(value)
+                sync_derived_data(
+                    model, [instance for _, instance in written],
+                    previous_company_ids if instances is not None else (),
+                )
+        except IntegrityError as e:
+            return Response({'mode': mode, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        success = status.HTTP_201_CREATED if instances is None else status.HTTP_200_OK
+        return self._bulk_response(results, mode, success)
+
+    def _bulk_delete(self, items, mode, model):
+        ids = [item.get('id') if isinstance(item, dict) else item for item in items]
+        existing = {
+            str(pk): pk for pk in self.get_queryset().filter(pk__in=self._valid_ids(model, ids)).values_list('pk', flat=True)
+        }
+        results = []
+        for index, pk in enumerate(ids):
+            if str(pk) in existing:
+                results.append({'index': index, 'status': 'deleted', 'id': existing[str(pk)]})
+            else:
+                results.append({'index': index, 'status': 'error', 'errors': {'id': ['Not found.']}})
+        if mode == 'atomic' and any(result['status'] == 'error' for result in results):
+            return self._bulk_response(results, mode, status.HTTP_200_OK)
+        with transaction.atomic():
+            # a queryset delete still sends post_delete, so the signals keep derived data in step
+            model.objects.filter(pk__in=existing.values()).delete()
+        return self._bulk_response(results, mode, status.HTTP_200_OK)
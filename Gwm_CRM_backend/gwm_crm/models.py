@@ -1,9 +1,26 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
+from django.db.models.functions import Lower
 import pycountry
+import uuid
+from .managers import CompanyManager
 
-class Company(models.Model):
+class StoredFilesModel(models.Model):
+    """
+    Saves in a transaction, so the blob references the storage adds for
+    new FileField values (gwm_crm.storage) go away with a failed save.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+class Company(StoredFilesModel):
     name = models.CharField(max_length=50, unique=True)
     website = models.URLField(max_length=200, unique=True, blank=True)
     country = models.CharField(max_length=5, choices=(('a', 'A'), ('b', 'B'), ('c', 'C')))
@@ -36,6 +53,15 @@ class Company(models.Model):
         null=True,         
         verbose_name= "Correspondence"
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = CompanyManager()
+
+    class Meta:
+        constraints = [
+            # existing case-insensitive duplicates must go first: manage.py dedupe_company_names
+            models.UniqueConstraint(Lower('name'), name='unique_company_name_ci'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.country})"
@@ -55,10 +81,36 @@ class Opportunity(models.Model):
         ],
         default=0,
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.company}: {self.stage} (${self.expected_value})" 
 
+class OpportunityRollup(models.Model):
+    """
+    Pipeline totals per company, stage and expected close month, maintained
+    by the Opportunity signals. industry_category is copied from the
+    company so the pipeline can be grouped without a join.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='opportunity_rollups')
+    industry_category = models.PositiveSmallIntegerField()
+    stage = models.CharField(max_length=20, choices=Opportunity._meta.get_field('stage').choices)
+    close_month = models.DateField(null=True, blank=True)
+    count = models.IntegerField(default=0)
+    total_value = models.BigIntegerField(default=0)
+    weighted_value = models.DecimalField(max_digits=22, decimal_places=4, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'stage', 'close_month'], name='unique_opportunity_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['close_month', 'stage']),
+        ]
+
+    def __str__(self):
+        return f"{self.company_id} {self.stage} {self.close_month}: {self.count}"
+
 class Contact(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='contacts')
     full_name = models.CharField(max_length=100)
@@ -69,11 +121,12 @@ class Contact(models.Model):
     phone_mobile = models.CharField(max_length=20)
     address = models.TextField()
     customer_specific_conditions = models.CharField(max_length=200)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.full_name} - {self.position} @ {self.company}"
     
-class ContactDocument(models.Model):
+class ContactDocument(StoredFilesModel):
     contact = models.ForeignKey(
         Contact, 
         on_delete=models.CASCADE,
@@ -99,7 +152,7 @@ CURRENCY_CHOICES = sorted(
     key=lambda x: x[1]
 )
 
-class Product(models.Model):
+class Product(StoredFilesModel):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='products')
     category = models.CharField(max_length=200)
     price_list = models.FileField(
@@ -119,6 +172,7 @@ class Product(models.Model):
     )
     product_specifications = models.TextField()
     target_price = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return f"{self.company}: {self.category} (Target: ${self.target_price})"
@@ -148,12 +202,18 @@ class Interaction(models.Model):
         related_name='assigned_interactions',
         verbose_name="Assigned User"
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date']),
+        ]
 
     def __str__(self):
         contact_str = f" with {self.contact}" if self.contact else ""
         return f"{self.company}{contact_str} - {self.type} ({self.date.date()})" 
 
-class InteractionDocument(models.Model):
+class InteractionDocument(StoredFilesModel):
     interaction = models.ForeignKey(
         Interaction, 
         on_delete=models.CASCADE,
@@ -243,12 +303,47 @@ class Task(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['priority']),
             models.Index(fields=['due_date']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['status', 'due_date']),
         ]
 
     def __str__(self):
         return f"{self.title} ({self.get_status_display()})"
     
-class Meeting(models.Model):
+class TaskSummary(models.Model):
+    """
+    Task counts per user, role, status and priority, kept up to date by
+    the Task signals so the dashboard doesn't have to count the tasks
+    table. ``manage.py reconcile_task_summaries`` repairs any drift from
+    bulk updates.
+    """
+    ROLE_CHOICES = [
+        ('assigned', 'Assigned'),
+        ('created', 'Created'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='task_summaries'
+    )
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    status = models.CharField(max_length=20, choices=Task.STATUS_CHOICES)
+    priority = models.CharField(max_length=20, choices=Task.PRIORITY_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'role', 'status', 'priority'], name='unique_task_summary'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.role} {self.status}/{self.priority}: {self.count}"
+
+class Meeting(StoredFilesModel):
     company = models.ForeignKey('Company', on_delete=models.CASCADE, null=True, blank=True, related_name='meetings')
     date = models.DateTimeField(blank=True, null=True)
     report = models.TextField(blank=True)
@@ -262,6 +357,12 @@ class Meeting(models.Model):
         blank=True,             
         verbose_name="Meeting Attachments"
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date']),
+        ]
 
 class Notification(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="notifications")
@@ -272,6 +373,162 @@ class Notification(models.Model):
     type = models.CharField(max_length=50, choices=[
         ('task_due_soon', 'Task Due Soon'),
         ('meeting_due_soon', 'Meeting Due Soon'),
-        ('task_assigned', 'Task Assigned')
+        ('task_assigned', 'Task Assigned'),
+        ('meeting_scheduled', 'Meeting Scheduled'),
+        ('meeting_reminder', 'Meeting Reminder'),
     ])
-    related_object_id = models.IntegerField(null=True, blank=True) 
\ No newline at end of file
+    related_object_id = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['user', 'seen', '-created_at']),
+        ]
+        constraints = [
+            # one notification per event; lets the scheduler insert with ignore_conflicts.
+            # Existing duplicates must go first: see gwm_crm.services.notification_dedupe
+            models.UniqueConstraint(fields=['user', 'type', 'related_object_id'], name='unique_notification_event'),
+        ]
+
+class CollectionVersion(models.Model):
+    """
+    Per-model generation for list ETags, bumped by the changes Max(updated_at)
+    can't show (see gwm_crm.services.versions). Kept in the database so every
+    worker sees the same value.
+    """
+    model = models.CharField(max_length=100, primary_key=True)
+    generation = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.model}: {self.generation}"
+
+class NotificationCounter(models.Model):
+    """
+    Unread notification count per user, so the badge is one row lookup.
+    Created lazily from a real count on first read; inserts bump it and
+    marking everything read resets it.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='notification_counter'
+    )
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread"
+
+class NotificationArchive(models.Model):
+    """
+    Old seen notifications moved out of the Notification table by
+    ``manage.py prune_notifications --archive``. One row holds a batch of
+    one user's notifications as zlib-compressed JSON.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="notification_archives")
+    count = models.IntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-last_created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.count} notifications up to {self.last_created_at}"
+
+class ImportJob(StoredFilesModel):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    file = models.FileField(upload_to='imports/%Y/%m/%d/')
+    original_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='import_jobs'
+    )
+    # number of the last data row whose batch has been committed
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'heartbeat_at']),
+        ]
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.get_status_display()})"
+
+class UploadSession(models.Model):
+    """
+    A resumable upload. Chunks are appended to a temp file by offset and
+    the finished file is moved into the target FileField on completion.
+    """
+    TARGET_CHOICES = [
+        ('company.business_card', 'Company business card'),
+        ('company.catalogs', 'Company catalogs'),
+        ('company.signed_contracts', 'Company signed contracts'),
+        ('company.correspondence', 'Company correspondence'),
+        ('product.price_list', 'Product price list'),
+        ('meeting.attachment', 'Meeting attachment'),
+        ('contact.document', 'Contact document'),
+        ('interaction.document', 'Interaction document'),
+    ]
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('completed', 'Completed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    target = models.CharField(max_length=40, choices=TARGET_CHOICES)
+    object_id = models.PositiveIntegerField()
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    # optional hex sha256 of the whole file, checked on completion
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size}) {self.status}"
+
+class Blob(models.Model):
+    """
+    One stored file of the content-addressed media storage, keyed by the
+    sha256 of its bytes. refcount is the number of FileField values
+    pointing at it (see gwm_crm.storage).
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.size} bytes, {self.refcount} refs)"
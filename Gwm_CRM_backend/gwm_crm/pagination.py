@@ -0,0 +1,25 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor (keyset) pagination for every list endpoint. Pages are fetched
+    with WHERE <key> < <cursor position> on an indexed ordering, so page N
+    costs the same as page 1, and there's no COUNT(*) at all.
+
+    Views pick their ordering with ``pagination_ordering``. The cursor only
+    encodes the first field: rows equal on it are stepped over with an
+    OFFSET, and later fields just keep that order stable. So the first
+    field must be indexed, non-null and close to unique (e.g. a timestamp,
+    not a status), or a page behind many ties costs as much as OFFSET.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 500)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'pagination_ordering', None)
+        if ordering:
+            return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        return super().get_ordering(request, queryset, view)
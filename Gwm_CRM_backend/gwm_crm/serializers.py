@@ -1,9 +1,11 @@
 from rest_framework import serializers
-from .models import Company, Contact, Opportunity, Product, Interaction, ContactDocument, Task, Meeting, InteractionDocument, Notification
+from .models import Company, Contact, Opportunity, Product, Interaction, ContactDocument, Task, Meeting, InteractionDocument, Notification, ImportJob, UploadSession
 from authentication.models import User 
 from authentication.serializers import UserSerializer
+from .mixins import SparseFieldsMixin
+from .fields import CachedPrimaryKeyRelatedField
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Company
         fields = [
@@ -21,13 +23,14 @@ class CompanySerializer(serializers.ModelSerializer):
         }
 
     def validate_name(self, value):
-        """Ensure company name is unique"""
-        if Company.objects.filter(name__iexact=value).exists():
+        """Ensure company name is unique, ignoring case"""
+        exclude_pk = self.instance.pk if self.instance is not None else None
+        if Company.objects.name_taken(value, exclude_pk=exclude_pk):
             raise serializers.ValidationError("A company with this name already exists.")
         return value
 
-class ContactSerializer(serializers.ModelSerializer):
-    company_id = serializers.PrimaryKeyRelatedField(
+class ContactSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    company_id = CachedPrimaryKeyRelatedField(
         queryset=Company.objects.all(),
         source='company'
     )
@@ -43,7 +46,7 @@ class ContactSerializer(serializers.ModelSerializer):
             'document': {'required': False},
         }
 
-class ContactDocumentSerializer(serializers.ModelSerializer):
+class ContactDocumentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ContactDocument
         fields = ['id', 'file', 'uploaded_at', 'name']
@@ -55,8 +58,8 @@ class ContactDetailSerializer(ContactSerializer):
     class Meta(ContactSerializer.Meta):
         fields = ContactSerializer.Meta.fields + ['documents']
 
-class OpportunitySerializer(serializers.ModelSerializer):
-    company_id = serializers.PrimaryKeyRelatedField(
+class OpportunitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    company_id = CachedPrimaryKeyRelatedField(
         queryset=Company.objects.all(),
         source='company'
     )
@@ -68,8 +71,8 @@ class OpportunitySerializer(serializers.ModelSerializer):
             'expected_close_date', 'probability'
         ]
 
-class ProductSerializer(serializers.ModelSerializer):
-    company_id = serializers.PrimaryKeyRelatedField(
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    company_id = CachedPrimaryKeyRelatedField(
         queryset=Company.objects.all(),
         source='company',
     )
@@ -85,18 +88,18 @@ class ProductSerializer(serializers.ModelSerializer):
             'price_list': {'required': False},
         }
 
-class InteractionSerializer(serializers.ModelSerializer):
-    company_id = serializers.PrimaryKeyRelatedField(
+class InteractionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    company_id = CachedPrimaryKeyRelatedField(
         queryset=Company.objects.all(),
         source='company',
     )
-    contact_id = serializers.PrimaryKeyRelatedField(
+    contact_id = CachedPrimaryKeyRelatedField(
         queryset=Contact.objects.all(),
         source='contact',
         required=False,
         allow_null=True
     )
-    assigned_to_id = serializers.PrimaryKeyRelatedField(
+    assigned_to_id = CachedPrimaryKeyRelatedField(
         queryset=User.objects.all(),
         source='assigned_to',
         required=False,
@@ -114,15 +117,15 @@ class InteractionSerializer(serializers.ModelSerializer):
             # 'attachments': {'required': False},
         }
 
-class InteractionDocumentSerializer(serializers.ModelSerializer):
+class InteractionDocumentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = InteractionDocument
         fields = ['id', 'file', 'uploaded_at', 'name']
         read_only_fields = ['uploaded_at', 'name']
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # assigned_to = UserSerializer(read_only=True)
-    assigned_to_id = serializers.PrimaryKeyRelatedField(
+    assigned_to_id = CachedPrimaryKeyRelatedField(
         queryset=User.objects.all(), 
         source='assigned_to',
         # write_only=True,
@@ -143,8 +146,8 @@ class TaskSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_by']
 
-class MeetingSerializer(serializers.ModelSerializer):
-    user_ids = serializers.PrimaryKeyRelatedField(
+class MeetingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user_ids = CachedPrimaryKeyRelatedField(
         many=True,
         queryset=User.objects.all(),
         source='users',
@@ -175,7 +178,7 @@ class CompanyDetailSerializer(CompanySerializer):
             'contacts', 'opportunities', 'products', 'interactions', 'tasks', 'meetings'
         ]
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = [
@@ -186,4 +189,34 @@ class NotificationSerializer(serializers.ModelSerializer):
             'seen',
             'created_at',
             'related_object_id',
-        ]
\ No newline at end of file
+        ]
+
+class ImportJobSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    rows_per_second = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'original_name', 'status', 'rows_processed', 'created_count',
+            'skipped_count', 'error_count', 'errors', 'message', 'rows_per_second',
+            'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+    def get_rows_per_second(self, obj):
+        if not obj.started_at:
+            return None
+        end = obj.finished_at or obj.heartbeat_at
+        if not end:
+            return None
+        elapsed = (end - obj.started_at).total_seconds()
+        return round(obj.rows_processed / elapsed, 1) if elapsed > 0 else None
+
+class UploadSessionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'target', 'object_id', 'filename', 'size', 'received', 'sha256',
+            'status', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['id', 'received', 'status', 'created_at', 'updated_at']
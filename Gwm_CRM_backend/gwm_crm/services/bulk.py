@@ -0,0 +1,25 @@
+"""
+Keeps derived data in step after bulk writes, which skip the model
+signals: the company detail cache, collection versions, the search index
+and the opportunity pipeline rollups.
+"""
+from gwm_crm.models import Company, Opportunity
+from gwm_crm.services import pipeline, search
+from gwm_crm.services.company_cache import bump_versions
+from gwm_crm.services.versions import bump_collection
+
+
+def sync_derived_data(model, instances, previous_company_ids=()):
+    """``previous_company_ids``: the companies updated rows belonged to before, if they may have moved"""
+    if not instances:
+        return
+    if model is Company:
+        company_ids = {instance.pk for instance in instances}
+    else:
+        company_ids = ({getattr(instance, 'company_id', None) for instance in instances} | set(previous_company_ids)) - {None}
+    bump_versions(company_ids)
+    bump_collection(model)
+    if model in search.MODEL_KINDS:
+        search.index_objects(model, [instance.pk for instance in instances])
+    if model is Opportunity:
+        pipeline.rebuild(company_ids)
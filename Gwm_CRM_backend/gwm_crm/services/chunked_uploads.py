@@ -0,0 +1,251 @@
+"""
+Resumable uploads: initiate a session, PUT the bytes in chunks by
+offset, then complete. Chunks stream from the request straight into a
+temp file (never into memory), each can carry a sha256 that is checked
+as it is written, and on completion the file is moved into the target
+FileField.
+"""
+import hashlib
+import os
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from gwm_crm.models import (Company, Contact, ContactDocument, Interaction, InteractionDocument, Meeting,
+                            Product, UploadSession)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class AssembledFile(File):
+    """
+    The finished temp file. temporary_file_path() lets FileSystemStorage
+    move it into MEDIA_ROOT instead of copying it.
+    """
+
+    def __init__(self, path, name):
+        super().__init__(open(path, 'rb'), name=name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def _set_field(model, field_name):
+    def attach(object_id, file):
+        # the replaced file is released by gwm_crm.signals once this commits
+        instance = model.objects.get(pk=object_id)
+        setattr(instance, field_name, file)
+        instance.save()
+        return instance
+    return attach
+
+
+def _create_document(model, parent_field):
+    def attach(object_id, file):
+        return model.objects.create(**{parent_field: object_id}, file=file, name=file.name)
+    return attach
+
+
+# target -> (model the upload belongs to, how the finished file is stored)
+TARGETS = {
+    'company.business_card': (Company, _set_field(Company, 'business_card')),
+    'company.catalogs': (Company, _set_field(Company, 'catalogs')),
+    'company.signed_contracts': (Company, _set_field(Company, 'signed_contracts')),
+    'company.correspondence': (Company, _set_field(Company, 'correspondence')),
+    'product.price_list': (Product, _set_field(Product, 'price_list')),
+    'meeting.attachment': (Meeting, _set_field(Meeting, 'attachment')),
+    'contact.document': (Contact, _create_document(ContactDocument, 'contact_id')),
+    'interaction.document': (Interaction, _create_document(InteractionDocument, 'interaction_id')),
+}
+
+
+def session_dir():
+    return getattr(settings, 'UPLOAD_SESSION_DIR', os.path.join(settings.BASE_DIR, 'upload_sessions'))
+
+
+def max_size():
+    return getattr(settings, 'UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+
+
+def max_chunk_size():
+    return getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 32 * 1024 ** 2)
+
+
+def temp_path(session):
+    return os.path.join(session_dir(), f'{session.pk}.part')
+
+
+def start_session(user, target, object_id, filename, size, sha256=''):
+    if target not in TARGETS:
+        raise UploadError(f'Unknown target {target!r}.')
+    if size <= 0 or size > max_size():
+        raise UploadError(f'size must be between 1 and {max_size()} bytes.')
+    model, _ = TARGETS[target]
+    if not model.objects.filter(pk=object_id).exists():
+        raise UploadError(f'{model.__name__} {object_id} not found.', 404)
+
+    session = UploadSession.objects.create(
+        created_by=user,
+        target=target,
+        object_id=object_id,
+        filename=get_valid_filename(os.path.basename(filename))[:255] or 'upload',
+        size=size,
+        sha256=(sha256 or '').lower(),
+    )
+    os.makedirs(session_dir(), exist_ok=True)
+    open(temp_path(session), 'wb').close()
+    return session
+
+
+def write_chunk(session, offset, stream, length, checksum=None):
+    """
+    Writes ``length`` bytes from ``stream`` at ``offset``. The offset may
+    repeat already received bytes (a retried chunk) but not skip ahead;
+    repeated bytes are only hashed, never written again, so a retry can't
+    shorten or corrupt what was received. Returns the new offset.
+    """
+    if length <= 0 or length > max_chunk_size():
+        raise UploadError(f'Chunks must be between 1 and {max_chunk_size()} bytes.', 413)
+
+    with transaction.atomic():
+        # SQLite ignores FOR UPDATE; the conditional update below still catches a concurrent chunk there
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != 'uploading':
+            raise UploadError('This upload is already complete.', 409)
+        if offset > session.received:
+            raise UploadError(f'Expected offset {session.received}.', 409)
+        if offset + length > session.size:
+            raise UploadError('Chunk runs past the declared size.')
+
+        digest = hashlib.sha256()
+        position = offset
+        with open(temp_path(session), 'r+b') as target:
+            target.seek(session.received)
+            remaining = length
+            while remaining:
+                data = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                digest.update(data)
+                new = data[max(session.received - position, 0):]
+                if new:
+                    target.write(new)
+                position += len(data)
+                remaining -= len(data)
+
+            error = None
+            if remaining:
+                error = UploadError('The request body ended before Content-Length bytes were received.')
+            elif checksum and digest.hexdigest() != checksum.lower():
+                error = UploadError('Chunk checksum mismatch.', 422)
+            end = session.received if error else max(session.received, offset + length)
+            target.truncate(end)
+
+        updated = UploadSession.objects.filter(pk=session.pk, received=session.received, status='uploading').update(
+            received=end, updated_at=timezone.now()
+        )
+        if not updated:
+            raise UploadError('Another chunk was written concurrently; check the offset and retry.', 409)
+    session.received = end
+    if error:
+        raise error
+    return end
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete(session):
+    """Moves the assembled file into its target and returns the saved instance"""
+    path = temp_path(session)
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != 'uploading':
+            raise UploadError('This upload is already complete.', 409)
+        if session.received != session.size:
+            raise UploadError(f'Upload is incomplete: {session.received} of {session.size} bytes received.')
+        if session.sha256 and _file_sha256(path) != session.sha256:
+            raise UploadError('File checksum mismatch.', 422)
+
+        _, attach = TARGETS[session.target]
+        staging = _staging_link(path)
+        file = AssembledFile(staging, session.filename)
+        try:
+            instance = attach(session.object_id, file)
+        finally:
+            file.close()
+            # still here when storage copied instead of moving, or attaching failed
+            _remove(staging)
+        session.status = 'completed'
+        session.save(update_fields=['status', 'updated_at'])
+    discard_temp_file(session)
+    return instance
+
+
+def _staging_link(path):
+    """
+    A second name for the temp file for storage to move away, so the
+    .part file, and with it the session, survives a failed attach and
+    complete can be retried.
+    """
+    staging = path + '.attach'
+    _remove(staging)
+    try:
+        os.link(path, staging)
+    except OSError:
+        shutil.copyfile(path, staging)
+    return staging
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_temp_file(session):
+    _remove(temp_path(session))
+
+
+def abort(session):
+    discard_temp_file(session)
+    session.delete()
+
+
+def cleanup(max_age_hours=None):
+    """Removes sessions idle for longer than max_age_hours and stray temp files, returns sessions removed"""
+    if max_age_hours is None:
+        max_age_hours = getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24)
+    cutoff = timezone.now() - timedelta(hours=max_age_hours)
+
+    removed = 0
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+        abort(session)
+        removed += 1
+
+    if os.path.isdir(session_dir()):
+        live = {str(pk) for pk in UploadSession.objects.filter(status='uploading').values_list('pk', flat=True)}
+        for name in os.listdir(session_dir()):
+            path = os.path.join(session_dir(), name)
+            stem = name[:-len('.part')] if name.endswith('.part') else None
+            if stem not in live and os.path.getmtime(path) < cutoff.timestamp():
+                os.remove(path)
+    return removed
@@ -0,0 +1,91 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+STATS = ('hits', 'misses', 'invalidations')
+
+
+def _cache():
+    return caches[getattr(settings, 'COMPANY_DETAIL_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'COMPANY_DETAIL_CACHE_TIMEOUT', 600)
+
+
+def _version_key(company_id):
+    return f'company-detail:{company_id}:version'
+
+
+def _document_key(company_id, version, variant=''):
+    return f'company-detail:{company_id}:{version}:{variant}'
+
+
+def _stat_key(name):
+    return f'company-detail:stats:{name}'
+
+
+def _count(name, delta=1):
+    cache = _cache()
+    try:
+        cache.incr(_stat_key(name), delta)
+    except ValueError:
+        if not cache.add(_stat_key(name), delta, timeout=None):
+            cache.incr(_stat_key(name), delta)
+
+
+def get_version(company_id):
+    """
+    Current version of a company's detail document. Versions start from
+    the clock so a version key lost from the cache never comes back with
+    a number that an old document was stored under.
+    """
+    cache = _cache()
+    version = cache.get(_version_key(company_id))
+    if version is None:
+        cache.add(_version_key(company_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(company_id))
+    return version
+
+
+def get_document(company_id, variant=''):
+    """Returns (data, version); data is None on a miss"""
+    version = get_version(company_id)
+    data = _cache().get(_document_key(company_id, version, variant))
+    _count('misses' if data is None else 'hits')
+    return data, version
+
+
+def set_document(company_id, version, data, variant=''):
+    cache = _cache()
+    cache.set(_document_key(company_id, version, variant), data, timeout=_timeout())
+    variants = cache.get(_document_key(company_id, version, 'variants')) or set()
+    if variant not in variants:
+        variants.add(variant)
+        cache.set(_document_key(company_id, version, 'variants'), variants, timeout=_timeout())
+
+
+def bump_versions(company_ids):
+    """Invalidates the cached documents of the given companies"""
+    cache = _cache()
+    for company_id in {pk for pk in company_ids if pk is not None}:
+        old = cache.get(_version_key(company_id))
+        cache.set(_version_key(company_id), max(time.time_ns(), (old or 0) + 1), timeout=None)
+        if old is None:
+            continue
+        variants = cache.get(_document_key(company_id, old, 'variants')) or set()
+        if variants:
+            cache.delete_many(
+                [_document_key(company_id, old, variant) for variant in variants]
+                + [_document_key(company_id, old, 'variants')]
+            )
+            _count('invalidations', len(variants))
+
+
+def stats():
+    values = _cache().get_many([_stat_key(name) for name in STATS])
+    data = {name: values.get(_stat_key(name), 0) for name in STATS}
+    lookups = data['hits'] + data['misses']
+    data['hit_ratio'] = round(data['hits'] / lookups, 3) if lookups else None
+    return data
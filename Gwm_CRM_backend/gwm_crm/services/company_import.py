@@ -0,0 +1,137 @@
+import codecs
+import csv
+
+from django.db import IntegrityError, transaction
+
+from gwm_crm.models import Company
+from gwm_crm.services.bulk import sync_derived_data
+
+IMPORT_BATCH_SIZE = 2000
+
+
+def read_csv_rows(csv_file, encoding='utf-8-sig'):
+    """
+    Parses an uploaded CSV line by line instead of decoding the whole file.
+    Yields (row_number, row) with data rows numbered from 1.
+    """
+    reader = csv.DictReader(codecs.iterdecode(csv_file, encoding))
+    return enumerate(reader, start=1)
+
+
+class CompanyImporter:
+    """
+    Set-based company import.
+
+    Existing names (lowered) and websites are loaded once, rows are
+    validated in memory and new companies are written with bulk_create,
+    one transaction per batch. If a batch hits a constraint anyway
+    (e.g. a concurrent insert) it is replayed row by row so the error
+    report still points at the offending rows.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.processed = 0
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self.existing_names = set()
+        self.existing_websites = set()
+
+    def load_existing(self):
+        self.existing_names.update(Company.objects.lowered_names().iterator(chunk_size=self.batch_size))
+        websites = Company.objects.values_list('website', flat=True).iterator(chunk_size=self.batch_size)
+        self.existing_websites.update(website for website in websites if website is not None)
+
+    def build_company(self, row):
+        return Company(
+            name=row['name'],
+            website=row.get('website') or '',
+            country=row['country'],
+            industry_category=int(row['industry_category']),
+            activity_level=row['activity_level'],
+            acquired_via=row['acquired_via'],
+            lead_score=int(row['lead_score']),
+            notes=row.get('notes') or '',
+        )
+
+    def validate_row(self, idx, row):
+        """Returns a Company to insert, or None if the row is skipped or invalid"""
+        try:
+            company = self.build_company(row)
+            if not company.name:
+                raise ValueError('name is required')
+            key = company.name.lower()
+        except Exception as e:
+            self.errors.append({'row': idx, 'error': str(e)})
+            return None
+
+        if key in self.existing_names:
+            self.skipped += 1
+            return None
+
+        if company.website in self.existing_websites:
+            self.errors.append({'row': idx, 'error': 'A company with this website already exists.'})
+            return None
+
+        self.existing_names.add(key)
+        self.existing_websites.add(company.website)
+        return company
+
+    def write_batch(self, batch):
+        """Inserts [(row_number, company), ...], falling back to row by row on conflicts"""
+        try:
+            with transaction.atomic():
+                companies = Company.objects.bulk_create([company for _, company in batch])
+                # bulk_create skips post_save, which keeps search and caches current
+                sync_derived_data(Company, companies)
+            self.created += len(batch)
+            return
+        except IntegrityError:
+            pass
+
+        for idx, company in batch:
+            try:
+                with transaction.atomic():
+                    company.pk = None
+                    company.save(force_insert=True)
+                self.created += 1
+            except IntegrityError as e:
+                self.errors.append({'row': idx, 'error': str(e)})
+
+    def run(self, rows, start_after=0, on_batch=None):
+        """
+        Imports (row_number, row) pairs. Rows up to ``start_after`` are
+        skipped, which lets a caller resume a partially imported file.
+        ``on_batch(last_row)`` is called inside each batch's transaction.
+        """
+        self.load_existing()
+
+        pending = []
+        last_row = start_after
+        for idx, row in rows:
+            if idx <= start_after:
+                continue
+            last_row = idx
+            self.processed += 1
+            company = self.validate_row(idx, row)
+            if company is not None:
+                pending.append((idx, company))
+            if self.processed % self.batch_size == 0:
+                self.flush(pending, last_row, on_batch)
+                pending = []
+
+        if pending or self.processed % self.batch_size:
+            self.flush(pending, last_row, on_batch)
+        return self
+
+    def flush(self, pending, last_row, on_batch):
+        with transaction.atomic():
+            if pending:
+                self.write_batch(pending)
+            if on_batch is not None:
+                on_batch(last_row)
+
+
+def import_companies(csv_file, batch_size=IMPORT_BATCH_SIZE):
+    return CompanyImporter(batch_size=batch_size).run(read_csv_rows(csv_file))
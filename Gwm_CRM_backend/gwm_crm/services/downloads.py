@@ -0,0 +1,144 @@
+"""
+File downloads with validators and byte ranges.
+
+Files stream from storage through FileResponse, or, with
+DOWNLOAD_SENDFILE_MODE set to 'x-accel' (nginx) or 'x-sendfile'
+(Apache/lighttpd), only the headers are sent and the front proxy
+transfers the bytes (and handles Range itself). Permission checks stay
+in the view either way.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """Read-only view of ``length`` bytes of a file starting at ``start``"""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _modified_time(field_file):
+    try:
+        return field_file.storage.get_modified_time(field_file.name)
+    except (NotImplementedError, OSError):
+        return None
+
+
+def _etag(field_file, size, modified):
+    raw = f'{field_file.name}:{size}:{modified.timestamp() if modified else ""}'
+    return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single "bytes=" range, None to send the
+    whole file (no header, or a form we don't serve such as multiple
+    ranges), or False when the range can't be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, etag, modified):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag
+    timestamp = parse_http_date_safe(value)
+    return modified is not None and timestamp is not None and int(modified.timestamp()) <= timestamp
+
+
+def _sendfile_response(field_file, content_type):
+    mode = getattr(settings, 'DOWNLOAD_SENDFILE_MODE', None)
+    if mode == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+        # the stored path, which differs from the field's name under the content-addressed storage
+        relative = os.path.relpath(field_file.path, field_file.storage.location).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = field_file.path
+        return response
+    return None
+
+
+def file_response(request, field_file, filename=None, as_attachment=True):
+    filename = filename or os.path.basename(field_file.name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    size = field_file.size
+    modified = _modified_time(field_file)
+    etag = _etag(field_file, size, modified)
+    last_modified = int(modified.timestamp()) if modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _sendfile_response(field_file, content_type)
+    if response is None:
+        requested = parse_range(request.headers.get('Range'), size)
+        if requested and not _if_range_matches(request, etag, modified):
+            requested = None
+
+        if requested is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif requested:
+            start, end = requested
+            response = FileResponse(
+                RangeFile(field_file.open('rb'), start, end - start + 1),
+                status=206, content_type=content_type,
+            )
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            response = FileResponse(field_file.open('rb'), content_type=content_type)
+
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
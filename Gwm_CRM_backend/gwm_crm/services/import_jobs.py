@@ -0,0 +1,190 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from gwm_crm.models import ImportJob
+from gwm_crm.services.company_import import CompanyImporter, read_csv_rows
+
+logger = logging.getLogger(__name__)
+
+# only the first errors are kept on the job, error_count has the full number
+MAX_STORED_ERRORS = 1000
+
+_executor = None
+_executor_lock = threading.Lock()
+_watchdog_started = False
+
+
+def _batch_size():
+    return getattr(settings, 'IMPORT_JOB_BATCH_SIZE', 2000)
+
+
+def _stale_after():
+    return timedelta(seconds=getattr(settings, 'IMPORT_JOB_STALE_SECONDS', 300))
+
+
+def enqueue_import(uploaded_file, user=None):
+    """Saves the upload to storage and queues it for the workers"""
+    job = ImportJob.objects.create(
+        file=uploaded_file,
+        original_name=uploaded_file.name[:255],
+        created_by=user if user and user.is_authenticated else None,
+    )
+    if getattr(settings, 'IMPORT_JOB_IN_PROCESS_WORKERS', 2):
+        transaction.on_commit(lambda: submit(job.pk))
+    return job
+
+
+def submit(job_id=None):
+    """Runs the job on an in-process worker, which then drains whatever else is claimable"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMPORT_JOB_IN_PROCESS_WORKERS', 2),
+                thread_name_prefix='import-job',
+            )
+    _executor.submit(_run_in_thread, job_id)
+    start_watchdog()
+
+
+def start_watchdog():
+    """
+    Once per process, every IMPORT_JOB_STALE_SECONDS: hands the jobs a
+    restart or crash left queued or running to the in-process workers.
+    Started by the first request (gwm_crm.signals) or submit.
+    """
+    global _watchdog_started
+    if not getattr(settings, 'IMPORT_JOB_IN_PROCESS_WORKERS', 2):
+        return
+    with _executor_lock:
+        if _watchdog_started:
+            return
+        _watchdog_started = True
+    _schedule_sweep()
+
+
+def _schedule_sweep():
+    timer = threading.Timer(_stale_after().total_seconds(), _sweep)
+    timer.daemon = True
+    timer.start()
+
+
+def _sweep():
+    try:
+        if ImportJob.objects.filter(_claimable()).exists():
+            submit()
+    except Exception:
+        logger.exception("Import job sweep failed")
+    finally:
+        close_old_connections()
+        _schedule_sweep()
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        if job_id is not None:
+            job = claim_job(job_id)
+            if job is not None:
+                run_import_job(job)
+        drain()
+    except Exception:
+        logger.exception(f"Import job {job_id} crashed")
+    finally:
+        close_old_connections()
+
+
+def drain():
+    """Runs claimable jobs (queued, or running with a stale heartbeat) until none are left"""
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return
+        run_import_job(job)
+
+
+def _claimable():
+    stale = timezone.now() - _stale_after()
+    return Q(status='queued') | Q(status='running', heartbeat_at__lt=stale)
+
+
+def claim_job(job_id):
+    """
+    Marks a queued (or abandoned running) job as ours. The update only
+    matches while the job is still claimable, so two workers can never
+    both pick it up.
+    """
+    now = timezone.now()
+    claimed = ImportJob.objects.filter(_claimable(), pk=job_id).update(
+        status='running',
+        heartbeat_at=now,
+    )
+    if not claimed:
+        return None
+
+    job = ImportJob.objects.get(pk=job_id)
+    if job.started_at is None:
+        job.started_at = now
+        job.save(update_fields=['started_at'])
+    return job
+
+
+def claim_next_job():
+    candidates = ImportJob.objects.filter(_claimable()).order_by('created_at').values_list('pk', flat=True)
+    for job_id in candidates[:10]:
+        job = claim_job(job_id)
+        if job is not None:
+            return job
+    return None
+
+
+def run_import_job(job):
+    """
+    Imports the job's file, resuming after the last committed row. Each
+    batch of companies is committed in the same transaction as the job's
+    progress, so a crash never leaves half a batch behind.
+    """
+    importer = CompanyImporter(batch_size=_batch_size())
+    base = {
+        'created': job.created_count,
+        'skipped': job.skipped_count,
+        'errors': job.error_count,
+    }
+    stored_errors = list(job.errors)
+    reported = 0
+
+    def on_batch(last_row):
+        nonlocal reported
+        new_errors = importer.errors[reported:]
+        reported = len(importer.errors)
+        stored_errors.extend(new_errors[:max(MAX_STORED_ERRORS - len(stored_errors), 0)])
+        ImportJob.objects.filter(pk=job.pk).update(
+            rows_processed=last_row,
+            created_count=base['created'] + importer.created,
+            skipped_count=base['skipped'] + importer.skipped,
+            error_count=base['errors'] + len(importer.errors),
+            errors=stored_errors,
+            heartbeat_at=timezone.now(),
+        )
+
+    try:
+        with job.file.open('rb') as csv_file:
+            importer.run(read_csv_rows(csv_file), start_after=job.rows_processed, on_batch=on_batch)
+    except Exception as e:
+        logger.error(f"Import job {job.pk} failed: {str(e)}")
+        ImportJob.objects.filter(pk=job.pk).update(
+            status='failed',
+            message=str(e),
+            finished_at=timezone.now(),
+        )
+        return
+
+    ImportJob.objects.filter(pk=job.pk).update(status='completed', finished_at=timezone.now())
+    logger.info(f"Import job {job.pk} completed: {importer.created} created, {len(importer.errors)} errors")
@@ -0,0 +1,179 @@
+"""
+In-process request metrics, exported in the Prometheus text format.
+
+Every thread records into its own shard (a dict it alone writes), so the
+request path takes no locks; a scrape merges the shards. Shards of
+finished threads are kept, counters never go backwards.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from rest_framework import serializers
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LABELS = ('route', 'action', 'method', 'status')
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_instrumented = False
+_instrument_lock = threading.Lock()
+
+
+def buckets():
+    return tuple(getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_BUCKETS))
+
+
+class RequestStats:
+    """What one request spent, filled in by the SQL wrapper and the serializers"""
+    __slots__ = ('queries', 'query_seconds', 'serializer_seconds', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+
+
+class Series:
+    __slots__ = ('buckets', 'count', 'seconds', 'queries', 'query_seconds', 'serializer_seconds')
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def start_request():
+    stats = _local.request = RequestStats()
+    return stats
+
+
+def current_request():
+    """The RequestStats of the request this thread is handling, or None"""
+    return getattr(_local, 'request', None)
+
+
+def _timed(to_representation):
+    @functools.wraps(to_representation)
+    def timed(serializer, instance):
+        stats = current_request()
+        if stats is None or stats.serializing:
+            # nested and list item serializers count towards the outermost one
+            return to_representation(serializer, instance)
+        stats.serializing = True
+        started = time.perf_counter()
+        try:
+            return to_representation(serializer, instance)
+        finally:
+            stats.serializing = False
+            stats.serializer_seconds += time.perf_counter() - started
+    return timed
+
+
+def instrument_serializers():
+    """
+    Times every top-level serializer into the current request's
+    serializer_seconds, by wrapping DRF's base to_representation once per
+    process, so no serializer has to opt in.
+    """
+    global _instrumented
+    with _instrument_lock:
+        if _instrumented:
+            return
+        for cls in (serializers.Serializer, serializers.ListSerializer):
+            cls.to_representation = _timed(cls.to_representation)
+        _instrumented = True
+
+
+def finish_request(labels, seconds, stats):
+    _local.request = None
+    bounds = buckets()
+    shard = _shard()
+    series = shard.get(labels)
+    if series is None:
+        series = shard[labels] = Series(len(bounds))
+    index = bisect_left(bounds, seconds)
+    if index < len(bounds):
+        series.buckets[index] += 1
+    series.count += 1
+    series.seconds += seconds
+    series.queries += stats.queries
+    series.query_seconds += stats.query_seconds
+    series.serializer_seconds += stats.serializer_seconds
+
+
+def snapshot():
+    """{labels: Series} summed over every thread's shard"""
+    bounds = buckets()
+    with _shards_lock:
+        shards = list(_shards)
+    merged = {}
+    for shard in shards:
+        for labels, series in shard.copy().items():
+            total = merged.get(labels)
+            if total is None:
+                total = merged[labels] = Series(len(bounds))
+            for index, value in enumerate(series.buckets):
+                total.buckets[index] += value
+            total.count += series.count
+            total.seconds += series.seconds
+            total.queries += series.queries
+            total.query_seconds += series.query_seconds
+            total.serializer_seconds += series.serializer_seconds
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(values, **extra):
+    pairs = list(zip(LABELS, values)) + list(extra.items())
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render():
+    """The Prometheus text exposition of every series"""
+    bounds = buckets()
+    series = sorted(snapshot().items())
+    lines = [
+        '# HELP gwm_http_request_duration_seconds Time spent handling the request.',
+        '# TYPE gwm_http_request_duration_seconds histogram',
+    ]
+    for labels, stats in series:
+        cumulative = 0
+        for bound, value in zip(bounds, stats.buckets):
+            cumulative += value
+            lines.append(f'gwm_http_request_duration_seconds_bucket{_labels(labels, le=bound)} {cumulative}')
+        lines.append(f'gwm_http_request_duration_seconds_bucket{_labels(labels, le="+Inf")} {stats.count}')
+        lines.append(f'gwm_http_request_duration_seconds_sum{_labels(labels)} {stats.seconds}')
+        lines.append(f'gwm_http_request_duration_seconds_count{_labels(labels)} {stats.count}')
+
+    counters = [
+        ('gwm_db_queries_total', 'SQL statements run by requests.', 'queries'),
+        ('gwm_db_query_seconds_total', 'Time spent in SQL statements.', 'query_seconds'),
+        ('gwm_serializer_seconds_total', 'Time spent rendering top-level serializers.', 'serializer_seconds'),
+    ]
+    for name, help_text, attr in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for labels, stats in series:
+            lines.append(f'{name}{_labels(labels)} {getattr(stats, attr)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,43 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from gwm_crm.models import Notification, NotificationCounter
+
+
+def unread_count(user_id):
+    """The user's unread count, counting the table once if no counter exists yet"""
+    unread = NotificationCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first()
+    if unread is not None:
+        return unread
+    unread = Notification.objects.filter(user_id=user_id, seen=False).count()
+    try:
+        with transaction.atomic():
+            NotificationCounter.objects.create(user_id=user_id, unread=unread)
+    except IntegrityError:
+        # created concurrently; that one already includes our count
+        return NotificationCounter.objects.get(user_id=user_id).unread
+    return unread
+
+
+def bump(deltas):
+    """
+    Adds {user_id: delta} to existing counters, one UPDATE per distinct
+    delta; missing counters are counted on first read.
+    """
+    by_delta = defaultdict(list)
+    for user_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(user_id)
+    for delta, user_ids in by_delta.items():
+        NotificationCounter.objects.filter(user_id__in=user_ids).update(unread=F('unread') + delta)
+
+
+def record_created(notifications):
+    """Counts rows known to be inserted; with ignore_conflicts, filter them through notifications.inserted first"""
+    bump(Counter(notification.user_id for notification in notifications if not notification.seen))
+
+
+def reset(user_id):
+    NotificationCounter.objects.filter(user_id=user_id).update(unread=0)
@@ -0,0 +1,41 @@
+"""
+Pre-step for the unique_notification_event constraint, which can't be
+added while (user, type, related_object_id) duplicates exist. Run it as
+``migrations.RunPython(collapse_duplicates, migrations.RunPython.noop)``
+just before the AddConstraint, or with
+``manage.py collapse_duplicate_notifications`` before ``migrate``.
+
+Only the notification table is read and written (no model signals), so
+it works before the tables of later models such as the unread counters
+exist.
+"""
+from django.apps import apps as global_apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Exists, OuterRef
+
+BATCH_SIZE = 1000
+
+
+def collapse_duplicates(apps=None, schema_editor=None, batch_size=BATCH_SIZE):
+    """Deletes all but the oldest notification of every event, returns rows deleted"""
+    Notification = (apps or global_apps).get_model('gwm_crm', 'Notification')
+    connection = schema_editor.connection if schema_editor else connections[DEFAULT_DB_ALIAS]
+    older = Notification.objects.filter(
+        user_id=OuterRef('user_id'),
+        type=OuterRef('type'),
+        related_object_id=OuterRef('related_object_id'),
+        id__lt=OuterRef('id'),
+    )
+    duplicates = Notification.objects.using(connection.alias).filter(
+        related_object_id__isnull=False
+    ).filter(Exists(older)).order_by('id').values_list('id', flat=True)
+
+    table = connection.ops.quote_name(Notification._meta.db_table)
+    deleted = 0
+    while True:
+        ids = list(duplicates[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+            deleted += cursor.rowcount
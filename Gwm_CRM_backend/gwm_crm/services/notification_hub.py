@@ -0,0 +1,66 @@
+"""
+In-process pub/sub for live notifications.
+
+Each open stream subscribes with an asyncio queue of size one. Publishing
+only wakes the user's streams; they then read their new rows from the
+database with a primary key range query, so a missed or coalesced wake-up
+never loses a notification. publish() is thread-safe and a no-op when
+nobody is listening, which is always the case under WSGI and in
+management commands (streams pick those up on their next poll).
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+
+class NotificationHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        """Must be called from the event loop that will read the queue"""
+        queue = asyncio.Queue(maxsize=1)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[user_id]
+
+    def publish(self, user_ids):
+        with self._lock:
+            targets = [s for user_id in set(user_ids) for s in self._subscribers.get(user_id, ())]
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_wake, queue)
+            except RuntimeError:
+                # the loop has already been closed
+                pass
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+def _wake(queue):
+    if queue.empty():
+        queue.put_nowait(True)
+
+
+hub = NotificationHub()
+
+
+def publish_on_commit(user_ids):
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: hub.publish(user_ids))
@@ -0,0 +1,108 @@
+"""
+Notification retention: batched pruning of old seen notifications and
+the compressed archive they can be moved to. Every batch is its own
+short transaction so the table is never locked for long. Duplicates
+can't exist under unique_notification_event (see notification_dedupe).
+"""
+import json
+import time
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from gwm_crm.models import Notification, NotificationArchive
+
+# rough per-row cost of the fixed columns and index entries
+ROW_OVERHEAD_BYTES = 96
+ARCHIVE_FIELDS = ('id', 'type', 'title', 'message', 'created_at', 'related_object_id')
+
+
+def retention_days():
+    return getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 90)
+
+
+def batch_size():
+    return getattr(settings, 'NOTIFICATION_RETENTION_BATCH_SIZE', 1000)
+
+
+def _estimate(queryset):
+    stats = queryset.order_by().aggregate(
+        rows=Count('id'),
+        text=Sum(Length('title') + Length('message'), default=0),
+    )
+    return {'rows': stats['rows'], 'bytes': stats['text'] + stats['rows'] * ROW_OVERHEAD_BYTES}
+
+
+def expired(days=None):
+    cutoff = timezone.now() - timedelta(days=retention_days() if days is None else days)
+    return Notification.objects.filter(seen=True, created_at__lt=cutoff)
+
+
+def report(days=None):
+    """Rows and approximate bytes a prune run would reclaim, without changing anything"""
+    return {'expired': _estimate(expired(days))}
+
+
+def _delete_in_batches(queryset, size, pause, archive=False):
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            if archive:
+                archive_rows(Notification.objects.filter(id__in=ids))
+            deleted += Notification.objects.filter(id__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+def prune(days=None, size=None, archive=False, pause=0):
+    """Deletes (or archives) seen notifications older than ``days``, returns rows removed"""
+    return _delete_in_batches(expired(days), size or batch_size(), pause, archive=archive)
+
+
+def archive_rows(queryset):
+    by_user = defaultdict(list)
+    for row in queryset.order_by('id').values('user_id', *ARCHIVE_FIELDS):
+        by_user[row.pop('user_id')].append(row)
+
+    archives = []
+    for user_id, rows in by_user.items():
+        payload = json.dumps(rows, default=str, separators=(',', ':')).encode()
+        archives.append(NotificationArchive(
+            user_id=user_id,
+            count=len(rows),
+            first_created_at=min(row['created_at'] for row in rows),
+            last_created_at=max(row['created_at'] for row in rows),
+            payload=zlib.compress(payload, 9),
+        ))
+    NotificationArchive.objects.bulk_create(archives)
+    return archives
+
+
+def archived_notifications(user_id, limit=50, before=None):
+    """A user's archived notifications, newest first, decompressed on demand"""
+    archives = NotificationArchive.objects.filter(user_id=user_id).order_by('-last_created_at')
+    if before is not None:
+        archives = archives.filter(first_created_at__lt=before)
+
+    results = []
+    for archive in archives.iterator(chunk_size=20):
+        rows = json.loads(zlib.decompress(archive.payload))
+        for row in reversed(rows):
+            row['created_at'] = parse_datetime(row['created_at'])
+            if before is not None and row['created_at'] >= before:
+                continue
+            results.append(row)
+        if len(results) >= limit:
+            break
+    results.sort(key=lambda row: row['created_at'], reverse=True)
+    return results[:limit]
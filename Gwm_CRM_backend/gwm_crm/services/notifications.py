@@ -1,47 +1,140 @@
+"""
+Scheduled notifications. Each sweep finds the (user, object) pairs that
+still lack a notification with one anti-join query and inserts them with
+bulk_create(ignore_conflicts=True); the unique constraint on
+(user, type, related_object_id) makes a repeated or overlapping sweep a
+no-op.
+"""
+import time
 from datetime import timedelta
+
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
+
 from gwm_crm.models import Task, Meeting, Notification
+from gwm_crm.services import notification_counts
+from gwm_crm.services.notification_hub import publish_on_commit
+
+ASSIGNMENT_WINDOW = timedelta(minutes=10)
+DUE_SOON = timedelta(hours=24)
+BATCH_SIZE = 2000
+
+
+def _not_notified(type, user_field, object_field):
+    return ~Exists(Notification.objects.filter(
+        user_id=OuterRef(user_field), type=type, related_object_id=OuterRef(object_field)
+    ))
+
+
+def inserted(notifications):
+    """
+    The notifications bulk_create(ignore_conflicts=True) really inserted;
+    it returns its whole input, conflicts included. Rows are matched back
+    on the unique key plus the created_at this insert gave them. Rows
+    without a related object aren't covered by the key and always go in.
+    """
+    keyed = [n for n in notifications if n.related_object_id is not None]
+    if not keyed:
+        return list(notifications)
+    stored = set(Notification.objects.filter(
+        user_id__in={n.user_id for n in keyed},
+        type__in={n.type for n in keyed},
+        related_object_id__in={n.related_object_id for n in keyed},
+    ).values_list('user_id', 'type', 'related_object_id', 'created_at'))
+    rows, matched = [], set()
+    for n in notifications:
+        key = (n.user_id, n.type, n.related_object_id)
+        if n.related_object_id is not None and (key in matched or (*key, n.created_at) not in stored):
+            continue
+        matched.add(key)
+        rows.append(n)
+    return rows
+
+
+def _write(batch):
+    created = inserted(Notification.objects.bulk_create(batch, ignore_conflicts=True))
+    notification_counts.record_created(created)
+    publish_on_commit(notification.user_id for notification in created)
+    return len(created)
+
 
-def create_notifications():
-    now = timezone.now()
+def _insert(rows, build):
+    """Bulk inserts build(row) for every row in batches, returns rows inserted"""
+    total = 0
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(build(*row))
+        if len(batch) >= BATCH_SIZE:
+            total += _write(batch)
+            batch = []
+    if batch:
+        total += _write(batch)
+    return total
 
-    new_tasks = Task.objects.filter(
-        created_at__gte=now - timedelta(minutes=10),
-        assigned_to__isnull=False
+
+def sweep_task_assigned(now):
+    rows = Task.objects.filter(
+        created_at__gte=now - ASSIGNMENT_WINDOW,
+        assigned_to__isnull=False,
+    ).filter(_not_notified('task_assigned', 'assigned_to_id', 'pk')).order_by().values_list(
+        'id', 'assigned_to_id', 'title'
+    )
+    return _insert(rows, lambda pk, user_id, title: Notification(
+        user_id=user_id,
+        type='task_assigned',
+        title='New Task Assigned',
+        message=f"You have been assigned a task: {title}",
+        related_object_id=pk,
+    ))
+
+
+def sweep_task_due_soon(now):
+    rows = Task.objects.filter(
+        due_date__gte=now,
+        due_date__lte=now + DUE_SOON,
+        assigned_to__isnull=False,
+    ).filter(_not_notified('task_due_soon', 'assigned_to_id', 'pk')).order_by().values_list(
+        'id', 'assigned_to_id', 'title'
+    )
+    return _insert(rows, lambda pk, user_id, title: Notification(
+        user_id=user_id,
+        type='task_due_soon',
+        title='Task Due Soon',
+        message=f"The task '{title}' is due soon!",
+        related_object_id=pk,
+    ))
+
+
+def sweep_meeting_due_soon(now):
+    """Notifies the attendees of meetings starting within the next day"""
+    rows = Meeting.users.through.objects.filter(
+        meeting__date__gte=now,
+        meeting__date__lte=now + DUE_SOON,
+    ).filter(_not_notified('meeting_due_soon', 'user_id', 'meeting_id')).order_by().values_list(
+        'meeting_id', 'user_id', 'meeting__company__name'
     )
+    return _insert(rows, lambda pk, user_id, company_name: Notification(
+        user_id=user_id,
+        type='meeting_due_soon',
+        title='Upcoming Meeting',
+        message=f"You have a meeting with {company_name} soon." if company_name else "You have a meeting soon.",
+        related_object_id=pk,
+    ))
+
+
+SWEEPS = {
+    'task_assigned': sweep_task_assigned,
+    'task_due_soon': sweep_task_due_soon,
+    'meeting_due_soon': sweep_meeting_due_soon,
+}
+
 
-    for task in new_tasks:
-        if not Notification.objects.filter(user=task.assigned_to, type='task_assigned', related_object_id=task.id).exists():
-            Notification.objects.create(
-                user=task.assigned_to,
-                type='task_assigned',
-                title='New Task Assigned',
-                message=f"You have been assigned a task: {task.title}",
-                related_object_id=task.id
-            )
-
-    soon = now + timedelta(hours=24)
-    tasks_due = Task.objects.filter(due_datelte=soon, due_dategte=now, assigned_to__isnull=False)
-    for task in tasks_due:
-        if not Notification.objects.filter(user=task.assigned_to, type='task_due_soon', related_object_id=task.id).exists():
-            Notification.objects.create(
-                user=task.assigned_to,
-                type='task_due_soon',
-                title='Task Due Soon',
-                message=f"The task '{task.title}' is due soon!",
-                related_object_id=task.id
-            )
-
-    meetings_due = Meeting.objects.filter(datelte=soon, dategte=now, company__isnull=False)
-    for meeting in meetings_due:
-        company = meeting.company
-        users = [task.assigned_to for task in company.tasks.filter(assigned_to__isnull=False).distinct()]
-        for user in users:
-            if not Notification.objects.filter(user=user, type='meeting_due_soon', related_object_id=meeting.id).exists():
-                Notification.objects.create(
-                    user=user,
-                    type='meeting_due_soon',
-                    title='Upcoming Meeting',
-                    message=f"You have a meeting with {company.name} soon.",
-                    related_object_id=meeting.id
-                )
\ No newline at end of file
+def create_notifications(now=None):
+    """Runs every sweep once, returns {type: {'created': n, 'seconds': t}}"""
+    now = now or timezone.now()
+    stats = {}
+    for type, sweep in SWEEPS.items():
+        started = time.perf_counter()
+        created = sweep(now)
+        stats[type] = {'created': created, 'seconds': round(time.perf_counter() - started, 4)}
+    return stats
@@ -0,0 +1,161 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from gwm_crm.models import Company, Opportunity, OpportunityRollup
+
+CENTS = Decimal('0.01')
+TRACKED_FIELDS = ('company_id', 'stage', 'expected_close_date', 'expected_value', 'probability')
+
+
+def snapshot(opportunity):
+    return tuple(getattr(opportunity, field) for field in TRACKED_FIELDS)
+
+
+def stored_snapshot(pk):
+    return Opportunity.objects.filter(pk=pk).values_list(*TRACKED_FIELDS).first()
+
+
+def close_month(value):
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def _contribution(values):
+    company_id, stage, expected_close_date, expected_value, probability = values
+    weighted = Decimal(expected_value) * Decimal(probability) / 100
+    return (company_id, stage, close_month(expected_close_date)), (1, expected_value, weighted)
+
+
+def apply_change(before, after):
+    """Moves an opportunity's amounts from its old rollup row to its new one"""
+    deltas = defaultdict(lambda: [0, 0, Decimal(0)])
+    for values, sign in ((before, -1), (after, 1)):
+        if values is None:
+            continue
+        key, amounts = _contribution(values)
+        for i, amount in enumerate(amounts):
+            deltas[key][i] += sign * amount
+    for key, (count, total, weighted) in deltas.items():
+        if count or total or weighted:
+            _apply_delta(key, count, total, weighted)
+
+
+def _apply_delta(key, count, total, weighted):
+    company_id, stage, month = key
+    rows = OpportunityRollup.objects.filter(company_id=company_id, stage=stage, close_month=month)
+    changes = {
+        'count': F('count') + count,
+        'total_value': F('total_value') + total,
+        'weighted_value': F('weighted_value') + weighted,
+    }
+    if rows.update(**changes) or count <= 0:
+        return
+    industry_category = Company.objects.filter(pk=company_id).values_list('industry_category', flat=True).first()
+    if industry_category is None:
+        return
+    try:
+        with transaction.atomic():
+            OpportunityRollup.objects.create(
+                company_id=company_id, industry_category=industry_category, stage=stage,
+                close_month=month, count=count, total_value=total, weighted_value=weighted,
+            )
+    except IntegrityError:
+        rows.update(**changes)
+
+
+def sync_industry(company):
+    OpportunityRollup.objects.filter(company_id=company.pk).exclude(
+        industry_category=company.industry_category
+    ).update(industry_category=company.industry_category)
+
+
+def rebuild(company_ids=None):
+    """Recomputes rollup rows from the opportunities table, returns rows written"""
+    opportunities = Opportunity.objects.order_by()
+    rollups = OpportunityRollup.objects.all()
+    if company_ids is not None:
+        opportunities = opportunities.filter(company_id__in=company_ids)
+        rollups = rollups.filter(company_id__in=company_ids)
+
+    # divided by 100 in Python: integer division on some backends drops the cents
+    weighted = ExpressionWrapper(
+        F('expected_value') * F('probability'),
+        output_field=DecimalField(max_digits=24, decimal_places=2),
+    )
+    grouped = opportunities.annotate(close_month=TruncMonth('expected_close_date')).values(
+        'company_id', 'company__industry_category', 'stage', 'close_month'
+    ).annotate(
+        count=Count('id'),
+        total_value=Sum('expected_value'),
+        weighted_value=Sum(weighted),
+    )
+
+    rows = [
+        OpportunityRollup(
+            company_id=row['company_id'],
+            industry_category=row['company__industry_category'],
+            stage=row['stage'],
+            close_month=row['close_month'].date() if hasattr(row['close_month'], 'date') else row['close_month'],
+            count=row['count'],
+            total_value=row['total_value'] or 0,
+            weighted_value=Decimal(row['weighted_value'] or 0) / 100,
+        )
+        for row in grouped
+    ]
+    with transaction.atomic():
+        rollups.delete()
+        OpportunityRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _group(rollups, field):
+    rows = rollups.values(field).annotate(
+        count=Sum('count'),
+        total_value=Sum('total_value'),
+        weighted_value=Sum('weighted_value'),
+    ).order_by(field)
+    return [
+        {
+            field: row[field],
+            'count': row['count'],
+            'total_value': row['total_value'],
+            'weighted_value': Decimal(row['weighted_value']).quantize(CENTS),
+        }
+        for row in rows
+        if row['count']
+    ]
+
+
+def pipeline(company_id=None, date_from=None, date_to=None):
+    """
+    Pipeline totals grouped by stage, close month and industry. Date
+    filters apply at month granularity to expected_close_date.
+    """
+    rollups = OpportunityRollup.objects.all()
+    if company_id is not None:
+        rollups = rollups.filter(company_id=company_id)
+    if date_from is not None:
+        rollups = rollups.filter(close_month__gte=date_from.replace(day=1))
+    if date_to is not None:
+        rollups = rollups.filter(close_month__lte=date_to)
+
+    totals = rollups.aggregate(
+        count=Sum('count', default=0),
+        total_value=Sum('total_value', default=0),
+        weighted_value=Sum('weighted_value', default=0),
+    )
+    totals['weighted_value'] = Decimal(totals['weighted_value']).quantize(CENTS)
+    return {
+        'totals': totals,
+        'by_stage': _group(rollups, 'stage'),
+        'by_month': _group(rollups, 'close_month'),
+        'by_industry': _group(rollups, 'industry_category'),
+    }
@@ -0,0 +1,184 @@
+"""
+Full-text search over companies, contacts and interactions.
+
+On SQLite the documents live in an FTS5 table kept in sync by the
+signals in gwm_crm.signals. The rowid encodes the object, ``id * 4 + kind``,
+so updates and deletes are primary key operations. Other databases fall
+back to unranked icontains lookups.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from gwm_crm.models import Company, Contact, Interaction
+
+TABLE = 'gwm_crm_search'
+BATCH_SIZE = 2000
+
+KINDS = {
+    'company': 1,
+    'contact': 2,
+    'interaction': 3,
+}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+
+
+def _documents_company(queryset):
+    for pk, name, notes in queryset.values_list('id', 'name', 'notes').iterator(chunk_size=BATCH_SIZE):
+        yield pk, pk, name, notes
+
+
+def _documents_contact(queryset):
+    rows = queryset.values_list(
+        'id', 'company_id', 'full_name', 'position', 'company_email', 'personal_email', 'address'
+    ).iterator(chunk_size=BATCH_SIZE)
+    for pk, company_id, full_name, position, company_email, personal_email, address in rows:
+        yield pk, company_id, full_name, ' '.join([position, company_email, personal_email, address])
+
+
+def _documents_interaction(queryset):
+    rows = queryset.values_list('id', 'company_id', 'type', 'summary').iterator(chunk_size=BATCH_SIZE)
+    for pk, company_id, type, summary in rows:
+        yield pk, company_id, type, summary
+
+
+SOURCES = {
+    'company': (Company, _documents_company),
+    'contact': (Contact, _documents_contact),
+    'interaction': (Interaction, _documents_interaction),
+}
+MODEL_KINDS = {model: kind for kind, (model, _) in SOURCES.items()}
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def _rowid(kind, pk):
+    return pk * 4 + KINDS[kind]
+
+
+def ensure_index(drop=False):
+    if not uses_fts():
+        return
+    with connection.cursor() as cursor:
+        if drop:
+            cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            f"company_id UNINDEXED, title, body, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+
+def _write(cursor, kind, documents):
+    rows = [(_rowid(kind, pk), company_id, title or '', body or '') for pk, company_id, title, body in documents]
+    if rows:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, company_id, title, body) VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+    return len(rows)
+
+
+def index_objects(model, pks):
+    """(Re)indexes the given rows of a searchable model"""
+    if not uses_fts():
+        return
+    kind = MODEL_KINDS[model]
+    _, documents = SOURCES[kind]
+    with connection.cursor() as cursor:
+        _write(cursor, kind, documents(model.objects.filter(pk__in=list(pks))))
+
+
+def remove_objects(model, pks):
+    if not uses_fts():
+        return
+    kind = MODEL_KINDS[model]
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(_rowid(kind, pk),) for pk in pks])
+
+
+def rebuild_index():
+    """Recreates the whole index with batched inserts, returns rows per kind"""
+    counts = {}
+    with transaction.atomic():
+        ensure_index(drop=True)
+        with connection.cursor() as cursor:
+            for kind, (model, documents) in SOURCES.items():
+                counts[kind] = 0
+                batch = []
+                for document in documents(model.objects.all()):
+                    batch.append(document)
+                    if len(batch) >= BATCH_SIZE:
+                        counts[kind] += _write(cursor, kind, batch)
+                        batch = []
+                counts[kind] += _write(cursor, kind, batch)
+            cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+    return counts
+
+
+def _match_expression(query):
+    """Turns free text into an FTS5 query: every word must match, as a prefix"""
+    terms = re.findall(r'\w+', query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search(query, kinds=None, limit=20, offset=0):
+    """
+    Returns up to ``limit`` results ranked across all kinds, each a dict
+    with type, id, company_id, title, snippet and score (lower is better).
+    """
+    kinds = [kind for kind in (kinds or KINDS) if kind in KINDS]
+    expression = _match_expression(query)
+    if not expression or not kinds:
+        return []
+    if not uses_fts():
+        return _fallback_search(query, kinds, limit, offset)
+
+    kind_filter = ', '.join(str(KINDS[kind]) for kind in kinds)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, company_id, title, "
+            f"snippet({TABLE}, 2, '[', ']', '...', 12), bm25({TABLE}, 0.0, 10.0, 1.0) AS score "
+            f"FROM {TABLE} WHERE {TABLE} MATCH %s AND (rowid %% 4) IN ({kind_filter}) "
+            f"ORDER BY score LIMIT %s OFFSET %s",
+            [expression, limit, offset],
+        )
+        rows = cursor.fetchall()
+
+    return [
+        {
+            'type': KIND_NAMES[rowid % 4],
+            'id': rowid // 4,
+            'company_id': company_id,
+            'title': title,
+            'snippet': snippet,
+            'score': round(score, 4),
+        }
+        for rowid, company_id, title, snippet, score in rows
+    ]
+
+
+def _fallback_search(query, kinds, limit, offset):
+    lookups = {
+        'company': ['name', 'notes'],
+        'contact': ['full_name', 'position', 'company_email', 'personal_email', 'address'],
+        'interaction': ['type', 'summary'],
+    }
+    results = []
+    for kind in kinds:
+        model, documents = SOURCES[kind]
+        condition = Q()
+        for field in lookups[kind]:
+            condition |= Q(**{f'{field}__icontains': query})
+        for pk, company_id, title, body in documents(model.objects.filter(condition)[:offset + limit]):
+            results.append({
+                'type': kind,
+                'id': pk,
+                'company_id': company_id,
+                'title': title,
+                'snippet': (body or '')[:120],
+                'score': None,
+            })
+    return results[offset:offset + limit]
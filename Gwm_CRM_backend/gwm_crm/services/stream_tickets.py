@@ -0,0 +1,38 @@
+"""
+Single-use tickets for opening the notification stream. EventSource can't
+send an Authorization header, and a bearer token in the query string ends
+up in access logs, so clients trade their token for a ticket that is
+signed (any worker can check it), expires after
+NOTIFICATION_STREAM_TICKET_SECONDS and is redeemed once. Reuse is caught
+through the cache, across workers when it is shared (REDIS_URL).
+"""
+import secrets
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+_signer = signing.TimestampSigner(salt='gwm_crm.notification-stream')
+
+
+def lifetime():
+    return getattr(settings, 'NOTIFICATION_STREAM_TICKET_SECONDS', 30)
+
+
+def issue(user_id, expires_at):
+    """A ticket for the user's stream, which ends at ``expires_at`` (epoch seconds)"""
+    return _signer.sign_object({'user': user_id, 'exp': expires_at, 'nonce': secrets.token_urlsafe(16)})
+
+
+def redeem(ticket):
+    """(user_id, expires_at) for a valid ticket not used before, else None"""
+    try:
+        payload = _signer.unsign_object(ticket, max_age=lifetime())
+    except signing.BadSignature:
+        return None
+    if payload['exp'] <= time.time():
+        return None
+    if not cache.add(f"stream-ticket:{payload['nonce']}", True, timeout=lifetime()):
+        return None
+    return payload['user'], payload['exp']
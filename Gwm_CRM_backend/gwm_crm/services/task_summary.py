@@ -0,0 +1,164 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from gwm_crm.models import Task, TaskSummary
+
+TRACKED_FIELDS = ('assigned_to_id', 'created_by_id', 'status', 'priority')
+OPEN_STATUSES = ['open', 'in_progress']
+DUE_SOON = timedelta(days=3)
+
+
+def summary_keys(values):
+    """Summary rows a task with (assigned_to_id, created_by_id, status, priority) counts towards"""
+    if values is None:
+        return []
+    assigned_to_id, created_by_id, status, priority = values
+    keys = [(assigned_to_id, 'assigned', status, priority)]
+    if created_by_id is not None:
+        keys.append((created_by_id, 'created', status, priority))
+    return keys
+
+
+def snapshot(task):
+    return tuple(getattr(task, field) for field in TRACKED_FIELDS)
+
+
+def stored_snapshot(pk):
+    return Task.objects.filter(pk=pk).values_list(*TRACKED_FIELDS).first()
+
+
+def apply_change(before, after):
+    """Moves a task's counts from its old summary rows to its new ones"""
+    deltas = Counter()
+    for key in summary_keys(before):
+        deltas[key] -= 1
+    for key in summary_keys(after):
+        deltas[key] += 1
+    for key, delta in deltas.items():
+        if delta:
+            _apply_delta(key, delta)
+
+
+def _apply_delta(key, delta):
+    user_id, role, status, priority = key
+    rows = TaskSummary.objects.filter(user_id=user_id, role=role, status=status, priority=priority)
+    if rows.update(count=F('count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            TaskSummary.objects.create(user_id=user_id, role=role, status=status, priority=priority, count=delta)
+    except IntegrityError:
+        rows.update(count=F('count') + delta)
+
+
+def release_user(user_id):
+    """
+    Deleting a user nulls assigned_to/created_by on their tasks with a
+    queryset update, which sends no Task signals: their 'assigned' counts
+    move to the unassigned rows and their 'created' rows go.
+    """
+    rows = TaskSummary.objects.filter(user_id=user_id)
+    for status, priority, count in rows.filter(role='assigned', count__gt=0).values_list('status', 'priority', 'count'):
+        _apply_delta((None, 'assigned', status, priority), count)
+    rows.delete()
+
+
+def dashboard_from_summaries(user, now):
+    """
+    Dashboard numbers from the summary table (one small aggregate) plus one
+    aggregate over the (status, due_date) index for the time windows.
+    """
+    assigned = Q(role='assigned')
+    counts = TaskSummary.objects.aggregate(
+        total=Sum('count', filter=assigned, default=0),
+        open=Sum('count', filter=assigned & Q(status='open'), default=0),
+        in_progress=Sum('count', filter=assigned & Q(status='in_progress'), default=0),
+        closed=Sum('count', filter=assigned & Q(status='closed'), default=0),
+        high_priority=Sum('count', filter=assigned & Q(priority='high'), default=0),
+        assigned_tasks=Sum('count', filter=assigned & Q(user=user), default=0),
+        created_tasks=Sum('count', filter=Q(role='created', user=user), default=0),
+    )
+    windows = Task.objects.filter(
+        Q(due_date__gte=now, due_date__lte=now + DUE_SOON) |
+        Q(due_date__lt=now, status__in=OPEN_STATUSES)
+    ).aggregate(
+        due_soon=Count('id', filter=Q(due_date__gte=now)),
+        overdue=Count('id', filter=Q(due_date__lt=now)),
+    )
+    return _shape({**counts, **windows})
+
+
+def dashboard_from_queryset(queryset, user, now):
+    """The same numbers from any task queryset, in one conditional aggregate"""
+    counts = queryset.order_by().aggregate(
+        total=Count('id'),
+        open=Count('id', filter=Q(status='open')),
+        in_progress=Count('id', filter=Q(status='in_progress')),
+        closed=Count('id', filter=Q(status='closed')),
+        high_priority=Count('id', filter=Q(priority='high')),
+        due_soon=Count('id', filter=Q(due_date__gte=now, due_date__lte=now + DUE_SOON)),
+        overdue=Count('id', filter=Q(due_date__lt=now, status__in=OPEN_STATUSES)),
+        assigned_tasks=Count('id', filter=Q(assigned_to=user)),
+        created_tasks=Count('id', filter=Q(created_by=user)),
+    )
+    return _shape(counts)
+
+
+def _shape(counts):
+    return {
+        'total': counts['total'],
+        'open': counts['open'],
+        'in_progress': counts['in_progress'],
+        'closed': counts['closed'],
+        'high_priority': counts['high_priority'],
+        'due_soon': counts['due_soon'],
+        'overdue': counts['overdue'],
+        'user_stats': {
+            'assigned_tasks': counts['assigned_tasks'],
+            'created_tasks': counts['created_tasks'],
+        }
+    }
+
+
+def expected_summaries():
+    expected = Counter()
+    for role, field in (('assigned', 'assigned_to_id'), ('created', 'created_by_id')):
+        rows = Task.objects.order_by().values_list(field, 'status', 'priority').annotate(n=Count('id'))
+        if role == 'created':
+            rows = rows.filter(created_by__isnull=False)
+        for user_id, status, priority, n in rows:
+            expected[(user_id, role, status, priority)] = n
+    return expected
+
+
+def reconcile():
+    """Rewrites summary rows that drifted from the tasks table, returns how many changed"""
+    with transaction.atomic():
+        expected = expected_summaries()
+        current = {}
+        to_update, to_delete = [], []
+        for row in TaskSummary.objects.all():
+            key = (row.user_id, row.role, row.status, row.priority)
+            if key in current:
+                # NULL users aren't covered by the unique constraint
+                to_delete.append(row.pk)
+                continue
+            current[key] = row
+
+        for key, row in current.items():
+            if key not in expected:
+                to_delete.append(row.pk)
+            elif row.count != expected[key]:
+                row.count = expected[key]
+                to_update.append(row)
+        to_create = [
+            TaskSummary(user_id=key[0], role=key[1], status=key[2], priority=key[3], count=n)
+            for key, n in expected.items() if key not in current
+        ]
+        TaskSummary.objects.filter(pk__in=to_delete).delete()
+        TaskSummary.objects.bulk_update(to_update, ['count'])
+        TaskSummary.objects.bulk_create(to_create)
+    return len(to_update) + len(to_delete) + len(to_create)
@@ -0,0 +1,35 @@
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+
+from gwm_crm.models import CollectionVersion
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def collection_generation(model):
+    """
+    Per-model counter for the changes Max(updated_at) can't see: deletes,
+    foreign keys a delete sets to NULL, and queryset .update() calls that
+    don't set updated_at (their callers bump it). It's a database row, so
+    all workers agree and a rolled back change leaves it as it was.
+    """
+    return CollectionVersion.objects.filter(pk=_label(model)).values_list('generation', flat=True).first() or 0
+
+
+def bump_collection(*models):
+    for model in models:
+        rows = CollectionVersion.objects.filter(pk=_label(model))
+        if rows.update(generation=F('generation') + 1):
+            continue
+        try:
+            with transaction.atomic():
+                CollectionVersion.objects.create(pk=_label(model), generation=1)
+        except IntegrityError:
+            rows.update(generation=F('generation') + 1)
+
+
+def nulled_by_delete(model):
+    """Models whose foreign keys to ``model`` are set to NULL when one of its rows is deleted"""
+    return {rel.related_model for rel in model._meta.related_objects if rel.on_delete is models.SET_NULL}
@@ -1,8 +1,21 @@
-from django.db.models.signals import post_save, pre_save, m2m_changed
+from django.conf import settings
+from django.db import transaction
+from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_init, post_save, pre_save, pre_delete, post_delete, m2m_changed
+from django.core.signals import request_started
 from django.dispatch import receiver
 from django.utils import timezone
-from .models import Task, Meeting
-from .utils import create_notification
+from .models import Company, Contact, Opportunity, Product, Interaction, InteractionDocument, Task, Meeting, Notification, ContactDocument
+from .utils import create_notification, bulk_create_notifications
+from .services.company_cache import bump_versions
+from .services import search
+from .services.versions import bump_collection, nulled_by_delete
+from .services import task_summary
+from .services import pipeline
+from .services import notification_counts
+from .services.notification_hub import publish_on_commit
+from .services import import_jobs
 
 @receiver(post_save, sender=Task)
 def handle_task_notifications(sender, instance, created, **kwargs):
@@ -67,42 +80,281 @@ def handle_task_notifications(sender, instance, created, **kwargs):
 #         import logging
 #         logging.error(f"Meeting notification error: {str(e)}")
 
-@receiver(post_save, sender=Meeting)
-def handle_new_meeting(sender, instance, created, **kwargs):
-    """Handle initial meeting creation"""
-    if created:
-        for user in instance.users.all():
-            _create_meeting_notifications(instance, user)
-
 @receiver(m2m_changed, sender=Meeting.users.through)
-def handle_meeting_attendees(sender, instance, action, pk_set, **kwargs):
-    """Handle when users are added to meetings"""
-    if action == "post_add":
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        for user_id in pk_set:
-            user = User.objects.get(pk=user_id)
-            _create_meeting_notifications(instance, user)
-
-def _create_meeting_notifications(meeting, user):
-    """Shared notification creation logic"""
+def handle_meeting_attendees(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Notifies attendees as they are added, from either side of the relation.
+    A new meeting has none when it is saved (the API sets users after
+    save()), so this is also what notifies for new meetings.
+    """
+    if action != "post_add" or not pk_set:
+        return
+    if reverse:
+        _schedule_fan_out(list(pk_set), [instance.pk])
+    else:
+        _schedule_fan_out([instance.pk], list(pk_set))
+
+def _schedule_fan_out(meeting_ids, user_ids):
+    if getattr(settings, 'MEETING_NOTIFICATIONS_ON_COMMIT', False):
+        transaction.on_commit(lambda: _fan_out_meeting_notifications(meeting_ids, user_ids))
+    else:
+        _fan_out_meeting_notifications(meeting_ids, user_ids)
+
+def _fan_out_meeting_notifications(meeting_ids, user_ids):
+    """Notifies every (meeting, user) pair with one read and one bulk insert"""
     try:
-        create_notification(
-            user=user,
-            title="New Meeting Scheduled",
-            message=f"Meeting on {meeting.date.strftime('%b %d, %Y')}",
-            notification_type='meeting_scheduled',
-            related_object_id=meeting.id
-        )
-        
-        if meeting.date <= timezone.now() + timezone.timedelta(hours=24):
-            create_notification(
-                user=user,
-                title="Meeting Reminder",
-                message=f"'{meeting.title}' starts soon",
-                notification_type='meeting_reminder',
-                related_object_id=meeting.id
-            )
+        now = timezone.now()
+        notifications = []
+        for meeting in Meeting.objects.filter(pk__in=meeting_ids, date__isnull=False).only('id', 'date'):
+            for user_id in user_ids:
+                notifications.extend(_meeting_notifications(meeting, user_id, now))
+        bulk_create_notifications(notifications)
     except Exception as e:
         import logging
-        logging.error(f"Meeting notification error for user {user.id}: {str(e)}")
\ No newline at end of file
+        logging.error(f"Meeting notification error for meetings {meeting_ids}: {str(e)}")
+
+def _meeting_notifications(meeting, user_id, now):
+    """Unsaved notifications for one attendee; meetings without a date get none"""
+    when = meeting.date.strftime('%b %d, %Y')
+    notifications = [Notification(
+        user_id=user_id,
+        title="New Meeting Scheduled",
+        message=f"Meeting on {when}",
+        type='meeting_scheduled',
+        related_object_id=meeting.id,
+    )]
+    if meeting.date <= now + timezone.timedelta(hours=24):
+        notifications.append(Notification(
+            user_id=user_id,
+            title="Meeting Reminder",
+            message=f"Meeting on {when} starts soon",
+            type='meeting_reminder',
+            related_object_id=meeting.id,
+        ))
+    return notifications
+
+@receiver([post_save, post_delete], sender=Company)
+def invalidate_company_detail(sender, instance, **kwargs):
+    bump_versions([instance.pk])
+
+@receiver(pre_save, sender=Contact)
+@receiver(pre_save, sender=Opportunity)
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Interaction)
+@receiver(pre_save, sender=Task)
+@receiver(pre_save, sender=Meeting)
+def remember_parent_company(sender, instance, raw=False, update_fields=None, **kwargs):
+    """A row moved to another company leaves the old one's document too"""
+    instance._company_before = None
+    if raw or instance._state.adding or (update_fields is not None and 'company' not in update_fields):
+        return
+    instance._company_before = sender.objects.filter(pk=instance.pk).values_list('company_id', flat=True).first()
+
+@receiver([post_save, post_delete], sender=Contact)
+@receiver([post_save, post_delete], sender=Opportunity)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Interaction)
+@receiver([post_save, post_delete], sender=Task)
+@receiver([post_save, post_delete], sender=Meeting)
+def invalidate_parent_company_detail(sender, instance, **kwargs):
+    """Any change to a nested row changes the company's detail document"""
+    bump_versions([instance.company_id, getattr(instance, '_company_before', None)])
+
+@receiver([post_save, post_delete], sender=InteractionDocument)
+def invalidate_interaction_company_detail(sender, instance, **kwargs):
+    bump_versions(
+        Interaction.objects.filter(pk=instance.interaction_id).values_list('company_id', flat=True)
+    )
+
+@receiver(m2m_changed, sender=Meeting.users.through)
+def invalidate_meeting_company_detail(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_versions([instance.company_id])
+    elif pk_set:
+        bump_versions(Meeting.objects.filter(pk__in=pk_set).values_list('company_id', flat=True))
+
+# the user fields company details show, through the nested UserSerializer
+NESTED_USER_FIELDS = ('email', 'first_name', 'last_name', 'company_id')
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_nested_user_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._nested_before = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not {field.removesuffix('_id') for field in NESTED_USER_FIELDS} & set(update_fields):
+        return
+    instance._nested_before = sender.objects.filter(pk=instance.pk).values_list(*NESTED_USER_FIELDS).first()
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_company_details(sender, instance, created, **kwargs):
+    """Users are nested in tasks and meetings; only a change to what they show there matters"""
+    before = getattr(instance, '_nested_before', None)
+    if created or before is None or before == tuple(getattr(instance, field) for field in NESTED_USER_FIELDS):
+        return
+    bump_versions(
+        Company.objects.filter(
+            Q(tasks__created_by=instance) | Q(meetings__users=instance)
+        ).values_list('pk', flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Contact)
+@receiver(post_save, sender=Interaction)
+def update_search_index(sender, instance, **kwargs):
+    search.index_objects(sender, [instance.pk])
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Contact)
+@receiver(post_delete, sender=Interaction)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_objects(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Contact)
+@receiver(post_delete, sender=Opportunity)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Interaction)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Meeting)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def bump_collection_version(sender, instance, **kwargs):
+    """Deletes, and the foreign keys they set to NULL, don't show up in Max(updated_at)"""
+    bump_collection(sender, *nulled_by_delete(sender))
+
+@receiver(m2m_changed, sender=Meeting.users.through)
+def touch_meeting_attendees(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    meeting_ids = pk_set if reverse else [instance.pk]
+    if reverse and action == 'post_clear':
+        meeting_ids = None
+    if meeting_ids:
+        Meeting.objects.filter(pk__in=meeting_ids).update(updated_at=timezone.now())
+
+@receiver([post_save, post_delete], sender=InteractionDocument)
+def touch_interaction_documents(sender, instance, **kwargs):
+    Interaction.objects.filter(pk=instance.interaction_id).update(updated_at=timezone.now())
+
+
+@receiver(pre_save, sender=Task)
+def remember_task_summary_values(sender, instance, raw=False, **kwargs):
+    instance._summary_before = None if raw or instance.pk is None else task_summary.stored_snapshot(instance.pk)
+
+@receiver(post_save, sender=Task)
+def update_task_summaries(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    task_summary.apply_change(getattr(instance, '_summary_before', None), task_summary.snapshot(instance))
+
+@receiver(post_delete, sender=Task)
+def remove_task_from_summaries(sender, instance, **kwargs):
+    task_summary.apply_change(task_summary.snapshot(instance), None)
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def release_user_task_summaries(sender, instance, **kwargs):
+    task_summary.release_user(instance.pk)
+
+@receiver(pre_save, sender=Opportunity)
+def remember_pipeline_values(sender, instance, raw=False, **kwargs):
+    instance._pipeline_before = None if raw or instance.pk is None else pipeline.stored_snapshot(instance.pk)
+
+@receiver(post_save, sender=Opportunity)
+def update_pipeline_rollups(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pipeline.apply_change(getattr(instance, '_pipeline_before', None), pipeline.snapshot(instance))
+
+@receiver(post_delete, sender=Opportunity)
+def remove_opportunity_from_rollups(sender, instance, **kwargs):
+    pipeline.apply_change(pipeline.snapshot(instance), None)
+
+@receiver(post_save, sender=Company)
+def update_rollup_industry(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        pipeline.sync_industry(instance)
+
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not instance.seen:
+        notification_counts.bump({instance.user_id: 1})
+        publish_on_commit([instance.user_id])
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not instance.seen:
+        notification_counts.bump({instance.user_id: -1})
+
+def _file_fields(model):
+    return [field for field in model._meta.concrete_fields if isinstance(field, models.FileField)]
+
+def _release_on_commit(storage, name):
+    transaction.on_commit(lambda: storage.delete(name))
+
+def _loaded_file_names(instance):
+    # the raw value, to not turn deferred fields into queries
+    return {
+        field.attname: getattr(instance.__dict__[field.attname], 'name', instance.__dict__[field.attname])
+        for field in _file_fields(type(instance)) if field.attname in instance.__dict__
+    }
+
+@receiver(post_init, sender=Company)
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=Meeting)
+@receiver(post_init, sender=ContactDocument)
+@receiver(post_init, sender=InteractionDocument)
+def remember_stored_files(sender, instance, **kwargs):
+    instance._stored_files = _loaded_file_names(instance)
+
+@receiver(pre_save, sender=Company)
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Meeting)
+@receiver(pre_save, sender=ContactDocument)
+@receiver(pre_save, sender=InteractionDocument)
+def find_replaced_files(sender, instance, raw=False, update_fields=None, **kwargs):
+    """FileField values the save replaces: a different name, or a new upload (which adds a reference)"""
+    instance._replaced_files = []
+    if raw or instance._state.adding:
+        return
+    stored = getattr(instance, '_stored_files', {})
+    fields = [field for field in _file_fields(sender) if update_fields is None or field.name in update_fields]
+    missing = [field.attname for field in fields if field.attname not in stored]
+    if missing:
+        values = sender.objects.filter(pk=instance.pk).values_list(*missing).first() or ()
+        stored = {**stored, **dict(zip(missing, values))}
+    for field in fields:
+        old, file = stored.get(field.attname), getattr(instance, field.attname)
+        if old and (file.name != old or not file._committed):
+            instance._replaced_files.append((file.storage, old))
+
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Meeting)
+@receiver(post_save, sender=ContactDocument)
+@receiver(post_save, sender=InteractionDocument)
+def release_replaced_files(sender, instance, raw=False, **kwargs):
+    for storage, name in getattr(instance, '_replaced_files', ()):
+        _release_on_commit(storage, name)
+    instance._replaced_files = []
+    instance._stored_files = _loaded_file_names(instance)
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Meeting)
+@receiver(post_delete, sender=ContactDocument)
+@receiver(post_delete, sender=InteractionDocument)
+def release_files(sender, instance, **kwargs):
+    """Hands deleted rows' files back to storage once the delete is committed"""
+    for field in _file_fields(sender):
+        file = getattr(instance, field.attname)
+        if file:
+            _release_on_commit(file.storage, file.name)
+
+
+@receiver(request_started)
+def start_import_watchdog(sender, **kwargs):
+    # serving processes resume the import jobs a restart left behind
+    import_jobs.start_watchdog()
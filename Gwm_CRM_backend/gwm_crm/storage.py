@@ -0,0 +1,153 @@
+"""
+Content-addressed media storage.
+
+Every file is stored once per distinct content under
+``blobs/<aa>/<bb>/<sha256>``. The names saved in FileFields look like
+``cas/<sha256>/<original filename>``, so the filename still shows in the
+database and in downloads while identical uploads share one blob. The
+Blob table counts references: saving adds one, delete() removes one, and
+the blob file goes away with the last reference.
+
+References follow the rows, not the calls: saves of the models holding
+FileFields run in a transaction (models.StoredFilesModel), so a failed
+save rolls its new reference back, and gwm_crm.signals releases a
+replaced or deleted file's reference once the change is committed.
+
+URLs keep the logical name, ``MEDIA_URL`` + ``cas/<sha256>/<filename>``,
+so the filename and the content type it implies survive proxying. The
+server maps them onto the blob: gwm_crm.views.media_blob under DEBUG,
+and in nginx for example
+
+    location ~ ^/media/cas/(..)(..)([0-9a-f]+)/ {
+        alias /srv/gwm/media/blobs/$1/$2/$1$2$3;
+    }
+
+Names from before this storage (plain upload_to paths) keep working and
+are deleted as ordinary files; ``manage.py dedupe_media`` converts them.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.text import get_valid_filename
+
+PREFIX = 'cas/'
+BLOB_DIR = 'blobs'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def split_name(name):
+    """(digest, filename) for a content-addressed name, else None"""
+    if not name or not name.startswith(PREFIX):
+        return None
+    digest, _, filename = name[len(PREFIX):].partition('/')
+    return digest, filename
+
+
+def blob_name(digest):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def path(self, name):
+        parts = split_name(name)
+        if parts is not None:
+            name = blob_name(parts[0])
+        return super().path(name)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        validate_file_name(name, allow_relative_path=True)
+        name = self._store(name, content, max_length)
+        validate_file_name(name, allow_relative_path=True)
+        return name
+
+    def _store(self, name, content, max_length=None):
+        """Hashes the content as it is written to a temp file, then files it under its digest"""
+        blobs_root = super().path(BLOB_DIR)
+        os.makedirs(blobs_root, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            source = content.temporary_file_path()
+            digest = file_digest(source)
+            size = os.path.getsize(source)
+        else:
+            hasher = hashlib.sha256()
+            size = 0
+            fd, source = tempfile.mkstemp(dir=blobs_root, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    hasher.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+
+        add_reference(digest, size)
+        target = super().path(blob_name(digest))
+        if os.path.exists(target):
+            if not hasattr(content, 'temporary_file_path'):
+                os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            file_move_safe(source, target, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(target, self.file_permissions_mode)
+
+        return self.logical_name(digest, os.path.basename(name), max_length)
+
+    def logical_name(self, digest, filename, max_length=None):
+        filename = get_valid_filename(filename) or 'file'
+        name = f'{PREFIX}{digest}/{filename}'
+        if max_length and len(name) > max_length:
+            stem, ext = os.path.splitext(filename)
+            keep = max(max_length - len(PREFIX) - len(digest) - 1 - len(ext), 1)
+            name = f'{PREFIX}{digest}/{stem[:keep]}{ext}'[:max_length]
+        return name
+
+    def delete(self, name):
+        parts = split_name(name)
+        if parts is None:
+            return super().delete(name)
+        if release_reference(parts[0]):
+            super().delete(blob_name(parts[0]))
+
+
+def add_reference(digest, size, count=1):
+    from gwm_crm.models import Blob
+
+    if Blob.objects.filter(pk=digest).update(refcount=F('refcount') + count):
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(digest=digest, size=size, refcount=count)
+    except IntegrityError:
+        Blob.objects.filter(pk=digest).update(refcount=F('refcount') + count)
+
+
+def release_reference(digest):
+    """Drops one reference, returns True when the blob has none left"""
+    from gwm_crm.models import Blob
+
+    Blob.objects.filter(pk=digest, refcount__gt=0).update(refcount=F('refcount') - 1)
+    deleted, _ = Blob.objects.filter(pk=digest, refcount__lte=0).delete()
+    return bool(deleted)
@@ -0,0 +1,21 @@
+import os
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """
+    Runs the tests with the query inspector in 'strict' mode (unless
+    QUERY_INSPECTOR_MODE is set), so a view going over its query_budget
+    fails the test that requested it.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.query_inspector = override_settings(QUERY_INSPECTOR_MODE=os.environ.get('QUERY_INSPECTOR_MODE') or 'strict')
+        self.query_inspector.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.query_inspector.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1042 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_save
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from authentication.authentication import UserRefreshToken
+
+from .models import (Blob, Company, Contact, ContactDocument, ImportJob, Interaction, Meeting, Notification, Opportunity, OpportunityRollup,
+                     Product, Task, UploadSession)
+from .services import search
+from .services import (chunked_uploads, company_cache, import_jobs, metrics, notification_counts, notification_retention, notifications,
+                       pipeline, task_summary)
+from . import eager_loading
+from .serializers import CompanyDetailSerializer, CompanySerializer
+from .services.exports import iter_csv_rows
+from .services.notification_dedupe import collapse_duplicates
+from .storage import split_name
+from .utils import bulk_create_notifications
+from .middleware import QueryBudgetExceeded
+from .views import (CompanyViewSet, ContactViewSet, InteractionViewSet, MeetingViewSet, OpportunityViewSet, ProductViewSet,
+                    media_blob)
+from .services.company_import import import_companies
+
+CSV_HEADER = 'name,website,country,industry_category,activity_level,acquired_via,lead_score,notes\n'
+
+
+def make_company(name='Acme', **kwargs):
+    values = {
+        'website': f'https://{name.lower()}.example.com', 'country': 'a', 'industry_category': 1,
+        'activity_level': 'active', 'acquired_via': 'web', 'lead_score': 10, 'notes': '',
+    }
+    values.update(kwargs)
+    return Company.objects.create(name=name, **values)
+
+
+def make_user(email, **kwargs):
+    return get_user_model().objects.create_user(email=email, password=None, first_name='A', last_name='B', **kwargs)
+
+
+def company_csv(count, start=0):
+    rows = ''.join(
+        f'Company {i},https://c{i}.example.com,a,1,active,web,{i % 100},notes {i}\n'
+        for i in range(start, start + count)
+    )
+    return io.BytesIO((CSV_HEADER + rows).encode())
+
+
+def baseline_csv(queryset, fields):
+    """The CSV the export endpoints wrote before they streamed"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    for obj in queryset:
+        writer.writerow([getattr(obj, field, '') for field in fields])
+    return out.getvalue()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user('exporter@example.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(3):
+            company = make_company(f'Export {i}', notes='line one\nline "two"')
+            contact = Contact.objects.create(
+                company=company, full_name=f'Person {i}', position='Buyer', company_email=f'p{i}@example.com',
+                personal_email=f'q{i}@example.com', phone_office='1', phone_mobile='2', address='a',
+                customer_specific_conditions='',
+            )
+            Opportunity.objects.create(company=company, stage='lead', expected_value=100 * i, probability='12.50')
+            Product.objects.create(
+                company=company, category='c', volume_offered='v', delivery_terms='d', packaging='p',
+                payment_terms='t', product_specifications='s', target_price=i,
+            )
+            Interaction.objects.create(company=company, contact=contact if i else None, type='call')
+            Task.objects.create(title=f'Task {i}', assigned_to=self.user if i else None, created_by=self.user)
+            Meeting.objects.create(company=company, date=timezone.now()).users.add(self.user)
+
+    def exports(self):
+        company_fields = ['id', 'name', 'website', 'country', 'industry_category',
+                          'activity_level', 'acquired_via', 'lead_score', 'notes']
+        task_fields = ['id', 'title', 'status', 'priority', 'due_date', 'assigned_to_id', 'created_by_id']
+        return [
+            ('companies', Company.objects.all(), company_fields),
+            ('contacts', Contact.objects.all(), ContactViewSet.export_fields),
+            ('opportunities', Opportunity.objects.all(), OpportunityViewSet.export_fields),
+            ('products', Product.objects.all(), ProductViewSet.export_fields),
+            ('interactions', Interaction.objects.all(), InteractionViewSet.export_fields),
+            ('tasks', Task.objects.all(), task_fields),
+            ('meetings', self.user.meetings.all(), MeetingViewSet.export_fields),
+        ]
+
+    def test_exports_stream_the_baseline_csv(self):
+        for url, queryset, fields in self.exports():
+            with self.subTest(url):
+                response = self.client.get(f'/crm/{url}/export/')
+                self.assertIsInstance(response, StreamingHttpResponse)
+                self.assertEqual(response['Content-Type'], 'text/csv')
+                self.assertEqual(b''.join(response.streaming_content).decode(), baseline_csv(queryset, fields))
+
+    def test_gzip_export_decompresses_to_the_same_csv(self):
+        for url, queryset, fields in self.exports():
+            with self.subTest(url):
+                response = self.client.get(f'/crm/{url}/export/?compress=gzip')
+                self.assertEqual(response['Content-Type'], 'application/gzip')
+                self.assertEqual(
+                    gzip.decompress(b''.join(response.streaming_content)).decode(), baseline_csv(queryset, fields),
+                )
+
+    def test_fields_without_columns_still_write_a_row_per_object(self):
+        fields = ['user_ids', 'missing']
+        text = ''.join(iter_csv_rows(Meeting.objects.order_by('pk'), fields, chunk_size=2))
+        self.assertEqual(text, baseline_csv(Meeting.objects.order_by('pk'), fields))
+        self.assertEqual(len(text.splitlines()), 4)
+
+
+class CompanyImportTests(TestCase):
+
+    def test_short_row_is_reported_per_row(self):
+        data = (
+            'website,country,industry_category,activity_level,acquired_via,lead_score,notes,name\n'
+            'https://a.example.com,a,1,active,web,1,n,A\n'
+            'https://b.example.com,a,1,active,web,1,n\n'
+        )
+        result = import_companies(io.BytesIO(data.encode()))
+        self.assertEqual(result.created, 1)
+        self.assertEqual([error['row'] for error in result.errors], [2])
+
+    def test_existing_names_are_skipped(self):
+        make_company('Company 1')
+        result = import_companies(company_csv(3))
+        self.assertEqual((result.created, result.skipped), (2, 1))
+
+    def test_imported_companies_are_searchable(self):
+        import_companies(company_csv(3))
+        self.assertEqual([hit['title'] for hit in search.search('Company 2')], ['Company 2'])
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # the first import also creates the collection version row
+        import_companies(company_csv(1, start=5000))
+        counts = []
+        for start, rows in ((0, 10), (1000, 60)):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(import_companies(company_csv(rows, start=start)).created, rows)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImportJobTests(TestCase):
+
+    def make_job(self, **kwargs):
+        job = ImportJob(original_name='companies.csv', **kwargs)
+        job.file.save('companies.csv', ContentFile(company_csv(3).getvalue()), save=False)
+        job.save()
+        return job
+
+    def test_stale_running_job_is_resumed(self):
+        job = self.make_job(status='running', heartbeat_at=timezone.now() - timedelta(hours=1))
+        import_jobs.drain()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.created_count), ('completed', 3))
+
+    def test_live_running_job_is_left_alone(self):
+        job = self.make_job(status='running', heartbeat_at=timezone.now())
+        import_jobs.drain()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+
+class CompanyDetailQueryTests(TestCase):
+
+    def setUp(self):
+        self.company = make_company()
+        self.user = make_user('admin@example.com', company=self.company)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.added = 0
+
+    def add_related(self, count):
+        for i in range(self.added, self.added + count):
+            user = make_user(f'user{i}@example.com', company=make_company(f'Employer {i}'))
+            contact = Contact.objects.create(
+                company=self.company, full_name=f'Contact {i}', position='p', company_email=f'c{i}@example.com',
+                personal_email=f'p{i}@example.com', phone_office='1', phone_mobile='1', address='a',
+                customer_specific_conditions='',
+            )
+            Interaction.objects.create(company=self.company, contact=contact, type='call', status='pending', summary='s', assigned_to=user)
+            Task.objects.create(title=f'Task {i}', description='d', status='pending', priority='low', created_by=user, assigned_to=self.user, company=self.company)
+            meeting = Meeting.objects.create(company=self.company, date=timezone.now() + timedelta(days=1))
+            meeting.users.add(self.user, user)
+            Opportunity.objects.create(company=self.company, stage='lead', expected_value=1, probability=10, expected_close_date=timezone.now())
+            Product.objects.create(
+                company=self.company, category='c', target_price=1, volume_offered=1, delivery_terms='d',
+                packaging='p', payment_terms='p', product_specifications='s',
+            )
+        self.added += count
+
+    def retrieve(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/crm/companies/{self.company.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_related_rows(self):
+        self.add_related(1)
+        response, expected = self.retrieve()
+        self.assertEqual(len(response.json()['tasks']), 1)
+
+        self.add_related(15)
+        cache.clear()
+        with self.assertNumQueries(expected):
+            response = self.client.get(f'/crm/companies/{self.company.pk}/')
+        body = response.json()
+        self.assertEqual(len(body['tasks']), 16)
+        self.assertEqual(body['meetings'][-1]['attendees'][-1]['company_name'], 'Employer 15')
+
+
+class CompanyDetailCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.old, self.new = make_company('Old'), make_company('New')
+
+    def test_moving_a_row_invalidates_both_companies(self):
+        contact = Contact.objects.create(
+            company=self.old, full_name='Moved', position='p', company_email='m@example.com',
+            personal_email='p@example.com', phone_office='1', phone_mobile='1', address='a',
+            customer_specific_conditions='',
+        )
+        versions = [company_cache.get_version(self.old.pk), company_cache.get_version(self.new.pk)]
+        contact.company = self.new
+        contact.save()
+        self.assertNotEqual(company_cache.get_version(self.old.pk), versions[0])
+        self.assertNotEqual(company_cache.get_version(self.new.pk), versions[1])
+
+    def test_login_does_not_touch_company_details(self):
+        user = make_user('login@example.com', company=self.old)
+        user.last_login = timezone.now()
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+
+    def test_renaming_a_user_invalidates_their_task_companies(self):
+        user = make_user('renamed@example.com')
+        Task.objects.create(title='T', description='d', status='pending', priority='low', created_by=user, company=self.old)
+        version = company_cache.get_version(self.old.pk)
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertNotEqual(company_cache.get_version(self.old.pk), version)
+
+
+class CompanyNameTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('names@example.com'))
+
+    def payload(self, name, website):
+        return {
+            'name': name, 'website': website, 'country': 'a', 'industry_category': 1,
+            'activity_level': 'active', 'acquired_via': 'web', 'lead_score': 10, 'notes': 'n',
+        }
+
+    def test_names_differing_only_in_case_are_refused(self):
+        response = self.client.post('/crm/companies/', self.payload('Acme', 'https://a.example.com'), format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/crm/companies/', self.payload('ACME', 'https://b.example.com'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.json())
+
+    def test_patch_keeping_the_name_is_accepted(self):
+        company = make_company('Acme')
+        response = self.client.patch(f'/crm/companies/{company.pk}/', {'name': 'ACME', 'lead_score': 20}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'ACME')
+
+    def test_index_catches_what_validation_missed(self):
+        make_company('Acme')
+        with mock.patch.object(CompanySerializer, 'validate_name', lambda self, value: value):
+            response = self.client.post('/crm/companies/', self.payload('ACME', 'https://b.example.com'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Company with this name already exists'})
+        self.assertEqual(Company.objects.count(), 1)
+
+
+class DedupeCompanyNamesTests(TransactionTestCase):
+
+    def test_reports_then_renames_case_insensitive_duplicates(self):
+        # the table as it was before unique_company_name_ci
+        constraint = Company._meta.constraints[0]
+        Company._meta.constraints = []
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Company, constraint)
+        try:
+            first = make_company('Acme')
+            second = make_company('ACME', website='https://acme2.example.com')
+            make_company('Other')
+            out = io.StringIO()
+            with self.assertRaisesMessage(CommandError, '1 company names are taken more than once'):
+                call_command('dedupe_company_names', stdout=out)
+            self.assertIn(f"acme: {first.pk} 'Acme', {second.pk} 'ACME'", out.getvalue())
+            call_command('dedupe_company_names', rename=True, stdout=io.StringIO())
+        finally:
+            Company._meta.constraints = [constraint]
+            with connection.schema_editor() as editor:
+                editor.add_constraint(Company, constraint)
+        self.assertEqual(
+            list(Company.objects.order_by('pk').values_list('name', flat=True)), ['Acme', f'ACME ({second.pk})', 'Other'],
+        )
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('searcher@example.com'))
+
+    def hits(self, query, **params):
+        response = self.client.get('/crm/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def make_contact(self, company, full_name):
+        return Contact.objects.create(
+            company=company, full_name=full_name, position='Buyer', company_email='c@example.com',
+            personal_email='p@example.com', phone_office='1', phone_mobile='2', address='a',
+            customer_specific_conditions='',
+        )
+
+    def test_title_match_ranks_above_body_match(self):
+        # bm25 needs the term to be rare for its weight to show
+        for i in range(6):
+            make_company(f'Filler {i}')
+        make_company('Harbor', notes='ships through zephyr ports every week')
+        make_company('Zephyr', notes='wholesale')
+        results = self.hits('zephyr')['results']
+        self.assertEqual([hit['title'] for hit in results], ['Zephyr', 'Harbor'])
+        self.assertLess(results[0]['score'], results[1]['score'])
+        self.assertIn('[zephyr]', results[1]['snippet'])
+
+    def test_type_filter(self):
+        company = make_company('Zephyr')
+        contact = self.make_contact(company, 'Zephyr Jones')
+        Interaction.objects.create(company=company, type='zephyr call')
+        results = self.hits('zephyr', type='contact')['results']
+        self.assertEqual([(hit['type'], hit['id']) for hit in results], [('contact', contact.pk)])
+        self.assertEqual(len(self.hits('zephyr', type='company,interaction')['results']), 2)
+
+    def test_pages(self):
+        for i in range(3):
+            make_company(f'Zephyr {i}')
+        first = self.hits('zephyr', page_size=2)
+        second = self.hits('zephyr', page_size=2, page=2)
+        self.assertEqual((first['page'], first['has_next'], len(first['results'])), (1, True, 2))
+        self.assertEqual((second['page'], second['has_next'], len(second['results'])), (2, False, 1))
+        ids = [hit['id'] for hit in first['results'] + second['results']]
+        self.assertEqual(sorted(ids), sorted(Company.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.client.get('/crm/search/', {'q': 'zephyr', 'page': 'x'}).status_code, 400)
+
+    def test_index_follows_saves_and_deletes(self):
+        company = make_company('Zephyr')
+        company.name = 'Boreas'
+        company.save()
+        self.assertEqual(self.hits('zephyr')['results'], [])
+        self.assertEqual([hit['id'] for hit in self.hits('boreas')['results']], [company.pk])
+        contact = self.make_contact(company, 'Boreas Smith')
+        company_pk = company.pk
+        contact.delete()
+        self.assertEqual([(hit['type'], hit['id']) for hit in self.hits('boreas')['results']], [('company', company_pk)])
+        company.delete()
+        self.assertEqual(self.hits('boreas')['results'], [])
+
+    def test_rebuild_command_restores_the_index(self):
+        company = make_company('Zephyr')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        self.assertEqual(self.hits('zephyr')['results'], [])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 1 company, 0 contact, 0 interaction', out.getvalue())
+        self.assertEqual([hit['id'] for hit in self.hits('zephyr')['results']], [company.pk])
+
+    def test_other_databases_fall_back_to_icontains(self):
+        company = make_company('Harbor', notes='ships through Zephyr ports')
+        self.make_contact(company, 'Someone')
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertFalse(search.uses_fts())
+            results = search.search('zephyr')
+            self.assertEqual(search.search('zephyr', kinds=['contact']), [])
+        self.assertEqual(
+            results,
+            [{'type': 'company', 'id': company.pk, 'company_id': company.pk, 'title': 'Harbor',
+              'snippet': 'ships through Zephyr ports', 'score': None}],
+        )
+
+
+class MeetingNotificationTests(TestCase):
+
+    def setUp(self):
+        self.ann = make_user('ann@example.com')
+        self.bob = make_user('bob@example.com')
+
+    def sent(self):
+        return sorted(Notification.objects.values_list('user__email', 'type', 'related_object_id'))
+
+    def test_adding_attendees_notifies_them(self):
+        meeting = Meeting.objects.create(date=timezone.now() + timedelta(days=3))
+        meeting.users.add(self.ann, self.bob)
+        self.assertEqual(self.sent(), [
+            ('ann@example.com', 'meeting_scheduled', meeting.pk), ('bob@example.com', 'meeting_scheduled', meeting.pk),
+        ])
+
+    def test_adding_meetings_to_a_user_notifies_them(self):
+        soon = Meeting.objects.create(date=timezone.now() + timedelta(hours=2))
+        later = Meeting.objects.create(date=timezone.now() + timedelta(days=3))
+        self.ann.meetings.add(soon, later)
+        self.assertEqual(self.sent(), [
+            ('ann@example.com', 'meeting_reminder', soon.pk),
+            ('ann@example.com', 'meeting_scheduled', soon.pk),
+            ('ann@example.com', 'meeting_scheduled', later.pk),
+        ])
+
+    def test_meetings_without_a_date_are_skipped(self):
+        Meeting.objects.create().users.add(self.ann)
+        self.assertEqual(self.sent(), [])
+
+    def test_api_created_meeting_notifies_its_attendees(self):
+        client = APIClient()
+        client.force_authenticate(self.ann)
+        response = client.post('/crm/meetings/', {
+            'date': (timezone.now() + timedelta(days=3)).isoformat(), 'user_ids': [self.ann.pk, self.bob.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([row[:2] for row in self.sent()], [
+            ('ann@example.com', 'meeting_scheduled'), ('bob@example.com', 'meeting_scheduled'),
+        ])
+
+    @override_settings(MEETING_NOTIFICATIONS_ON_COMMIT=True)
+    def test_fan_out_can_wait_for_the_commit(self):
+        meeting = Meeting.objects.create(date=timezone.now() + timedelta(days=3))
+        with self.captureOnCommitCallbacks(execute=True):
+            meeting.users.add(self.ann)
+            self.assertEqual(self.sent(), [])
+        self.assertEqual(self.sent(), [('ann@example.com', 'meeting_scheduled', meeting.pk)])
+
+    def test_adding_again_does_not_duplicate(self):
+        meeting = Meeting.objects.create(date=timezone.now() + timedelta(days=3))
+        meeting.users.add(self.ann)
+        meeting.users.add(self.ann, self.bob)
+        meeting.users.remove(self.ann)
+        meeting.users.add(self.ann)
+        self.assertEqual(self.sent(), [
+            ('ann@example.com', 'meeting_scheduled', meeting.pk), ('bob@example.com', 'meeting_scheduled', meeting.pk),
+        ])
+
+
+class TaskDashboardTests(TestCase):
+
+    def setUp(self):
+        self.staff = make_user('boss@example.com', is_staff=True)
+        self.worker = make_user('worker@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def dashboards(self):
+        """(from the summary rows, from the tasks table), which must agree"""
+        response = self.client.get('/crm/tasks/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        from_tasks = task_summary.dashboard_from_queryset(Task.objects.all(), self.staff, timezone.now())
+        self.assertEqual(response.json(), from_tasks)
+        return from_tasks
+
+    def test_status_change(self):
+        task = Task.objects.create(title='T', assigned_to=self.worker, created_by=self.staff)
+        task.status = 'closed'
+        task.save()
+        dashboard = self.dashboards()
+        self.assertEqual((dashboard['total'], dashboard['open'], dashboard['closed']), (1, 0, 1))
+
+    def test_reassignment(self):
+        task = Task.objects.create(title='T', assigned_to=self.worker, created_by=self.worker, priority='high')
+        task.assigned_to = self.staff
+        task.save()
+        dashboard = self.dashboards()
+        self.assertEqual(dashboard['high_priority'], 1)
+        self.assertEqual(dashboard['user_stats'], {'assigned_tasks': 1, 'created_tasks': 0})
+
+    def test_deleted_user_tasks_stay_counted(self):
+        for i in range(3):
+            Task.objects.create(title=f'T{i}', assigned_to=self.worker, created_by=self.worker, status='in_progress')
+        Task.objects.create(title='Mine', created_by=self.staff)
+        self.worker.delete()
+        dashboard = self.dashboards()
+        self.assertEqual((dashboard['total'], dashboard['in_progress'], dashboard['open']), (4, 3, 1))
+        self.assertEqual(dashboard['user_stats'], {'assigned_tasks': 0, 'created_tasks': 1})
+        self.assertEqual(task_summary.reconcile(), 0)
+
+
+class PipelineTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('sales@example.com'))
+        self.acme = make_company('Acme', industry_category=3)
+        self.globex = make_company('Globex', industry_category=5)
+
+    def mid_month(self, month):
+        return datetime(2026, month, 15, 12, tzinfo=dt_timezone.utc)
+
+    def report(self, **params):
+        response = self.client.get('/crm/opportunities/pipeline/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_maintained_rollups_match_a_rebuild(self):
+        opportunities = [
+            Opportunity.objects.create(
+                company=company, stage=stage, expected_value=value, probability=probability,
+                expected_close_date=self.mid_month(month) if month else None,
+            )
+            for company, stage, value, probability, month in (
+                (self.acme, 'lead', 1000, '10.00', 1),
+                (self.acme, 'lead', 250, '33.33', 1),
+                (self.acme, 'qualified', 4000, '50.00', 2),
+                (self.globex, 'negotiation', 999, '12.50', None),
+                (self.globex, 'won', 7000, '100.00', 3),
+            )
+        ]
+        moved = opportunities[0]
+        moved.stage = 'qualified'
+        moved.save()
+        moved.company = self.globex
+        moved.save()
+        moved.expected_close_date = self.mid_month(4)
+        moved.expected_value = 1500
+        moved.save()
+        opportunities[2].delete()
+
+        maintained = self.report()
+        self.assertEqual(maintained['totals']['count'], 4)
+        self.assertEqual(
+            [(row['stage'], row['count']) for row in maintained['by_stage']],
+            [('lead', 1), ('negotiation', 1), ('qualified', 1), ('won', 1)],
+        )
+        pipeline.rebuild()
+        self.assertEqual(self.report(), maintained)
+        self.assertEqual(self.report(company=self.globex.pk)['totals']['count'], 3)
+
+    def test_industry_change_moves_the_rollups(self):
+        Opportunity.objects.create(company=self.acme, stage='lead', expected_value=100, probability='50.00')
+        self.acme.industry_category = 5
+        self.acme.save()
+        self.assertEqual(
+            [(row['industry_category'], row['count']) for row in self.report()['by_industry']], [(5, 1)],
+        )
+
+    def test_date_filters(self):
+        for month in (1, 2, 3):
+            Opportunity.objects.create(
+                company=self.acme, stage='lead', expected_value=month, expected_close_date=self.mid_month(month),
+            )
+        self.assertEqual(self.report(date_from='2026-02')['totals']['total_value'], 5)
+        self.assertEqual(self.report(date_from='2026-02-20', date_to='2026-02')['totals']['total_value'], 2)
+        self.assertEqual(self.report(date_to='2026-02-01')['totals']['total_value'], 3)
+        for params in ({'date_from': 'soon'}, {'date_to': '2026-13'}, {'company': 'acme'}):
+            with self.subTest(params):
+                response = self.client.get('/crm/opportunities/pipeline/', params)
+                self.assertEqual(response.status_code, 400)
+
+
+class SparseFieldsTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user('reader@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_notifications(self, count):
+        Notification.objects.bulk_create(
+            Notification(user=self.user, title=f'N{i}', message='m', type='task_assigned', related_object_id=i)
+            for i in range(Notification.objects.count(), Notification.objects.count() + count)
+        )
+
+    def test_sparse_page_loads_its_ordering_columns_up_front(self):
+        counts = []
+        for count in (2, 10):
+            self.add_notifications(count)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/crm/notifications/all/?fields=id,title&page_size=5')
+            counts.append(len(queries))
+            self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+        self.assertEqual(counts[0], counts[1])
+
+    def test_plans_are_keyed_on_declared_fields(self):
+        make_company()
+        self.client.get('/crm/companies/')
+        cached = len(eager_loading._plans)
+        for junk in ('a', 'b', 'c'):
+            response = self.client.get(f'/crm/companies/?fields=id,name,{junk}')
+            self.assertEqual(set(response.json()['results'][0]), {'id', 'name'})
+        self.client.get('/crm/companies/?omit=nonsense')
+        self.assertEqual(len(eager_loading._plans), cached + 1)
+
+    def test_full_field_plans_are_built_with_the_view(self):
+        CompanyViewSet.as_view({'get': 'retrieve'})
+        self.assertIn((CompanyDetailSerializer, Company, None), eager_loading._plans)
+
+
+class ListETagTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('etag@example.com'))
+        company = make_company()
+        self.contact = Contact.objects.create(
+            company=company, full_name='Gone', position='p', company_email='g@example.com',
+            personal_email='p@example.com', phone_office='1', phone_mobile='1', address='a',
+            customer_specific_conditions='',
+        )
+        Interaction.objects.create(company=company, contact=self.contact, type='call', status='pending', summary='s')
+
+    def etag(self):
+        response = self.client.get('/crm/interactions/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_etag_survives_a_cache_flush(self):
+        etag = self.etag()
+        cache.clear()
+        self.assertEqual(self.etag(), etag)
+
+    def test_foreign_key_nulled_by_a_delete_changes_the_etag(self):
+        etag = self.etag()
+        self.contact.delete()
+        self.assertNotEqual(self.etag(), etag)
+
+
+class NotificationSchedulerTests(TestCase):
+
+    def test_conflicting_rows_are_not_counted(self):
+        user = make_user('notified@example.com')
+        Notification.objects.create(user=user, title='T', message='m', type='task_assigned', related_object_id=1)
+        self.assertEqual(notification_counts.unread_count(user.pk), 1)
+        batch = [
+            Notification(user=user, title='T', message='m', type='task_assigned', related_object_id=related)
+            for related in (1, 2)
+        ]
+        self.assertEqual(notifications._write(batch), 1)
+        self.assertEqual(notification_counts.unread_count(user.pk), 2)
+
+    def test_bulk_create_returns_and_counts_inserted_rows_only(self):
+        user = make_user('bulk@example.com')
+        self.assertEqual(notification_counts.unread_count(user.pk), 0)
+        batch = [
+            Notification(user=user, title='M', message='m', type='meeting_scheduled', related_object_id=related)
+            for related in (1, 1, None)
+        ]
+        created = bulk_create_notifications(batch)
+        self.assertEqual([n.related_object_id for n in created], [1, None])
+        self.assertEqual(notification_counts.unread_count(user.pk), 2)
+
+
+class NotificationRetentionTests(TestCase):
+
+    def test_prune_removes_old_seen_rows_only(self):
+        user = make_user('old@example.com')
+        rows = Notification.objects.bulk_create(
+            Notification(user=user, title='N', message='m', type='task_assigned', related_object_id=i, seen=seen)
+            for i, seen in enumerate((True, False, True))
+        )
+        Notification.objects.filter(pk__in=[rows[0].pk, rows[1].pk]).update(created_at=timezone.now() - timedelta(days=100))
+        self.assertEqual(notification_retention.prune(days=90, size=1), 1)
+        self.assertEqual(sorted(Notification.objects.values_list('pk', flat=True)), [rows[1].pk, rows[2].pk])
+
+
+class CollapseDuplicateNotificationsTests(TransactionTestCase):
+
+    def test_keeps_the_oldest_row_of_each_event(self):
+        # the table as it was before unique_notification_event
+        constraint = Notification._meta.constraints[0]
+        Notification._meta.constraints = []
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Notification, constraint)
+        try:
+            user = make_user('dupes@example.com')
+            rows = Notification.objects.bulk_create(
+                Notification(user=user, title=str(i), message='m', type='task_assigned', related_object_id=related)
+                for i, related in enumerate((1, 1, 1, 2, None, None))
+            )
+            self.assertEqual(collapse_duplicates(batch_size=1), 2)
+        finally:
+            Notification._meta.constraints = [constraint]
+            with connection.schema_editor() as editor:
+                editor.add_constraint(Notification, constraint)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('pk', flat=True)),
+            [rows[0].pk, rows[3].pk, rows[4].pk, rows[5].pk],
+        )
+
+
+@override_settings(QUERY_INSPECTOR_MODE='strict')
+class QueryInspectorTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('inspected@example.com')
+
+    def test_going_over_the_budget_fails(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/crm/contacts/')['X-Query-Count'], '3')
+        with mock.patch.object(ContactViewSet, 'query_budget', {'list': 2}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'ran 3 queries, budget is 2'):
+                client.get('/crm/contacts/')
+
+    async def test_async_requests_are_inspected(self):
+        token = await sync_to_async(lambda: str(UserRefreshToken.for_user(self.user).access_token))()
+        headers = {'Authorization': f'Bearer {token}'}
+        response = await self.async_client.get('/crm/contacts/', headers=headers)
+        self.assertNotEqual(response['X-Query-Count'], '0')
+        with mock.patch.object(ContactViewSet, 'query_budget', {'list': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                await self.async_client.get('/crm/contacts/', headers=headers)
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTests(TestCase):
+    SERIES = 'gwm_http_request_duration_seconds_count{route="contact-list",action="list",method="GET",status="200"}'
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('measured@example.com')
+
+    def requests_counted(self):
+        for line in metrics.render().splitlines():
+            if line.startswith(self.SERIES + ' '):
+                return int(line.split()[-1])
+        return 0
+
+    def test_wsgi_requests_are_counted(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        before = self.requests_counted()
+        client.get('/crm/contacts/')
+        self.assertEqual(self.requests_counted(), before + 1)
+
+    def test_any_top_level_serializer_is_timed_once(self):
+        class Plain(serializers.Serializer):
+            name = serializers.SerializerMethodField()
+
+            def get_name(self, obj):
+                time.sleep(0.02)
+                return obj
+
+        metrics.instrument_serializers()
+        stats = metrics.start_request()
+        try:
+            self.assertEqual(Plain(['a', 'b'], many=True).data, [{'name': 'a'}, {'name': 'b'}])
+        finally:
+            metrics.finish_request(('test', '', 'GET', '200'), 0.0, stats)
+        # counted once for the list, not again for each item
+        self.assertGreaterEqual(stats.serializer_seconds, 0.04)
+        self.assertLess(stats.serializer_seconds, 0.08)
+
+    async def test_asgi_requests_are_counted(self):
+        token = await sync_to_async(lambda: str(UserRefreshToken.for_user(self.user).access_token))()
+        before = self.requests_counted()
+        await self.async_client.get('/crm/contacts/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(self.requests_counted(), before + 1)
+
+
+@override_settings(NOTIFICATION_STREAM_HEARTBEAT_SECONDS=1)
+class NotificationStreamTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('stream@example.com')
+
+    def notify(self, related_object_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(
+                user=self.user, title='Live', message='m', type='task_assigned', related_object_id=related_object_id,
+            )
+
+    async def test_new_notification_arrives_on_the_stream(self):
+        token = await sync_to_async(lambda: str(UserRefreshToken.for_user(self.user).access_token))()
+        response = await self.async_client.get(
+            '/crm/api/notifications/stream/', headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        events = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await anext(events), b'retry: 3000\n\n')
+            waiting = asyncio.ensure_future(anext(events))
+            await asyncio.sleep(0.1)
+            notification = await sync_to_async(self.notify)(1)
+            event = await asyncio.wait_for(waiting, timeout=5)
+        finally:
+            await events.aclose()
+        self.assertTrue(event.startswith(f'id: {notification.pk}\nevent: notification\n'.encode()))
+
+    def test_ticket_opens_the_stream_once(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        ticket = client.post('/crm/api/notifications/stream/ticket/').json()['ticket']
+        self.notify(1)
+        url = f'/crm/api/notifications/stream/?ticket={ticket}&last_event_id=0'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'event: notification', response.content)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), UPLOAD_SESSION_DIR=tempfile.mkdtemp())
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        self.company = make_company()
+        self.data = b'0123456789' * 10
+        self.session = chunked_uploads.start_session(
+            make_user('uploader@example.com'), 'company.catalogs', self.company.pk, 'catalog.pdf', len(self.data)
+        )
+
+    def write(self, offset, length):
+        return chunked_uploads.write_chunk(self.session, offset, io.BytesIO(self.data[offset:offset + length]), length)
+
+    def test_retried_chunk_does_not_rewind(self):
+        self.write(0, 60)
+        self.assertEqual(self.write(20, 20), 60)
+        self.assertEqual(self.write(50, 50), 100)
+        with open(chunked_uploads.temp_path(self.session), 'rb') as part:
+            self.assertEqual(part.read(), self.data)
+
+    def test_failed_attach_can_be_retried(self):
+        self.write(0, 100)
+
+        def fail(**kwargs):
+            raise RuntimeError('attach failed')
+        post_save.connect(fail, sender=Company)
+        try:
+            with self.assertRaises(RuntimeError):
+                chunked_uploads.complete(self.session)
+        finally:
+            post_save.disconnect(fail, sender=Company)
+        self.assertEqual(UploadSession.objects.get(pk=self.session.pk).status, 'uploading')
+        self.assertTrue(os.path.exists(chunked_uploads.temp_path(self.session)))
+
+        company = chunked_uploads.complete(self.session)
+        with company.catalogs.open('rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOWNLOAD_SENDFILE_MODE=None)
+class FileDownloadTests(TestCase):
+    DATA = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('downloader@example.com'))
+        self.company = make_company()
+        self.company.business_card.save('card.bin', ContentFile(self.DATA))
+        self.url = f'/crm/companies/{self.company.pk}/files/business-card/download/'
+
+    def get(self, url=None, **headers):
+        response = self.client.get(url or self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_full_download(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, self.DATA))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('card.bin', response['Content-Disposition'])
+
+    def test_range(self):
+        response, body = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.DATA)}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(body, self.DATA[10:20])
+
+    def test_suffix_range(self):
+        response, body = self.get(Range='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 924-1023/{len(self.DATA)}')
+        self.assertEqual(body, self.DATA[-100:])
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range=f'bytes={len(self.DATA)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.DATA)}')
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        response, body = self.get(Range='bytes=0-1,4-5')
+        self.assertEqual((response.status_code, body), (200, self.DATA))
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(Range='bytes=0-3', **{'If-Range': etag})
+        self.assertEqual((response.status_code, body), (206, self.DATA[:4]))
+        response, body = self.get(Range='bytes=0-3', **{'If-Range': '"stale"'})
+        self.assertEqual((response.status_code, body), (200, self.DATA))
+
+    def test_not_modified(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(**{'If-None-Match': etag})
+        self.assertEqual((response.status_code, body), (304, b''))
+        self.assertEqual(response['ETag'], etag)
+
+    def test_document_under_another_parent_is_not_found(self):
+        contacts = [
+            Contact.objects.create(
+                company=self.company, full_name=name, position='p', company_email='c@example.com',
+                personal_email='p@example.com', phone_office='1', phone_mobile='2', address='a',
+                customer_specific_conditions='',
+            )
+            for name in ('Owner', 'Other')
+        ]
+        document = ContactDocument(contact=contacts[0], name='terms.txt')
+        document.file.save('terms.txt', ContentFile(b'terms'))
+        url = '/crm/contacts/{}/documents/{}/download/'
+        response, body = self.get(url.format(contacts[0].pk, document.pk))
+        self.assertEqual((response.status_code, body), (200, b'terms'))
+        self.assertEqual(self.get(url.format(contacts[1].pk, document.pk))[0].status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedStorageTests(TestCase):
+
+    def upload(self, content, name='catalog.pdf'):
+        return SimpleUploadedFile(name, content, content_type='application/pdf')
+
+    def test_replacing_a_file_releases_the_old_reference(self):
+        company = make_company(catalogs=self.upload(b'first'))
+        old_digest = split_name(company.catalogs.name)[0]
+        serializer = CompanySerializer(company, data={'catalogs': self.upload(b'second')}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+        self.assertFalse(Blob.objects.filter(pk=old_digest).exists())
+        self.assertEqual(Blob.objects.get(pk=split_name(company.catalogs.name)[0]).refcount, 1)
+
+    def test_reuploading_the_same_content_keeps_one_reference(self):
+        company = make_company(catalogs=self.upload(b'same'))
+        company.catalogs = self.upload(b'same')
+        with self.captureOnCommitCallbacks(execute=True):
+            company.save()
+        self.assertEqual(Blob.objects.get().refcount, 1)
+
+    def test_failed_save_rolls_the_reference_back(self):
+        make_company('Taken')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            make_company('Taken', website='https://other.example.com', catalogs=self.upload(b'orphan'))
+        self.assertFalse(Blob.objects.exists())
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_recount_removes_blob_files_of_rolled_back_saves(self):
+        kept = make_company('Kept', catalogs=self.upload(b'kept'))
+        with transaction.atomic():
+            orphan = make_company('Orphan', catalogs=self.upload(b'orphan'))
+            transaction.set_rollback(True)
+        self.assertTrue(os.path.exists(orphan.catalogs.path))
+
+        call_command('dedupe_media', stdout=io.StringIO())
+        self.assertTrue(os.path.exists(orphan.catalogs.path), 'young files may belong to an open transaction')
+        out = io.StringIO()
+        call_command('dedupe_media', orphan_age=0, stdout=out)
+        self.assertIn('1 orphans removed', out.getvalue())
+        self.assertFalse(os.path.exists(orphan.catalogs.path))
+        self.assertTrue(os.path.exists(kept.catalogs.path))
+
+    def test_url_keeps_the_filename_and_serves_its_type(self):
+        company = make_company(catalogs=self.upload(b'%PDF-1.4'))
+        self.assertTrue(company.catalogs.url.endswith('/catalog.pdf'))
+        digest, filename = split_name(company.catalogs.name)
+        response = media_blob(RequestFactory().get(company.catalogs.url), digest, filename)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+
+class BulkEndpointTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('bulk-api@example.com'))
+        self.old, self.new = make_company('Old'), make_company('New')
+
+    def add_opportunity(self, company):
+        return Opportunity.objects.create(
+            company=company, stage='lead', expected_value=100, probability=50, expected_close_date=timezone.now(),
+        )
+
+    def test_atomic_delete_with_repeated_ids(self):
+        opportunity = self.add_opportunity(self.old)
+        response = self.client.delete(
+            '/crm/opportunities/bulk/', [opportunity.pk, opportunity.pk], format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Opportunity.objects.exists())
+
+    def test_non_numeric_ids_are_not_found(self):
+        opportunity = self.add_opportunity(self.old)
+        response = self.client.delete('/crm/opportunities/bulk/', [opportunity.pk, 'abc'], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'][1]['errors'], {'id': ['Not found.']})
+        response = self.client.patch('/crm/opportunities/bulk/', [{'id': 'abc', 'stage': 'won'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Opportunity.objects.exists())
+
+    def test_moving_rows_updates_the_old_company(self):
+        opportunity = self.add_opportunity(self.old)
+        old_version = company_cache.get_version(self.old.pk)
+        response = self.client.patch(
+            '/crm/opportunities/bulk/', [{'id': opportunity.pk, 'company_id': self.new.pk}], format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(company_cache.get_version(self.old.pk), old_version)
+        self.assertEqual(list(OpportunityRollup.objects.values_list('company_id', 'count')), [(self.new.pk, 1)])
@@ -1,9 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .models import ContactDocument, InteractionDocument
 from .views import (CompanyViewSet, ContactViewSet, ContactDocumentViewSet, OpportunityViewSet,
                     ProductViewSet, InteractionViewSet, TaskViewSet, InteractionDocumentViewSet,
-                    CompanyCSVUploadView, MarkNotificationsReadView, UnreadNotificationsView, AllNotificationsView,
-                    MeetingViewSet, CompanyFileViewSet)
+                    CompanyCSVUploadView, MarkNotificationsReadView, UnreadNotificationsView, UnreadNotificationCountView,
+                    AllNotificationsView, ArchivedNotificationsView,
+                    MeetingViewSet, CompanyFileViewSet, CompanyImportJobView, ImportJobDetailView,
+                    SearchView, notification_stream, NotificationStreamTicketView, UploadSessionView, UploadSessionDetailView,
+                    UploadSessionCompleteView, CompanyFileDownloadView, DocumentDownloadView)
 
 router = DefaultRouter()
 router.register(r'companies', CompanyViewSet)
@@ -22,6 +26,13 @@ urlpatterns = [
     path('companies/<int:pk>/files/catalogs/', CompanyFileViewSet.as_view({'get': 'catalogs', 'post': 'catalogs', 'delete': 'catalogs'})),
     path('companies/<int:pk>/files/signed_contracts/', CompanyFileViewSet.as_view({'get': 'signed_contracts', 'post': 'signed_contracts', 'delete': 'signed_contracts'})),
     path('companies/<int:pk>/files/correspondence/', CompanyFileViewSet.as_view({'get': 'correspondence', 'post': 'correspondence', 'delete': 'correspondence'})),
+    path('companies/<int:pk>/files/<str:field>/download/', CompanyFileDownloadView.as_view(), name='company-file-download'),
+    path('contacts/<int:contact_pk>/documents/<int:pk>/download/',
+        DocumentDownloadView.as_view(model=ContactDocument, parent_kwarg='contact_pk'),
+        name='contact-document-download'),
+    path('interactions/<int:interaction_pk>/documents/<int:pk>/download/',
+        DocumentDownloadView.as_view(model=InteractionDocument, parent_kwarg='interaction_pk'),
+        name='interaction-document-download'),
     path('contacts/<int:contact_pk>/documents/', 
         ContactDocumentViewSet.as_view({'post': 'create', 'get': 'list'})),
     path('contacts/<int:contact_pk>/documents/<int:pk>/',
@@ -38,6 +49,16 @@ urlpatterns = [
     path('tasks/my_tasks/', TaskViewSet.as_view({'get': 'my_tasks'}), name='my-tasks'),
     path('tasks/dashboard/', TaskViewSet.as_view({'get': 'dashboard'}), name='task-dashboard'),
     path('api/companies/upload-csv/', CompanyCSVUploadView.as_view(), name='company-upload-csv'),
+    path('api/companies/import-jobs/', CompanyImportJobView.as_view(), name='company-import-jobs'),
+    path('api/companies/import-jobs/<int:pk>/', ImportJobDetailView.as_view(), name='company-import-job-detail'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('api/uploads/', UploadSessionView.as_view(), name='upload-sessions'),
+    path('api/uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='upload-session-detail'),
+    path('api/uploads/<uuid:pk>/complete/', UploadSessionCompleteView.as_view(), name='upload-session-complete'),
     path('notifications/all/', AllNotificationsView.as_view(), name='all-notifications'),    path('api/notifications/unread/', UnreadNotificationsView.as_view(), name='notifications-unread'),
+    path('api/notifications/unread/count/', UnreadNotificationCountView.as_view(), name='notifications-unread-count'),
+    path('api/notifications/stream/', notification_stream, name='notifications-stream'),
+    path('api/notifications/stream/ticket/', NotificationStreamTicketView.as_view(), name='notifications-stream-ticket'),
+    path('api/notifications/archived/', ArchivedNotificationsView.as_view(), name='notifications-archived'),
     path('api/notifications/mark-as-seen/', MarkNotificationsReadView.as_view(), name='notifications-mark-seen'),
     ]
@@ -1,21 +1,52 @@
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from .models import Notification
+from .services import notification_counts
+from .services.notifications import inserted
+from .services.notification_hub import publish_on_commit
 import logging
 
 logger = logging.getLogger(__name__)
 
 def create_notification(user, title, message, notification_type, related_object_id=None):
     try:
-        notification = Notification.objects.create(
-            user=user,
-            title=title[:200], 
-            message=message,
-            type=notification_type,
-            related_object_id=related_object_id,
-            created_at=timezone.now()
-        )
+        with transaction.atomic():
+            notification = Notification.objects.create(
+                user=user,
+                title=title[:200], 
+                message=message,
+                type=notification_type,
+                related_object_id=related_object_id,
+                created_at=timezone.now()
+            )
         logger.info(f"Created notification: {notification}")
         return notification
+    except IntegrityError:
+        # this user was already notified about this object
+        return None
     except Exception as e:
         logger.error(f"Failed to create notification: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+def bulk_create_notifications(notifications, batch_size=500):
+    """Inserts unsaved Notification objects with bulk_create and logs once"""
+    if not notifications:
+        return []
+    try:
+        existing = set(Notification.objects.filter(
+            user_id__in={n.user_id for n in notifications},
+            type__in={n.type for n in notifications},
+            related_object_id__in={n.related_object_id for n in notifications},
+        ).values_list('user_id', 'type', 'related_object_id'))
+        notifications = [
+            n for n in notifications if (n.user_id, n.type, n.related_object_id) not in existing
+        ]
+        # ignore_conflicts only covers a concurrent insert of the same event
+        created = inserted(Notification.objects.bulk_create(notifications, batch_size=batch_size, ignore_conflicts=True))
+        notification_counts.record_created(created)
+        publish_on_commit(n.user_id for n in created)
+        logger.info(f"Created {len(created)} notifications")
+        return created
+    except Exception as e:
+        logger.error(f"Failed to create {len(notifications)} notifications: {str(e)}")
+        return []
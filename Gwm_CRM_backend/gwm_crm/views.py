@@ -1,10 +1,16 @@
 from django.shortcuts import render
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
-from django.http import HttpResponse
-
-from rest_framework.renderers import JSONRenderer
+from django.utils.dateparse import parse_datetime
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.views.static import serve
+from asgiref.sync import sync_to_async
+
+from rest_framework.renderers import JSONRenderer, BaseRenderer
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import viewsets, status, filters
 from rest_framework.response import Response
@@ -13,14 +19,34 @@ from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser
 from rest_framework import generics
 from rest_framework.parsers import JSONParser
-
-from .models import Company, Contact, ContactDocument, Opportunity, Product, Interaction, Task, InteractionDocument, Notification, Meeting
-from .serializers import CompanySerializer, CompanyDetailSerializer, ContactSerializer, ContactDocumentSerializer, OpportunitySerializer, ProductSerializer, InteractionSerializer, TaskSerializer, InteractionDocumentSerializer, NotificationSerializer, MeetingSerializer
-
-from datetime import timedelta
-import csv
+from rest_framework.exceptions import AuthenticationFailed
+from authentication.authentication import CachedJWTAuthentication
+from authentication.models import User
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .models import Company, Contact, ContactDocument, Opportunity, Product, Interaction, Task, InteractionDocument, Notification, Meeting, ImportJob, UploadSession
+from .serializers import CompanySerializer, CompanyDetailSerializer, ContactSerializer, ContactDocumentSerializer, OpportunitySerializer, ProductSerializer, InteractionSerializer, TaskSerializer, InteractionDocumentSerializer, NotificationSerializer, MeetingSerializer, ImportJobSerializer, UploadSessionSerializer
+from .mixins import BulkMixin, ConditionalGetMixin, EagerLoadingMixin, NotificationVersionMixin, SparseFieldsViewMixin, requested_fields
+from .services.exports import streaming_csv_response
+from .services.company_import import import_companies
+from .services.import_jobs import enqueue_import
+from .services.notification_hub import hub
+from .services import chunked_uploads, stream_tickets
+from .services.downloads import file_response
+from .storage import blob_name
+from .services.chunked_uploads import UploadError
+from .services import company_cache, search, task_summary, pipeline, notification_counts, notification_retention, metrics
+
+from datetime import date, timedelta
 import json
-import io
+import mimetypes
+import os
+import asyncio
+import time
+
+def wants_gzip(request):
+    return request.query_params.get('compress', '').lower() in ('gzip', 'gz', '1', 'true')
 
 class ExportMixin:
     export_fields = None  # Override this in each viewset
@@ -28,20 +54,20 @@ class ExportMixin:
 
     @action(detail=False, methods=['get'], url_path='export')
     def export_all(self, request):
+        """
+        Streams the CSV as it is read from the database.
+        Pass ?compress=gzip to get a gzipped file instead.
+        """
         queryset = self.get_queryset()
-        model_name = self.queryset.model.__name__.lower()
-
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{model_name}s.csv"'
-
-        writer = csv.writer(response)
-        fields = self.export_fields or [field.name for field in self.queryset.model._meta.fields]
-        writer.writerow(fields)
-
-        for obj in queryset:
-            writer.writerow([getattr(obj, field, '') for field in fields])
-
-        return response
+        model = queryset.model
+        fields = self.export_fields or [field.name for field in model._meta.concrete_fields]
+
+        return streaming_csv_response(
+            queryset,
+            fields,
+            f'{model.__name__.lower()}s.csv',
+            compress=wants_gzip(request),
+        )
 
     @action(detail=True, methods=['get'], url_path='export')
     def export_single(self, request, pk=None):
@@ -55,11 +81,12 @@ class ExportMixin:
         response['Content-Disposition'] = f'attachment; filename="{model_name}_{obj.pk}.json"'
         return response
 
-class CompanyViewSet(viewsets.ModelViewSet):
+class CompanyViewSet(EagerLoadingMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     parser_classes = [JSONParser]
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'list': 4, 'retrieve': 12, 'export_single': 11}
     # export_fields = ['id', 'name', 'website', 'country', 'industry_category',
     #                  'activity_level', 'acquired_via', 'lead_score', 'notes']
     # parser_classes = [MultiPartParser]
@@ -68,13 +95,16 @@ class CompanyViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        if Company.objects.filter(name__iexact=request.data.get('name')).exists():
+        try:
+            with transaction.atomic():
+                self.perform_create(serializer)
+        except IntegrityError:
+            # lost a race with a concurrent create, the unique index caught it
             return Response(
                 {"error": "Company with this name already exists"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(
             serializer.data,
@@ -82,11 +112,51 @@ class CompanyViewSet(viewsets.ModelViewSet):
             headers=headers
         )
     
+    eager_loading_actions = ('list', 'retrieve', 'export_single')
+
     def get_serializer_class(self):
-        if self.action == 'retrieve':
+        if self.action in ('retrieve', 'export_single'):
             return CompanyDetailSerializer
         return CompanySerializer
-    
+
+    def get_detail_version(self, queryset, lookup):
+        version = super().get_detail_version(queryset, lookup)
+        if version is None:
+            return None
+        token, last_modified = version
+        return f'{company_cache.get_version(lookup)}:{token}', last_modified
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serves the detail document from the cache when it's current.
+        Nested rows bump the company's version through signals, which also
+        feeds the ETag.
+        """
+        company_id = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        version = self.get_detail_version(self.filter_queryset(self.get_queryset()), company_id)
+        return self.conditional_response(
+            request, version, lambda: self.cached_detail_response(request, company_id)
+        )
+
+    def cached_detail_response(self, request, company_id):
+        selection = requested_fields(request)
+        variant = request.get_host()
+        if selection is not None:
+            fields, omit = selection
+            variant += f"|{','.join(sorted(fields or []))}|{','.join(sorted(omit))}"
+        data, version = company_cache.get_document(company_id, variant)
+        if data is not None:
+            return Response(data)
+
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        company_cache.set_document(instance.pk, version, data, variant)
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsAuthenticated, IsAdminUser])
+    def cache_stats(self, request):
+        return Response(company_cache.stats())
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -102,20 +172,14 @@ class CompanyViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'], url_path='export')
     def export_all(self, request):
-        queryset = self.get_queryset()
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="companies.csv"'
-
-        writer = csv.writer(response)
         fields = ['id', 'name', 'website', 'country', 'industry_category',
                 'activity_level', 'acquired_via', 'lead_score', 'notes']
-        writer.writerow(fields)
-
-        for company in queryset:
-            writer.writerow([getattr(company, field) for field in fields])
-
-        return response
+        return streaming_csv_response(
+            self.get_queryset(),
+            fields,
+            'companies.csv',
+            compress=wants_gzip(request),
+        )
     
     @action(detail=True, methods=['get'], url_path='export')
     def export_single(self, request, pk=None):
@@ -129,8 +193,7 @@ class CompanyViewSet(viewsets.ModelViewSet):
 
 
 class CompanyCSVUploadView(APIView):
-    parser_classes = [JSONParser]
-    # parser_classes = [MultiPartParser]
+    parser_classes = [MultiPartParser, JSONParser]
 
     def get(self, request, *args, **kwargs):
         return Response({"message": "Upload endpoint is live!"})
@@ -144,45 +207,143 @@ class CompanyCSVUploadView(APIView):
             return Response({'error': 'File is not a CSV.'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            decoded_file = csv_file.read().decode('utf-8')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.DictReader(io_string)
-
-            created_count = 0
-            errors = []
-
-            for idx, row in enumerate(reader, start=1):
-                try:
-                    company, created = Company.objects.get_or_create(
-                        name=row['name'],
-                        defaults={
-                            'website': row.get('website', ''),
-                            'country': row['country'],
-                            'industry_category': int(row['industry_category']),
-                            'activity_level': row['activity_level'],
-                            'acquired_via': row['acquired_via'],
-                            'lead_score': int(row['lead_score']),
-                            'notes': row.get('notes', ''),
-                        }
-                    )
-                    if created:
-                        created_count += 1
-                except Exception as e:
-                    errors.append({'row': idx, 'error': str(e)})
+            result = import_companies(csv_file)
 
             return Response({
-                'created': created_count,
-                'errors': errors
+                'created': result.created,
+                'errors': result.errors
             }, status=status.HTTP_201_CREATED)
 
         except Exception as e:
             return Response({'error': f'Failed to process CSV: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-class ContactViewSet(viewsets.ModelViewSet, ExportMixin):
+class CompanyImportJobView(APIView):
+    """
+    Queues a company CSV for background import and returns right away.
+    Poll the job URL for progress.
+    """
+    parser_classes = [MultiPartParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        csv_file = request.FILES.get('file')
+        if not csv_file:
+            return Response({'error': 'No file provided.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not csv_file.name.endswith('.csv'):
+            return Response({'error': 'File is not a CSV.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = enqueue_import(csv_file, request.user)
+        return Response({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': request.build_absolute_uri(f'{job.id}/'),
+        }, status=status.HTTP_202_ACCEPTED)
+
+class ImportJobDetailView(SparseFieldsViewMixin, generics.RetrieveAPIView):
+    parser_classes = [JSONParser]
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return ImportJob.objects.all()
+        return ImportJob.objects.filter(created_by=self.request.user)
+
+class UploadSessionView(APIView):
+    """
+    Starts a resumable upload. Send the bytes with PUT to the session URL
+    (Upload-Offset header, optional X-Chunk-SHA256), then POST to
+    complete/. Body: target, object_id, filename, size, optional sha256.
+    """
+    parser_classes = [JSONParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = UploadSessionSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            session = chunked_uploads.start_session(
+                request.user, data['target'], data['object_id'], data['filename'], data['size'], data.get('sha256', '')
+            )
+        except UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return Response({
+            **UploadSessionSerializer(session).data,
+            'max_chunk_size': chunked_uploads.max_chunk_size(),
+            'upload_url': request.build_absolute_uri(f'{session.pk}/'),
+        }, status=status.HTTP_201_CREATED)
+
+class UploadSessionDetailView(APIView):
+    """GET reports the offset to resume from, PUT appends a chunk, DELETE aborts"""
+    parser_classes = []
+    permission_classes = [IsAuthenticated]
+
+    def get_session(self, request, pk):
+        return UploadSession.objects.filter(pk=pk, created_by=request.user).first()
+
+    def get(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({'error': 'Upload not found.'}, status=status.HTTP_404_NOT_FOUND)
+        response = Response(UploadSessionSerializer(session).data)
+        response['Upload-Offset'] = str(session.received)
+        return response
+
+    def put(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({'error': 'Upload not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return Response({'error': 'Upload-Offset and Content-Length headers are required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            received = chunked_uploads.write_chunk(
+                session, offset, request._request, length, request.headers.get('X-Chunk-SHA256')
+            )
+        except UploadError as e:
+            response = Response({'error': str(e), 'offset': session.received}, status=e.status)
+            response['Upload-Offset'] = str(session.received)
+            return response
+        response = Response({'offset': received, 'size': session.size})
+        response['Upload-Offset'] = str(received)
+        return response
+
+    def delete(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({'error': 'Upload not found.'}, status=status.HTTP_404_NOT_FOUND)
+        chunked_uploads.abort(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadSessionCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        session = UploadSession.objects.filter(pk=pk, created_by=request.user).first()
+        if session is None:
+            return Response({'error': 'Upload not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            instance = chunked_uploads.complete(session)
+        except UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return Response({
+            'id': instance.pk,
+            'target': session.target,
+            'object_id': session.object_id,
+            'status': 'completed',
+        }, status=status.HTTP_201_CREATED)
+
+class ContactViewSet(BulkMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet, ExportMixin):
     parser_classes = [JSONParser]
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'list': 4, 'retrieve': 4}
     renderer_classes = [JSONRenderer]
     export_fields = ['id', 'full_name', 'position', 'company_email', 'phone_office']
 
@@ -206,7 +367,7 @@ class ContactViewSet(viewsets.ModelViewSet, ExportMixin):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
-class ContactDocumentViewSet(viewsets.ModelViewSet):
+class ContactDocumentViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     parser_classes = [JSONParser]
     serializer_class = ContactDocumentSerializer
     permission_classes = [IsAuthenticated]
@@ -221,15 +382,43 @@ class ContactDocumentViewSet(viewsets.ModelViewSet):
         contact = Contact.objects.get(pk=self.kwargs['contact_pk'])
         serializer.save(contact=contact)
 
-class OpportunityViewSet(viewsets.ModelViewSet, ExportMixin):
+class OpportunityViewSet(BulkMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet, ExportMixin):
     parser_classes = [JSONParser]
     queryset = Opportunity.objects.all()
     serializer_class = OpportunitySerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'list': 4, 'retrieve': 4, 'pipeline': 6}
     renderer_classes = [JSONRenderer]
     export_fields = ['id', 'company_id', 'stage', 'expected_value', 'probability']
-     
-class InteractionDocumentViewSet(viewsets.ModelViewSet):
+
+    @action(detail=False, methods=['get'])
+    def pipeline(self, request):
+        """
+        Pipeline totals (count, expected value, probability-weighted value)
+        by stage, expected close month and company industry, read from the
+        maintained rollup rows. Optional ?company=, ?date_from= and
+        ?date_to= (YYYY-MM-DD or YYYY-MM).
+        """
+        try:
+            company_id = int(request.query_params['company']) if request.query_params.get('company') else None
+            date_from = parse_month_or_date(request.query_params.get('date_from'))
+            date_to = parse_month_or_date(request.query_params.get('date_to'))
+        except ValueError:
+            return Response(
+                {'error': 'company must be an integer and dates YYYY-MM-DD or YYYY-MM.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(pipeline.pipeline(company_id=company_id, date_from=date_from, date_to=date_to))
+
+
+def parse_month_or_date(value):
+    if not value:
+        return None
+    if len(value) == 7:
+        value = f'{value}-01'
+    return date.fromisoformat(value)
+
+class InteractionDocumentViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     parser_classes = [JSONParser]
     serializer_class = InteractionDocumentSerializer
     permission_classes = [IsAuthenticated]
@@ -272,44 +461,45 @@ class InteractionDocumentViewSet(viewsets.ModelViewSet):
         serializer.save(interaction=interaction)
 
 
-class ProductViewSet(viewsets.ModelViewSet, ExportMixin):
+class ProductViewSet(BulkMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet, ExportMixin):
     parser_classes = [JSONParser]
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'list': 4, 'retrieve': 4}
     renderer_classes = [JSONRenderer]
     export_fields = ['id', 'company_id', 'category', 'volume_offered', 'currency', 'target_price']
 
-class InteractionViewSet(viewsets.ModelViewSet, ExportMixin):
+class InteractionViewSet(BulkMixin, EagerLoadingMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet, ExportMixin):
     parser_classes = [JSONParser]
     queryset = Interaction.objects.all()
     serializer_class = InteractionSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'list': 5, 'retrieve': 5}
     renderer_classes = [JSONRenderer]
     export_fields = ['id', 'company_id', 'contact_id', 'date', 'type', 'status']
+    pagination_ordering = ('-date', '-id')
 
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(EagerLoadingMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     parser_classes = [JSONParser]
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'list': 4, 'retrieve': 4, 'my_tasks': 3, 'dashboard': 4}
     renderer_classes = [JSONRenderer]
+    # due_date is nullable, which a cursor can't page over
+    pagination_ordering = ('-created_at', '-id')
+    eager_loading_actions = ('list', 'retrieve', 'my_tasks')
     # export_fields = ['id', 'title', 'status', 'priority', 'due_date', 'assigned_to_id', 'created_by_id']
     @action(detail=False, methods=['get'], url_path='export')
     def export_all(self, request):
-        queryset = self.get_queryset()
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="tasks.csv"'
-
-        writer = csv.writer(response)
         fields = ['id', 'title', 'status', 'priority', 'due_date', 'assigned_to_id', 'created_by_id']
-        writer.writerow(fields)
-
-        for task in queryset:
-            writer.writerow([getattr(task, field) for field in fields])
-
-        return response
+        return streaming_csv_response(
+            self.get_queryset(),
+            fields,
+            'tasks.csv',
+            compress=wants_gzip(request),
+        )
 
     
     @action(detail=True, methods=['get'], url_path='export')
@@ -362,33 +552,21 @@ class TaskViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def dashboard(self, request):
         parser_classes = [JSONParser]
-        """Task summary for dashboard"""
-        queryset = self.filter_queryset(self.get_queryset())
+        """
+        Task summary for dashboard.
+        Staff asking for the whole table get it from the maintained summary
+        rows; anything filtered is counted in a single aggregate query.
+        """
+        now = timezone.now()
         user = request.user
-        
-        data = {
-            'total': queryset.count(),
-            'open': queryset.filter(status='open').count(),
-            'in_progress': queryset.filter(status='in_progress').count(),
-            'closed': queryset.filter(status='closed').count(),
-            'high_priority': queryset.filter(priority='high').count(),
-            'due_soon': queryset.filter(
-                due_date__gte=timezone.now(),
-                due_date__lte=timezone.now() + timedelta(days=3)
-            ).count(),
-            'overdue': queryset.filter(
-                due_date__lt=timezone.now(),
-                status__in=['open', 'in_progress']
-            ).count(),
-            'user_stats': {
-                'assigned_tasks': queryset.filter(assigned_to=user).count(),
-                'created_tasks': queryset.filter(created_by=user).count(),
-            }
-        }
-        
-        return Response(data)
+
+        if user.is_staff and not request.query_params:
+            return Response(task_summary.dashboard_from_summaries(user, now))
+
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(task_summary.dashboard_from_queryset(queryset, user, now))
     
-class InteractionDocumentViewSet(viewsets.ModelViewSet):
+class InteractionDocumentViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     parser_classes = [JSONParser]
     serializer_class = InteractionDocumentSerializer
     permission_classes = [IsAuthenticated]
@@ -403,20 +581,24 @@ class InteractionDocumentViewSet(viewsets.ModelViewSet):
         interaction = Interaction.objects.get(pk=self.kwargs['interaction_pk'])
         serializer.save(interaction=interaction)
 
-class MeetingViewSet(viewsets.ModelViewSet, ExportMixin):
+class MeetingViewSet(EagerLoadingMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet, ExportMixin):
     queryset = Meeting.objects.all()
     serializer_class = MeetingSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'list': 5, 'retrieve': 5}
     export_fields = ['id', 'company_id', 'user_ids', 'date']
+    version_counts_rows = True
 
     def get_queryset(self):
         """Users can only see meetings they're attending"""
         return self.request.user.meetings.all()
 
-class UnreadNotificationsView(generics.ListAPIView):
+class UnreadNotificationsView(NotificationVersionMixin, SparseFieldsViewMixin, generics.ListAPIView):
     parser_classes = [JSONParser]
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = 4
+    pagination_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         return Notification.objects.filter(
@@ -430,24 +612,100 @@ class MarkNotificationsReadView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        updated = Notification.objects.filter(
-            user=request.user,
-            seen=False
-        ).update(seen=True)
+        with transaction.atomic():
+            updated = Notification.objects.filter(
+                user=request.user,
+                seen=False
+            ).update(seen=True)
+            notification_counts.reset(request.user.pk)
         
         return Response({
             'status': 'success',
             'marked_read': updated
         })
     
-class AllNotificationsView(generics.ListAPIView):
+def media_blob(request, digest, filename):
+    """Serves a content-addressed media URL from its blob (DEBUG only), typed by the filename"""
+    response = serve(request, blob_name(digest), document_root=settings.MEDIA_ROOT)
+    content_type = mimetypes.guess_type(filename)[0]
+    if content_type and response.status_code == 200:
+        response['Content-Type'] = content_type
+    return response
+
+
+class MetricsView(APIView):
+    """Request metrics of this process in the Prometheus text format, for admins"""
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class UnreadNotificationCountView(APIView):
+    """Badge count from the per-user counter, without touching the notifications table"""
+    permission_classes = [IsAuthenticated]
+    # a cold call loads the user once to cache its token version, and counts the badge once
+    query_budget = 6
+    # polled by every open client; only needs the user id from the token
+    trust_token_claims = True
+
+    def get(self, request):
+        return Response({'unread': notification_counts.unread_count(request.user.pk)})
+
+class ArchivedNotificationsView(APIView):
+    """Notifications moved to the archive by prune_notifications, newest first"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 500)
+        except ValueError:
+            return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        before = request.query_params.get('before')
+        before = parse_datetime(before) if before else None
+        rows = notification_retention.archived_notifications(request.user.pk, limit=limit, before=before)
+        return Response({'results': rows})
+
+class AllNotificationsView(NotificationVersionMixin, SparseFieldsViewMixin, generics.ListAPIView):
     parser_classes = [JSONParser]
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = 4
+    pagination_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         return Notification.objects.filter(user=self.request.user).order_by('-created_at')
 
+class SearchView(APIView):
+    """
+    Ranked full-text search across companies, contacts and interactions.
+    ?q=<text>&type=company,contact&page=1&page_size=20
+    """
+    parser_classes = [JSONParser]
+    permission_classes = [IsAuthenticated]
+    max_page_size = 100
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'The q parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', 20)), 1), self.max_page_size)
+        except ValueError:
+            return Response({'error': 'page and page_size must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        kinds = request.query_params.get('type')
+        kinds = kinds.split(',') if kinds else None
+
+        # one extra row tells us whether there is a next page without a COUNT
+        results = search.search(query, kinds=kinds, limit=page_size + 1, offset=(page - 1) * page_size)
+        return Response({
+            'page': page,
+            'has_next': len(results) > page_size,
+            'results': results[:page_size],
+        })
+
 class CompanyFileViewSet(viewsets.ViewSet):
     parser_classes = [MultiPartParser]
     permission_classes = [IsAuthenticated]
@@ -480,7 +738,8 @@ class CompanyFileViewSet(viewsets.ViewSet):
                                status=status.HTTP_404_NOT_FOUND)
             
             file_url = request.build_absolute_uri(getattr(company, field_name).url)
-            return Response({'url': file_url})
+            download_url = request.build_absolute_uri('download/')
+            return Response({'url': file_url, 'download_url': download_url})
 
         elif request.method == 'POST':
             file = request.FILES.get('file')
@@ -488,11 +747,7 @@ class CompanyFileViewSet(viewsets.ViewSet):
                 return Response({'error': 'No file provided'}, 
                               status=status.HTTP_400_BAD_REQUEST)
             
-            # Delete old file if exists
-            old_file = getattr(company, field_name)
-            if old_file:
-                old_file.delete(save=False)
-            
+            # the old file is released by gwm_crm.signals once the save commits
             setattr(company, field_name, file)
             company.save()
             
@@ -505,8 +760,172 @@ class CompanyFileViewSet(viewsets.ViewSet):
                 return Response({'error': f'No {field_name.replace("_", " ")} found'}, 
                                status=status.HTTP_404_NOT_FOUND)
             
-            file.delete(save=False)
             setattr(company, field_name, None)
             company.save()
             
-            return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PassthroughRenderer(BaseRenderer):
+    """Lets file downloads through content negotiation whatever the Accept header says"""
+    media_type = '*/*'
+    format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+class CompanyFileDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [PassthroughRenderer, JSONRenderer]
+    fields = {'business_card', 'catalogs', 'signed_contracts', 'correspondence'}
+
+    def get(self, request, pk, field):
+        field_name = field.replace('-', '_')
+        if field_name not in self.fields:
+            return Response({'error': 'Unknown file field'}, status=status.HTTP_404_NOT_FOUND)
+        company = Company.objects.filter(pk=pk).only('id', field_name).first()
+        if company is None:
+            return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
+        file = getattr(company, field_name)
+        if not file:
+            return Response({'error': f'No {field_name.replace("_", " ")} found'}, status=status.HTTP_404_NOT_FOUND)
+        return file_response(request, file)
+
+class DocumentDownloadView(APIView):
+    """Download of a ContactDocument or InteractionDocument, selected by ``model``"""
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [PassthroughRenderer, JSONRenderer]
+    model = None
+    parent_kwarg = None
+
+    def get(self, request, pk, **kwargs):
+        parent_field = self.parent_kwarg.replace('_pk', '_id')
+        document = self.model.objects.filter(pk=pk, **{parent_field: kwargs[self.parent_kwarg]}).first()
+        if document is None or not document.file:
+            return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+        return file_response(request, document.file, filename=os.path.basename(document.name or document.file.name))
+
+
+STREAM_BATCH_SIZE = 100
+
+
+class NotificationStreamTicketView(APIView):
+    """
+    Trades the caller's access token for a single-use ?ticket= to open the
+    notification stream with (see services.stream_tickets).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        expires_at = request.auth.get('exp') if request.auth is not None else None
+        if expires_at is None:
+            expires_at = time.time() + jwt_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+        return Response(
+            {'ticket': stream_tickets.issue(request.user.pk, expires_at), 'expires_in': stream_tickets.lifetime()},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+async def _stream_user(request):
+    """
+    Authenticates a stream request from the Authorization header, or from
+    a ?ticket= issued by NotificationStreamTicketView since EventSource
+    can't send headers. Returns (user, expires_at).
+    """
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        authentication = CachedJWTAuthentication()
+        try:
+            token = authentication.get_validated_token(header[7:])
+            user = await sync_to_async(authentication.get_user)(token)
+        except (InvalidToken, AuthenticationFailed):
+            return None, None
+        return user, token['exp']
+
+    redeemed = stream_tickets.redeem(request.GET.get('ticket', ''))
+    if redeemed is None:
+        return None, None
+    user_id, expires_at = redeemed
+    user = await User.objects.filter(pk=user_id, is_active=True).afirst()
+    return user, expires_at
+
+
+def _sse_event(notification):
+    data = json.dumps(NotificationSerializer(notification).data)
+    return f"id: {notification.pk}\nevent: notification\ndata: {data}\n\n"
+
+
+async def _pending_events(user_id, last_id):
+    rows = Notification.objects.filter(user_id=user_id, id__gt=last_id).order_by('id')[:STREAM_BATCH_SIZE]
+    return [notification async for notification in rows]
+
+
+async def _notification_events(user_id, last_id, expires_at):
+    """
+    Sends notifications newer than last_id as they're published to the
+    hub, with a comment line as heartbeat and a database poll every
+    NOTIFICATION_STREAM_POLL_SECONDS for rows created in other processes.
+    Ends when the access token expires so the client reconnects with a
+    fresh one.
+    """
+    heartbeat = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT_SECONDS', 15)
+    poll_every = getattr(settings, 'NOTIFICATION_STREAM_POLL_SECONDS', 30)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(expires_at - time.time(), 0)
+    subscriber = hub.subscribe(user_id)
+    _, queue = subscriber
+    try:
+        yield "retry: 3000\n\n"
+        check = True
+        last_poll = loop.time()
+        while loop.time() < deadline:
+            if check:
+                rows = await _pending_events(user_id, last_id)
+                for notification in rows:
+                    last_id = notification.pk
+                    yield _sse_event(notification)
+                last_poll = loop.time()
+                if len(rows) == STREAM_BATCH_SIZE:
+                    continue
+            try:
+                await asyncio.wait_for(queue.get(), timeout=min(heartbeat, max(deadline - loop.time(), 0)))
+                check = True
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                check = loop.time() - last_poll >= poll_every
+    finally:
+        hub.unsubscribe(user_id, subscriber)
+
+
+async def notification_stream(request):
+    """
+    Server-Sent Events stream of the user's new notifications. Resumes
+    after the Last-Event-ID header (or ?last_event_id=); a fresh
+    connection starts from the newest notification. Needs an ASGI server
+    to hold the connection open; under WSGI it returns what's pending and
+    the client's reconnect turns it into polling.
+    """
+    user, expires_at = await _stream_user(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({'error': 'Last-Event-ID must be an integer.'}, status=400)
+    if last_id is None:
+        newest = await Notification.objects.filter(user_id=user.pk).order_by('-id').values_list('id', flat=True).afirst()
+        last_id = newest or 0
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            _notification_events(user.pk, last_id, expires_at),
+            content_type='text/event-stream'
+        )
+    else:
+        events = [_sse_event(notification) for notification in await _pending_events(user.pk, last_id)]
+        response = HttpResponse("retry: 3000\n\n" + ''.join(events), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response